@@ -0,0 +1,1947 @@
+"""
+This script benchmarks the inventory collectors against a stubbed AWS that
+answers every call after an injected latency, so no credentials or network
+access are needed
+"""
+import argparse
+import asyncio
+import datetime
+import functools
+import hashlib
+import http.client
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import boto3
+import botocore
+import botocore.client
+import botocore.exceptions
+import botocore.session
+
+import client_pool
+import collection_filters
+import columnar_export
+import fetch_inventory
+import get_inventory
+import inventory_daemon
+import inventory_model
+import inventory_store
+import inventory_stream
+import mock_aws
+import rate_limiter
+import response_cache
+import serializers
+import org_inventory
+import price_table
+import recommendation_engine
+import recommendation_report
+import relationship_index
+import reservation_matcher
+import resource_collectors
+
+# Regions returned by the stubbed describe_regions call
+STUB_REGIONS = [
+    "us-east-1", "us-east-2", "us-west-1", "us-west-2", "ap-south-1",
+    "ap-northeast-1", "ap-northeast-2", "ap-northeast-3", "ap-southeast-1",
+    "ap-southeast-2", "ca-central-1", "eu-central-1", "eu-west-1",
+    "eu-west-2", "eu-west-3", "eu-north-1", "sa-east-1"
+]
+
+# Modules the startup benchmark imports in a fresh interpreter: the entry
+# points and the helpers used as a library
+STARTUP_MODULES = (
+    "fetch_inventory",
+    "get_inventory",
+    "org_inventory",
+    "inventory_daemon",
+    "resource_collectors",
+    "inventory_stream"
+)
+
+# Modules importing any of the STARTUP_MODULES must not load, they are imported when first used
+LAZY_MODULES = ("boto3", "botocore", "pandas", "numpy", "pyarrow")
+
+# Page sizes of the stubbed paginated operations
+STUB_PAGE_SIZES = {
+    "describe_instances": 1000,
+    "describe_load_balancers": 400,
+    "describe_auto_scaling_groups": 100
+}
+
+@functools.lru_cache(maxsize=None)
+def stub_service_model(service):
+    """
+    Returns the botocore ServiceModel of a service, which the stub clients
+    expose like the clients of boto3 do
+    """
+    return botocore.session.get_session().get_service_model(service)
+
+class StubMeta(object):
+    """
+    Stands in for the meta of a boto3 client, with the service model and the
+    method names of the operations inventory_stream reads the paginators by
+    """
+
+    def __init__(self, service, region):
+        self.region_name = region
+        self.service_model = stub_service_model(service)
+        self.method_to_api_mapping = {
+            botocore.xform_name(operation_name): operation_name
+            for operation_name in self.service_model.operation_names
+        }
+
+class StubClient(object):
+    """
+    Stands in for a boto3 client of any collected service, sleeping for the
+    configured latency on every call. The paginated operations generate every
+    page only when it is requested, with the pagination tokens of the real ones
+    """
+
+    def __init__(self, service, region, latency, instance_count=10, account_id="123456789012"):
+        self.service = service
+        self.region = region
+        self.latency = latency
+        self.instance_count = instance_count
+        self.account_id = account_id
+        self.meta = StubMeta(service, region)
+
+    def _call(self, response):
+        time.sleep(self.latency)
+        return response
+
+    def can_paginate(self, operation_name):
+        return operation_name in STUB_PAGE_SIZES
+
+    def stub_page(self, operation_name, number):
+        """
+        Returns page number of a paginated operation and whether more pages follow it
+        """
+        if operation_name == "describe_instances":
+            page_size = STUB_PAGE_SIZES[operation_name]
+            start = number * page_size
+            instances = [
+                {
+                    "InstanceId": "i-%s-%d" % (self.region, index),
+                    "InstanceType": "t3.large",
+                    "LaunchTime": datetime.datetime(2019, 10, 21, 12, 32, 41)
+                }
+                for index in range(start, min(start + page_size, self.instance_count))
+            ]
+            return {"Reservations": [{"Instances": instances}]}, start + page_size < self.instance_count
+        if operation_name == "describe_load_balancers" and self.service == "elb":
+            return {"LoadBalancerDescriptions": []}, False
+        if operation_name == "describe_load_balancers":
+            return {"LoadBalancers": []}, False
+        return {"AutoScalingGroups": []}, False
+
+    def paginated_call(self, operation_name, input_token, output_token, parameters):
+        number = int(parameters.get(input_token) or 0)
+        page, more = self.stub_page(operation_name, number)
+        if more:
+            page[output_token] = str(number + 1)
+        return self._call(page)
+
+    def describe_instances(self, **kwargs):
+        return self.paginated_call("describe_instances", "NextToken", "NextToken", kwargs)
+
+    def describe_load_balancers(self, **kwargs):
+        return self.paginated_call("describe_load_balancers", "Marker", "NextMarker", kwargs)
+
+    def describe_auto_scaling_groups(self, **kwargs):
+        return self.paginated_call("describe_auto_scaling_groups", "NextToken", "NextToken", kwargs)
+
+    def get_caller_identity(self):
+        return self._call({"Account": self.account_id})
+
+    def assume_role(self, RoleArn, RoleSessionName, **kwargs):
+        account_id = RoleArn.split(":")[4]
+        return self._call({"Credentials": {
+            "AccessKeyId": "stub-" + account_id,
+            "SecretAccessKey": "stub",
+            "SessionToken": "stub"
+        }})
+
+    def describe_regions(self):
+        return self._call({"Regions": [{"RegionName": name} for name in STUB_REGIONS]})
+
+    def describe_reserved_instances(self):
+        return self._call({"ReservedInstances": []})
+
+class StubSession(object):
+    """
+    Stands in for boto3.session.Session and hands out StubClients
+    """
+
+    latency = 0.0
+    instance_count = 10
+    region_name = "us-west-2"
+
+    def __init__(self, aws_access_key_id=None, **kwargs):
+        # Sessions of an assumed role belong to the account in the stub key
+        self.account_id = "123456789012"
+        if aws_access_key_id and aws_access_key_id.startswith("stub-"):
+            self.account_id = aws_access_key_id[len("stub-"):]
+
+    def client(self, service, region_name=None, **kwargs):
+        return StubClient(service, region_name, self.latency, self.instance_count, self.account_id)
+
+def benchmark_target_health(load_balancer_count, target_group_count, latency, max_workers):
+    """
+    Refreshes a RelationshipIndex of a synthetic region holding the given
+    number of v2 load balancers and target groups, from an empty index and
+    from the refreshed one, and prints the describe_target_groups and
+    describe_target_health calls and the time of every refresh
+    Parameters :
+    load_balancer_count - number of v2 load balancers in the region
+    target_group_count - number of target groups spread over the load balancers
+    latency - seconds every call to the fleet takes
+    max_workers - number of describe_target_health calls in flight at the same time
+    """
+    fleet = mock_aws.SyntheticFleet(
+        region_count=1,
+        instance_count=target_group_count * 2,
+        load_balancer_count=0,
+        v2_load_balancer_count=load_balancer_count,
+        target_group_count=target_group_count,
+        autoscaling_group_count=0,
+        latency=latency
+    )
+    with fleet.serve():
+        elbv2 = client_pool.ClientPool().client("elbv2", fleet.regions[0])
+        v2_load_balancers = list(inventory_stream.iter_records(elbv2, "describe_load_balancers", "LoadBalancers"))
+        index = relationship_index.RelationshipIndex()
+        for name in ("empty index", "refreshed index"):
+            calls = dict(fleet.calls)
+            start = time.perf_counter()
+            index.refresh(elbv2, [], v2_load_balancers, [], max_workers=max_workers)
+            elapsed = time.perf_counter() - start
+            made = {
+                operation_name: fleet.calls.get(("elastic-load-balancing-v2", operation_name), 0) -
+                calls.get(("elastic-load-balancing-v2", operation_name), 0)
+                for operation_name in ("DescribeTargetGroups", "DescribeTargetHealth")
+            }
+            print("  {}: {:.2f}s, {} describe_target_groups, {} describe_target_health calls, {:.1f} ms per target "
+                  "group".format(
+                      name,
+                      elapsed,
+                      made["DescribeTargetGroups"],
+                      made["DescribeTargetHealth"],
+                      elapsed * 1000.0 / target_group_count
+                  ))
+            if name == "empty index":
+                assert made["DescribeTargetHealth"] == target_group_count, made
+            else:
+                assert made["DescribeTargetHealth"] == 0, made
+    instance_map = index.instance_to_load_balancers_map()
+    assert len(instance_map) == fleet.instance_count, len(instance_map)
+
+def benchmark_streaming(instance_count):
+    """
+    Collects a single stubbed region holding instance_count instances, checks
+    that every instance made it into instances.json and prints the peak memory
+    Parameters :
+    instance_count - number of instances in the stubbed region
+    """
+    StubSession.latency = 0.0
+    StubSession.instance_count = instance_count
+    working_directory = os.getcwd()
+    output_directory = tempfile.mkdtemp()
+    try:
+        os.chdir(output_directory)
+        os.mkdir("inventory")
+        with mock.patch.object(boto3.session, "Session", StubSession):
+            tracemalloc.start()
+            start = time.perf_counter()
+            fetch_inventory.get_aws_data_for_region("us-west-2")
+            elapsed = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        with open("inventory/instances.json") as instances_file:
+            reservations = json.load(instances_file)["instances"]
+        collected = sum(len(reservation["Instances"]) for reservation in reservations)
+        assert collected == instance_count, collected
+        print("  {} instances in {:.2f}s, peak traced memory {:.1f} MB, max RSS {:.1f} MB".format(
+            collected,
+            elapsed,
+            peak / 1024.0 / 1024.0,
+            max_rss / 1024.0
+        ))
+    finally:
+        StubSession.instance_count = 10
+        os.chdir(working_directory)
+        shutil.rmtree(output_directory)
+
+def synthetic_raw_instance(region, index):
+    """
+    Returns a synthetic instance annotated by the collectors the way they
+    annotate instances in place
+    Parameters :
+    region - AWS region of the instance
+    index - number of the instance within the fleet
+    """
+    instance = mock_aws.synthetic_instance(region, index, "%s-asg-%d" % (region, index % 200))
+    instance["spot"] = False
+    instance["LoadBalancerName"] = ["%s-lb-%d" % (region, index % 100)]
+    return instance
+
+def iter_synthetic_reservations(instance_count):
+    """
+    Yields reservations of synthetic_raw_instances spread evenly over the stubbed regions
+    as (account_id, region, reservation) tuples
+    Parameters :
+    instance_count - number of instances over all regions
+    """
+    per_region = -(-instance_count // len(STUB_REGIONS))
+    for region_index, region in enumerate(STUB_REGIONS):
+        start = region_index * per_region
+        for index in range(start, min(start + per_region, instance_count)):
+            yield "123456789012", region, {
+                "ReservationId": "r-%017x" % index,
+                "OwnerId": "123456789012",
+                "Groups": [],
+                "Instances": [synthetic_raw_instance(region, index)]
+            }
+
+def benchmark_instance_model(instance_count, raw_limit=50000):
+    """
+    Prints the memory held for the instances of a multi-region run when the
+    raw annotated reservations are kept, as the collectors used to, and when
+    they are converted to InstanceRecords as they stream. The raw dictionaries
+    are measured on at most raw_limit instances and scaled up
+    Parameters :
+    instance_count - number of instances over all stubbed regions
+    raw_limit - largest number of instances whose raw dictionaries are kept
+    """
+    raw_count = min(instance_count, raw_limit)
+    tracemalloc.start()
+    reservations = [reservation for _, _, reservation in iter_synthetic_reservations(raw_count)]
+    raw_bytes = tracemalloc.get_traced_memory()[1] * float(instance_count) / raw_count
+    tracemalloc.stop()
+    del reservations
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    instance_records = []
+    for account_id, region, reservation in iter_synthetic_reservations(instance_count):
+        for _ in inventory_model.track_instance_records([reservation], account_id, region, instance_records):
+            pass
+    elapsed = time.perf_counter() - start
+    model_bytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    assert len(instance_records) == instance_count, len(instance_records)
+    expected = synthetic_raw_instance(STUB_REGIONS[0], 0)
+    assert instance_records[0].instance_id == expected["InstanceId"]
+    assert instance_records[0].load_balancer_names == tuple(expected["LoadBalancerName"])
+    assert instance_records[0].autoscaling_group == expected["Tags"][-1]["Value"]
+    print("  raw dictionaries: {:.1f} MB{}".format(
+        raw_bytes / 1024.0 / 1024.0,
+        " (scaled from {} instances)".format(raw_count) if raw_count < instance_count else ""
+    ))
+    print("  InstanceRecords: {:.1f} MB peak, converted in {:.2f}s".format(
+        model_bytes / 1024.0 / 1024.0,
+        elapsed
+    ))
+    print("  reduction: {:.1f}x".format(raw_bytes / model_bytes))
+
+def legacy_converter(value):
+    """
+    Default the collectors passed to json.dumps before the serializer backends,
+    turning datetimes into text and everything else into null
+    """
+    if isinstance(value, datetime.datetime):
+        return value.__str__()
+
+def benchmark_serializers(instance_count, check_count=1000):
+    """
+    Prints the throughput of writing the instances file of instance_count
+    synthetic instances with json.dumps and the legacy default and with every
+    installed serializer backend, and checks that the timestamps written by
+    every backend read back to the datetimes that were written
+    Parameters :
+    instance_count - number of instances of the payload
+    check_count - number of leading records compared across backends
+    """
+    reservations = [reservation for _, _, reservation in iter_synthetic_reservations(instance_count)]
+    before = [("account_id", "123456789012"), ("region", STUB_REGIONS[0])]
+    output_directory = tempfile.mkdtemp()
+    path = os.path.join(output_directory, "instances.json")
+
+    def legacy_write():
+        with open(path, "w", buffering=inventory_stream.WRITE_BUFFER_SIZE) as inventory_file:
+            inventory_file.write("{")
+            for key, value in before:
+                inventory_file.write(json.dumps(key) + ": " + json.dumps(value) + ", ")
+            inventory_file.write('"instances": [')
+            for index, reservation in enumerate(reservations):
+                if index:
+                    inventory_file.write(", ")
+                inventory_file.write(json.dumps(reservation, default=legacy_converter))
+            inventory_file.write("]}")
+
+    def backend_write(name):
+        with inventory_stream.open_inventory_file(path, "w+") as inventory_file:
+            inventory_stream.write_records(inventory_file, "json", "instances", reservations, before, serializer=name)
+
+    runs = [("json.dumps with the legacy default", legacy_write)]
+    for name in serializers.SERIALIZER_NAMES:
+        try:
+            serializers.get_serializer(name)
+        except RuntimeError as error:
+            print("  {}: skipped, {}".format(name, error))
+            continue
+        runs.append((name, lambda name=name: backend_write(name)))
+
+    expected_launch_time = reservations[0]["Instances"][0]["LaunchTime"]
+    reference = None
+    try:
+        for name, write in runs:
+            start = time.perf_counter()
+            write()
+            elapsed = time.perf_counter() - start
+            size = os.path.getsize(path)
+            print("  {}: {:.2f}s, {:.0f} instances/s, {:.1f} MB/s".format(
+                name,
+                elapsed,
+                instance_count / elapsed,
+                size / elapsed / 1024.0 / 1024.0
+            ))
+            records = inventory_stream.iter_inventory_records(path, "instances")
+            checked = [record for _, record in zip(range(check_count), records)]
+            assert len(checked) + sum(1 for _ in records) == instance_count, name
+            if name == runs[0][0]:
+                continue
+            launch_time = columnar_export.parse_timestamp(checked[0]["Instances"][0]["LaunchTime"])
+            assert launch_time == expected_launch_time, (name, launch_time)
+            if reference is None:
+                reference = checked
+            assert checked == reference, name
+    finally:
+        shutil.rmtree(output_directory)
+
+def benchmark_store(instance_count, run_count, lookups=10000):
+    """
+    Prints the time taken to load run_count runs of a synthetic inventory
+    into the inventory store and the latency of point lookups by instance id
+    and of the indexed queries over the accumulated history
+    Parameters :
+    instance_count - number of instances of every run
+    run_count - number of runs loaded, the store ends with their product as rows
+    lookups - number of point lookups timed
+    """
+    instance_records = []
+    for account_id, region, reservation in iter_synthetic_reservations(instance_count):
+        for _ in inventory_model.track_instance_records([reservation], account_id, region, instance_records):
+            pass
+
+    store_directory = tempfile.mkdtemp()
+    try:
+        store = inventory_store.InventoryStore(os.path.join(store_directory, "inventory.sqlite"))
+        start = time.perf_counter()
+        for _ in range(run_count):
+            run_id = store.load(instance_records)
+        elapsed = time.perf_counter() - start
+        row_count = instance_count * run_count
+        print("  loaded {} rows in {:.1f}s ({:.0f} rows/s)".format(row_count, elapsed, row_count / elapsed))
+
+        step = max(1, instance_count // lookups)
+        instance_ids = [record.instance_id for record in instance_records[::step]]
+        start = time.perf_counter()
+        for instance_id in instance_ids:
+            record = store.instance(instance_id)
+        elapsed = time.perf_counter() - start
+        assert record == instance_records[(len(instance_ids) - 1) * step], record
+        print("  point lookup by instance id: {:.3f} ms".format(elapsed * 1000.0 / len(instance_ids)))
+
+        expected = instance_records[-1]
+        queries = (
+            ("instance type and region", {"instance_type": expected.instance_type, "region": expected.region}),
+            ("load balancer", {"load_balancer_name": expected.load_balancer_names[0]}),
+            ("auto scaling group", {"autoscaling_group": expected.autoscaling_group}),
+            ("account and lifecycle", {"account_id": expected.account_id, "lifecycle": expected.lifecycle,
+                                       "limit": 100})
+        )
+        for name, filters in queries:
+            start = time.perf_counter()
+            records = store.query(run_id=run_id, **filters)
+            elapsed = time.perf_counter() - start
+            for record in records:
+                for field, value in filters.items():
+                    if field == "load_balancer_name":
+                        assert value in record.load_balancer_names, (name, record)
+                    elif field != "limit":
+                        assert getattr(record, field) == value, (name, record)
+            assert records, name
+            print("  query by {}: {} instances in {:.2f} ms".format(name, len(records), elapsed * 1000.0))
+        store.close()
+    finally:
+        shutil.rmtree(store_directory)
+
+def synthetic_recommendation_inputs(instance_count, account_count=100, region_count=17, seed=0):
+    """
+    Returns (instances, reservations, prices) DataFrames of a synthetic fleet
+    in the shape recommendation_engine works on
+    Parameters :
+    instance_count - number of instances over all accounts and regions
+    account_count - number of accounts the instances are spread over
+    region_count - number of regions the instances are spread over
+    seed - seed of the random generator
+    """
+    import numpy
+    import pandas
+
+    random = numpy.random.default_rng(seed)
+    instance_types = numpy.array([
+        family + "." + size
+        for family in ("t2", "t3", "m5", "c5", "r5")
+        for size in ("micro", "small", "medium", "large", "xlarge", "2xlarge")
+    ])
+    accounts = numpy.array(["%012d" % index for index in range(account_count)])
+    regions = numpy.array(STUB_REGIONS[:region_count])
+    category = lambda values, size: pandas.Categorical(values[random.integers(0, len(values), size)])
+
+    instances = pandas.DataFrame({
+        "account_id": category(accounts, instance_count),
+        "region": category(regions, instance_count),
+        "instance_id": ["i-%017x" % index for index in range(instance_count)],
+        "instance_type": category(instance_types, instance_count),
+        "state": pandas.Categorical(numpy.where(random.random(instance_count) < 0.9, "running", "stopped")),
+        "spot": random.random(instance_count) < 0.2,
+        "tenancy": pandas.Categorical(numpy.full(instance_count, "default")),
+        "platform": pandas.Categorical(numpy.where(random.random(instance_count) < 0.9, "linux", "windows")),
+        "availability_zone": pandas.Categorical(numpy.full(instance_count, "a")),
+        "autoscaling_group": numpy.where(random.random(instance_count) < 0.3, "asg", None),
+        "emr_cluster_id": numpy.where(random.random(instance_count) < 0.05, "j-cluster", None),
+        "has_load_balancer": random.random(instance_count) < 0.25
+    })
+    reservation_count = max(1, instance_count // 50)
+    reservations = pandas.DataFrame({
+        "account_id": category(accounts, reservation_count),
+        "region": category(regions, reservation_count),
+        "availability_zone": "a",
+        "scope": numpy.where(random.random(reservation_count) < 0.2, "Availability Zone", "Region"),
+        "instance_type": category(instance_types, reservation_count),
+        "product_description": numpy.where(random.random(reservation_count) < 0.9, "Linux/UNIX", "Windows"),
+        "instance_tenancy": "default",
+        "state": "active",
+        "instance_count": random.integers(1, 20, reservation_count)
+    })
+    on_demand = random.uniform(10, 500, (len(regions), len(instance_types)))
+    prices = pandas.DataFrame({
+        "region": numpy.repeat(regions, len(instance_types)),
+        "instance_type": numpy.tile(instance_types, len(regions)),
+        "on_demand_price": on_demand.ravel(),
+        "spot_price": on_demand.ravel() * 0.3,
+        "reserved_upfront_cost": on_demand.ravel() * 6,
+        "reserved_monthly_price": on_demand.ravel() * 0.6
+    })
+    return instances, reservations, prices
+
+def benchmark_recommendations(instance_counts):
+    """
+    Prints the seconds the rule evaluation and the document building take for
+    synthetic inventories of increasing size spread over 100 accounts
+    Parameters :
+    instance_counts - sizes of the synthetic inventories
+    """
+    for instance_count in instance_counts:
+        instances, reservations, prices = synthetic_recommendation_inputs(instance_count)
+        start = time.perf_counter()
+        spot_results = recommendation_engine.evaluate_spot_rules(instances, prices)
+        reservation_results = recommendation_engine.evaluate_reservations(instances, reservations, prices)
+        evaluated = time.perf_counter()
+        documents = recommendation_engine.build_documents(spot_results, reservation_results)
+        built = time.perf_counter()
+        print("  {} instances: rules {:.2f}s, documents {:.2f}s for {} accounts, {} spot rows".format(
+            instance_count,
+            evaluated - start,
+            built - evaluated,
+            len(documents),
+            len(spot_results)
+        ))
+
+def nested_scan_match(instances, reservations):
+    """
+    Reference matcher scanning every reservation for every instance, applying
+    reservations in the same order as reservation_matcher
+    Parameters :
+    instances - list of instance tuples as taken by reservation_matcher.match_instances
+    reservations - list of reservation tuples as taken by reservation_matcher.match_instances
+    """
+    remaining = []
+    for (account_id, region, availability_zone, scope, instance_type,
+         product_description, tenancy, instance_count) in reservations:
+        platform = reservation_matcher.normalize_platform(product_description)
+        tenancy = reservation_matcher.normalize_tenancy(tenancy)
+        family, factor = reservation_matcher.split_instance_type(instance_type)
+        if scope == reservation_matcher.ZONAL_SCOPE:
+            kind = "zonal"
+        elif reservation_matcher.is_size_flexible(platform, tenancy, factor):
+            kind = "flexible"
+        else:
+            kind = "regional"
+        remaining.append([
+            kind, account_id, region, availability_zone, instance_type, family,
+            platform, tenancy, instance_count * (factor if kind == "flexible" else 1)
+        ])
+
+    covered = []
+    for account_id, region, availability_zone, instance_type, platform, tenancy in instances:
+        platform = reservation_matcher.normalize_platform(platform)
+        tenancy = reservation_matcher.normalize_tenancy(tenancy)
+        family, factor = reservation_matcher.split_instance_type(instance_type)
+        flexible = reservation_matcher.is_size_flexible(platform, tenancy, factor)
+        match = None
+        for kind in ("zonal", "regional", "flexible"):
+            for reservation in remaining:
+                if reservation[0] != kind or reservation[1] != account_id:
+                    continue
+                if kind == "zonal":
+                    found = reservation[3] == availability_zone and reservation[4] == instance_type \
+                        and reservation[6:8] == [platform, tenancy] and reservation[8] >= 1
+                elif kind == "regional":
+                    found = reservation[2] == region and reservation[4] == instance_type \
+                        and reservation[6:8] == [platform, tenancy] and reservation[8] >= 1
+                else:
+                    found = flexible and reservation[2] == region and reservation[5] == family
+                if found:
+                    match = reservation
+                    break
+            if match is not None:
+                break
+        if match is not None and match[0] == "flexible":
+            # Flexible capacity is pooled per family like in the indexed matcher
+            pool = [
+                reservation for reservation in remaining
+                if reservation[0] == "flexible" and reservation[1] == account_id
+                and reservation[2] == region and reservation[5] == family
+            ]
+            if sum(reservation[8] for reservation in pool) >= factor:
+                needed = factor
+                for reservation in pool:
+                    used = min(needed, reservation[8])
+                    reservation[8] -= used
+                    needed -= used
+                covered.append(True)
+            else:
+                covered.append(False)
+        elif match is not None:
+            match[8] -= 1
+            covered.append(True)
+        else:
+            covered.append(False)
+    return covered
+
+def benchmark_reservation_matching(instance_counts, nested_scan_limit=20000):
+    """
+    Prints the seconds the indexed matcher takes for synthetic fleets of
+    increasing size and checks it against the nested scan on the smaller ones
+    Parameters :
+    instance_counts - sizes of the synthetic fleets
+    nested_scan_limit - largest fleet the nested scan is run for
+    """
+    for instance_count in instance_counts:
+        instances, reservations, prices = synthetic_recommendation_inputs(
+            instance_count,
+            account_count=1,
+            region_count=4
+        )
+        instance_rows = list(zip(*(instances[column].tolist() for column in (
+            "account_id", "region", "availability_zone", "instance_type", "platform", "tenancy"
+        ))))
+        reservation_rows = list(zip(*(reservations[column].tolist() for column in (
+            "account_id", "region", "availability_zone", "scope", "instance_type",
+            "product_description", "instance_tenancy", "instance_count"
+        ))))
+        start = time.perf_counter()
+        covered = reservation_matcher.match_instances(instance_rows, reservation_rows)
+        indexed = time.perf_counter() - start
+        line = "  {} instances, {} reservations: indexed {:.3f}s, {} covered".format(
+            instance_count,
+            len(reservation_rows),
+            indexed,
+            sum(covered)
+        )
+        if instance_count <= nested_scan_limit:
+            start = time.perf_counter()
+            assert nested_scan_match(instance_rows, reservation_rows) == covered
+            line += ", nested scan {:.3f}s (same result)".format(time.perf_counter() - start)
+        print(line)
+
+def benchmark_fetch_data(max_workers, latency):
+    """
+    Returns the wall clock seconds fetch_data takes over all stubbed regions
+    Parameters :
+    max_workers - number of regions fetched at the same time
+    latency - seconds every stubbed API call sleeps for
+    """
+    StubSession.latency = latency
+    working_directory = os.getcwd()
+    output_directory = tempfile.mkdtemp()
+    try:
+        os.chdir(output_directory)
+        os.mkdir("inventory")
+        with mock.patch.object(boto3.session, "Session", StubSession), mock.patch("builtins.print"):
+            start = time.perf_counter()
+            fetch_inventory.fetch_data(max_workers=max_workers)
+            return time.perf_counter() - start
+    finally:
+        os.chdir(working_directory)
+        shutil.rmtree(output_directory)
+
+def per_region_clients(region):
+    """
+    Builds the clients of a region from a new session and calls sts, the way
+    the region workers did before the ClientPool
+    Parameters :
+    region - AWS region of the clients
+    """
+    session = boto3.session.Session()
+    clients = [
+        session.client(service, region_name=region)
+        for service in ("ec2", "elb", "elbv2", "autoscaling", "sts")
+    ]
+    return clients[-1].get_caller_identity()["Account"]
+
+def benchmark_client_setup(latency, runs=2):
+    """
+    Prints the client setup cost per region of runs collections over all
+    stubbed regions, building real boto3 clients with the API calls stubbed
+    out, with a new session per region and with a ClientPool kept across runs
+    Parameters :
+    latency - seconds every stubbed API call sleeps for
+    runs - number of collections of all regions
+    """
+    calls = []
+
+    def make_api_call(self, operation_name, api_params):
+        calls.append(operation_name)
+        time.sleep(latency)
+        return {"Account": "123456789012"}
+
+    with mock.patch.object(botocore.client.BaseClient, "_make_api_call", make_api_call), \
+            mock.patch.dict(os.environ, {"AWS_ACCESS_KEY_ID": "stub", "AWS_SECRET_ACCESS_KEY": "stub"}):
+        start = time.perf_counter()
+        for _ in range(runs):
+            for region in STUB_REGIONS:
+                per_region_clients(region)
+        per_region = time.perf_counter() - start
+        per_region_calls = len(calls)
+
+        del calls[:]
+        pool = client_pool.ClientPool()
+        start = time.perf_counter()
+        for _ in range(runs):
+            for region in STUB_REGIONS:
+                pool.region_clients(region)
+        pooled = time.perf_counter() - start
+        last_run = sum(pool.setup_seconds.values())
+
+    region_count = runs * len(STUB_REGIONS)
+    print("  new session per region: {:.1f}ms per region, {} sts calls".format(
+        per_region * 1000.0 / region_count,
+        per_region_calls
+    ))
+    print("  ClientPool: {:.1f}ms per region, {} sts calls, {:.3f}s in the last run".format(
+        pooled * 1000.0 / region_count,
+        len(calls),
+        last_run
+    ))
+
+def benchmark_org_collection(account_count, latency, process_counts):
+    """
+    Collects account_count stubbed accounts of all stubbed regions with every
+    number of processes in process_counts, checks every account partition and
+    prints the time taken and the speedup over a single process
+    Parameters :
+    account_count - number of accounts collected
+    latency - seconds every stubbed API call sleeps for
+    process_counts - numbers of processes to collect with
+    """
+    StubSession.latency = latency
+    account_ids = ["%012d" % (100000000000 + index) for index in range(account_count)]
+    baseline = None
+    for processes in process_counts:
+        inventory_dir = tempfile.mkdtemp()
+        try:
+            # The worker processes are forked with the stubs in place
+            with mock.patch.object(boto3.session, "Session", StubSession), mock.patch("builtins.print"):
+                start = time.perf_counter()
+                results = org_inventory.collect_organization(
+                    account_ids,
+                    processes=processes,
+                    inventory_dir=inventory_dir,
+                    # The stubbed clients have no botocore events to pace
+                    rate_limit=False
+                )
+                elapsed = time.perf_counter() - start
+            assert [result[2] for result in results] == [None] * account_count, results
+            for account_id in account_ids:
+                path = os.path.join(org_inventory.account_partition(inventory_dir, account_id), "instances.json")
+                reservations = list(inventory_stream.iter_inventory_records(path, "instances"))
+                assert set(reservation["account_id"] for reservation in reservations) == {account_id}
+                assert len(reservations) == len(STUB_REGIONS), len(reservations)
+            baseline = baseline or elapsed
+            print("  processes={}: {:.2f}s, speedup {:.1f}x".format(processes, elapsed, baseline / elapsed))
+        finally:
+            shutil.rmtree(inventory_dir)
+
+def run_against_fleet(fleet, run, inventory_file):
+    """
+    Runs an entry point in an empty working directory while the fleet is served
+    Returns (seconds, API calls, throttled attempts, peak traced bytes, instances written)
+    Parameters :
+    fleet - SyntheticFleet served to the entry point
+    run - function running the entry point
+    inventory_file - path of the instances file the entry point writes, relative
+                     to the working directory
+    """
+    working_directory = os.getcwd()
+    output_directory = tempfile.mkdtemp()
+    try:
+        os.chdir(output_directory)
+        os.mkdir("inventory")
+        with fleet.serve(), mock.patch("builtins.print"):
+            calls = fleet.call_count()
+            throttles = fleet.throttles
+            tracemalloc.start()
+            start = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        collected = sum(
+            len(reservation["Instances"])
+            for reservation in inventory_stream.iter_inventory_records(inventory_file, "instances")
+        )
+        return elapsed, fleet.call_count() - calls, fleet.throttles - throttles, peak, collected
+    finally:
+        os.chdir(working_directory)
+        shutil.rmtree(output_directory)
+
+def run_get_inventory(*arguments):
+    """
+    Runs the main of get_inventory.py with the command line arguments
+    """
+    get_inventory.main(list(arguments))
+
+def benchmark_end_to_end(fleet, max_workers):
+    """
+    Runs fetch_data and get_inventory.py end to end against the synthetic
+    fleet through real boto3 clients, checks that every instance was written
+    and prints the wall time, API calls, throttled attempts and peak memory
+    Parameters :
+    fleet - SyntheticFleet to collect
+    max_workers - number of regions fetch_data fetches at the same time
+    """
+    first_region = fleet.region_fleets[fleet.regions[0]]
+    cache_directory = tempfile.mkdtemp()
+    cache_file = os.path.join(cache_directory, "cache.sqlite")
+
+    def fetch_data_with_cache():
+        cache = response_cache.ResponseCache(cache_file)
+        try:
+            fetch_inventory.fetch_data(max_workers=max_workers, client_pool=client_pool.ClientPool(cache=cache))
+        finally:
+            cache.close()
+
+    def fetch_data_with_relationship_index():
+        fetch_inventory.fetch_data(
+            max_workers=max_workers,
+            relationship_dir=os.path.join(cache_directory, "relationships")
+        )
+
+    entry_points = [
+        (
+            "fetch_data max_workers={}".format(max_workers),
+            lambda: fetch_inventory.fetch_data(max_workers=max_workers),
+            "inventory/instances.json",
+            fleet.instance_count
+        ),
+        (
+            "fetch_data with a cold response cache",
+            fetch_data_with_cache,
+            "inventory/instances.json",
+            fleet.instance_count
+        ),
+        (
+            "fetch_data with a warm response cache",
+            fetch_data_with_cache,
+            "inventory/instances.json",
+            fleet.instance_count
+        ),
+        (
+            "fetch_data with a cold relationship index",
+            fetch_data_with_relationship_index,
+            "inventory/instances.json",
+            fleet.instance_count
+        ),
+        (
+            "fetch_data with a saved relationship index",
+            fetch_data_with_relationship_index,
+            "inventory/instances.json",
+            fleet.instance_count
+        ),
+        (
+            "get_inventory.py all regions",
+            lambda: run_get_inventory("--accesskeyid", "mock", "--secretaccesskey", "mock"),
+            "instances.json",
+            fleet.instance_count
+        ),
+        (
+            "get_inventory.py default region",
+            lambda: run_get_inventory(),
+            "instances.json",
+            first_region.instance_count
+        )
+    ]
+    try:
+        for name, run, inventory_file, expected in entry_points:
+            elapsed, calls, throttles, peak, collected = run_against_fleet(fleet, run, inventory_file)
+            assert collected == expected, (name, collected, expected)
+            print("  {}: {:.2f}s, {} API calls, {} throttled, peak traced memory {:.1f} MB".format(
+                name,
+                elapsed,
+                calls,
+                throttles,
+                peak / 1024.0 / 1024.0
+            ))
+    finally:
+        shutil.rmtree(cache_directory)
+
+def benchmark_relationships(fleet):
+    """
+    Refreshes a RelationshipIndex of the first region of the synthetic fleet
+    from an empty index, from the saved index, and after the instances of an
+    auto scaling group attached to a target group changed, checks that every
+    incremental refresh relates the instances the way a full refresh does and
+    prints the describe_target_health calls and time of every refresh
+    Parameters :
+    fleet - SyntheticFleet whose first region is indexed
+    """
+    region = fleet.regions[0]
+    index_directory = tempfile.mkdtemp()
+    index_path = os.path.join(index_directory, "index.json")
+    try:
+        with fleet.serve():
+            pool = client_pool.ClientPool()
+            elb = pool.client("elb", region)
+            elbv2 = pool.client("elbv2", region)
+            autoscaling = pool.client("autoscaling", region)
+            load_balancers = list(inventory_stream.iter_records(
+                elb, "describe_load_balancers", "LoadBalancerDescriptions"
+            ))
+            v2_load_balancers = list(inventory_stream.iter_records(elbv2, "describe_load_balancers", "LoadBalancers"))
+            autoscaling_groups = list(inventory_stream.iter_records(
+                autoscaling, "describe_auto_scaling_groups", "AutoScalingGroups"
+            ))
+            target_group_arns = [
+                target_group["TargetGroupArn"] for target_group in relationship_index.list_target_groups(elbv2)
+            ]
+            # Attaching every auto scaling group to a target group
+            for group_index, autoscaling_group in enumerate(autoscaling_groups):
+                autoscaling_group["TargetGroupARNs"] = [target_group_arns[group_index % len(target_group_arns)]]
+
+            def refresh(name, index):
+                start = time.perf_counter()
+                calls = index.refresh(elbv2, load_balancers, v2_load_balancers, autoscaling_groups)
+                elapsed = time.perf_counter() - start
+                full = relationship_index.RelationshipIndex()
+                full.refresh(elbv2, load_balancers, v2_load_balancers, autoscaling_groups)
+                for healthy_only in (False, True):
+                    assert index.instance_to_load_balancers_map(healthy_only) == \
+                        full.instance_to_load_balancers_map(healthy_only), name
+                print("  {}: {} describe_target_health calls in {:.3f}s".format(name, calls, elapsed))
+                return calls
+
+            index = relationship_index.RelationshipIndex()
+            assert refresh("empty index", index) == len(target_group_arns)
+            index.save(index_path)
+
+            index = relationship_index.RelationshipIndex.load(index_path)
+            assert refresh("saved index", index) == 0
+
+            autoscaling_groups[0]["Instances"].pop()
+            assert refresh("one auto scaling group changed", index) == 1
+
+            instance_id = autoscaling_groups[1]["Instances"][0]["InstanceId"]
+            load_balancer_names = index.instance_load_balancers(instance_id)
+            assert any(name.startswith(region + "-elb-") for name in load_balancer_names), load_balancer_names
+            assert any(name.startswith(region + "-alb-") for name in load_balancer_names), load_balancer_names
+            assert autoscaling_groups[1]["AutoScalingGroupName"] in index.instance_autoscaling_groups(instance_id)
+            for name in load_balancer_names:
+                assert instance_id in index.load_balancer_instances(name), name
+    finally:
+        shutil.rmtree(index_directory)
+
+def benchmark_daemon(fleet, max_workers, requests=1000):
+    """
+    Starts the inventory daemon against the synthetic fleet on an event loop
+    of its own, and prints the time of its first full refresh, the latency of
+    reading the instances of a region from it over a kept alive connection
+    and the refreshes coalesced out of concurrent refresh requests
+    Parameters :
+    fleet - SyntheticFleet to serve
+    max_workers - number of threads the daemon refreshes on
+    requests - number of reads timed
+    """
+    with fleet.serve():
+        daemon = inventory_daemon.InventoryDaemon(max_workers=max_workers)
+        loop = asyncio.new_event_loop()
+        started = threading.Event()
+        ports = []
+
+        def run_loop():
+            asyncio.set_event_loop(loop)
+            ports.append(loop.run_until_complete(daemon.start(port=0)))
+            started.set()
+            loop.run_forever()
+
+        start = time.perf_counter()
+        thread = threading.Thread(target=run_loop)
+        thread.start()
+        try:
+            started.wait()
+            asyncio.run_coroutine_threadsafe(daemon.ready.wait(), loop).result()
+            print("  first refresh of {} regions: {:.2f}s, {} API calls".format(
+                len(daemon.regions),
+                time.perf_counter() - start,
+                fleet.call_count()
+            ))
+
+            connection = http.client.HTTPConnection("127.0.0.1", ports[0])
+            region = fleet.regions[0]
+            path = "/inventory/instances?region=" + region
+            connection.request("GET", path)
+            documents = json.loads(connection.getresponse().read())
+            assert sum(len(document["instances"]) for document in documents) == \
+                fleet.region_fleets[region].instance_count
+            for name, target in (("instances of a region", path), ("health", "/health")):
+                start = time.perf_counter()
+                for _ in range(requests):
+                    connection.request("GET", target)
+                    body = connection.getresponse().read()
+                elapsed = time.perf_counter() - start
+                print("  read {} ({:.1f} KB): {:.3f} ms".format(
+                    name,
+                    len(body) / 1024.0,
+                    elapsed * 1000.0 / requests
+                ))
+
+            calls = fleet.call_count()
+            for _ in range(10):
+                connection.request("POST", "/refresh/reservations?region=" + region)
+                connection.getresponse().read()
+            time.sleep(0.5)
+            state = daemon.states[(region, "reservations")]
+            print("  10 refresh requests: {} refreshes, {} coalesced, {} API calls".format(
+                state.refreshes - 1,
+                state.coalesced,
+                fleet.call_count() - calls
+            ))
+            connection.close()
+        finally:
+            asyncio.run_coroutine_threadsafe(daemon.stop(), loop).result()
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            loop.close()
+
+# Benchmarks main runs, selected with --benchmarks
+def benchmark_resume(fleet, max_workers, failed_regions=3):
+    """
+    Collects the synthetic fleet with fetch_data while the relationship refresh
+    of the last failed_regions regions fails, resumes the run, checks that every
+    instance ends up written exactly once and prints the wall time and API calls
+    of the failed run, of the resumed run and of a full run
+    Parameters :
+    fleet - SyntheticFleet to collect
+    max_workers - number of regions fetch_data fetches at the same time
+    failed_regions - number of regions failing in the first run
+    """
+    failing = set(fleet.regions[-failed_regions:])
+    refresh = relationship_index.RelationshipIndex.refresh
+
+    def failing_refresh(index, elbv2_client, *args, **kwargs):
+        if elbv2_client.meta.region_name in failing:
+            raise RuntimeError("injected failure")
+        return refresh(index, elbv2_client, *args, **kwargs)
+
+    def failing_run():
+        with mock.patch.object(relationship_index.RelationshipIndex, "refresh", failing_refresh):
+            fetch_inventory.fetch_data(max_workers=max_workers)
+
+    inventory_directory = tempfile.mkdtemp()
+    working_directory = os.getcwd()
+    try:
+        os.chdir(inventory_directory)
+        for name, run in (
+            ("full run", lambda: fetch_inventory.fetch_data(max_workers=max_workers)),
+            ("run with {} failed regions".format(failed_regions), failing_run),
+            ("resumed run", lambda: fetch_inventory.fetch_data(max_workers=max_workers, resume=True))
+        ):
+            with fleet.serve(), mock.patch("builtins.print"):
+                calls = fleet.call_count()
+                start = time.perf_counter()
+                run()
+                elapsed = time.perf_counter() - start
+            instance_ids = [
+                instance["InstanceId"]
+                for reservation in inventory_stream.iter_inventory_records("inventory/instances.json", "instances")
+                for instance in reservation["Instances"]
+            ]
+            assert len(instance_ids) == len(set(instance_ids)), name
+            print("  {}: {:.2f}s, {} API calls, {} of {} instances written".format(
+                name,
+                elapsed,
+                fleet.call_count() - calls,
+                len(instance_ids),
+                fleet.instance_count
+            ))
+        assert len(instance_ids) == fleet.instance_count, len(instance_ids)
+    finally:
+        os.chdir(working_directory)
+        shutil.rmtree(inventory_directory)
+
+def benchmark_collectors(fleet, max_workers):
+    """
+    Collects the synthetic fleet with fetch_data for several resource
+    selections, checks that only the selected inventory files are written and
+    that every instance is, and prints the wall time and API calls by
+    operation of every selection
+    Parameters :
+    fleet - SyntheticFleet to collect
+    max_workers - number of regions fetch_data fetches at the same time
+    """
+    selections = (
+        None,
+        ["instances", "load_balancer_map"],
+        ["instances", "autoscaling_groups"],
+        ["instances"]
+    )
+    working_directory = os.getcwd()
+    for resources in selections:
+        inventory_directory = tempfile.mkdtemp()
+        try:
+            os.chdir(inventory_directory)
+            with fleet.serve(), mock.patch("builtins.print"):
+                calls = dict(fleet.calls)
+                start = time.perf_counter()
+                fetch_inventory.fetch_data(max_workers=max_workers, resources=resources)
+                elapsed = time.perf_counter() - start
+            plan = resource_collectors.CollectionPlan(resources)
+            written = sorted(
+                file_name[:-len(".json")] for file_name in os.listdir("inventory") if file_name.endswith(".json")
+            )
+            assert written == sorted(plan.written), written
+            instances = [
+                instance
+                for reservation in inventory_stream.iter_inventory_records("inventory/instances.json", "instances")
+                for instance in reservation["Instances"]
+            ]
+            assert len(instances) == fleet.instance_count, len(instances)
+            if "load_balancer_map" not in plan.resources:
+                assert all(instance["LoadBalancerName"] is None for instance in instances)
+            operations = {
+                key: count - calls.get(key, 0) for key, count in fleet.calls.items() if count > calls.get(key, 0)
+            }
+            print("  {}: {:.2f}s, {} API calls ({})".format(
+                ",".join(resources) if resources else "all resources",
+                elapsed,
+                sum(operations.values()),
+                ", ".join(
+                    "{}.{} {}".format(service, operation, count)
+                    for (service, operation), count in sorted(operations.items())
+                )
+            ))
+        finally:
+            os.chdir(working_directory)
+            shutil.rmtree(inventory_directory)
+
+def benchmark_filters(fleet, max_workers):
+    """
+    Collects the instances and reserved instances of the synthetic fleet with
+    fetch_data with and without the state=active filter and the projection,
+    checks that the filtered runs write only the active instances and the
+    projected ones only the projected fields, and prints the response bytes,
+    inventory file bytes and wall time per 10k instances of the fleet
+    Parameters :
+    fleet - SyntheticFleet with terminated instances, counting the response bytes
+    max_workers - number of regions fetch_data fetches at the same time
+    """
+    runs = (
+        ("unfiltered", [], False),
+        ("state=active", [collection_filters.parse_filter("state=active")], False),
+        ("projection", [], True),
+        ("state=active with projection", [collection_filters.parse_filter("state=active")], True)
+    )
+    working_directory = os.getcwd()
+    for name, filters, projection in runs:
+        inventory_directory = tempfile.mkdtemp()
+        try:
+            os.chdir(inventory_directory)
+            with fleet.serve(), mock.patch("builtins.print"):
+                response_bytes = fleet.response_bytes
+                start = time.perf_counter()
+                fetch_inventory.fetch_data(
+                    max_workers=max_workers,
+                    resources=["instances", "reservations"],
+                    filters=filters,
+                    projection=projection
+                )
+                elapsed = time.perf_counter() - start
+            instances = [
+                instance
+                for reservation in inventory_stream.iter_inventory_records("inventory/instances.json", "instances")
+                for instance in reservation["Instances"]
+            ]
+            states = set(instance["State"]["Name"] for instance in instances)
+            if filters:
+                assert states == {"running"}, states
+            else:
+                assert len(instances) == fleet.instance_count, len(instances)
+            if projection:
+                assert all(set(instance).issubset(
+                    inventory_model.INSTANCE_FIELDS + ("spot", "LoadBalancerName")
+                ) for instance in instances)
+            per_10k = 10000.0 / fleet.instance_count
+            print("  {}: {} instances, per 10k instances {:.0f} KB of responses, {:.0f} KB written, {:.2f}s".format(
+                name,
+                len(instances),
+                (fleet.response_bytes - response_bytes) * per_10k / 1024.0,
+                sum(
+                    os.path.getsize(os.path.join("inventory", file_name))
+                    for file_name in os.listdir("inventory") if file_name.endswith(".json")
+                ) * per_10k / 1024.0,
+                elapsed * per_10k
+            ))
+        finally:
+            os.chdir(working_directory)
+            shutil.rmtree(inventory_directory)
+
+def benchmark_prices(fleet, max_workers, lookup_count=1000000):
+    """
+    Prices the instance types of the synthetic fleet by calling
+    describe_spot_price_history per region and instance type without a start
+    time, then by
+    refreshing a price table twice, checks the prices of the memory mapped
+    table against those the fleet serves, and prints the calls, response bytes
+    and wall time of each and the time of the vectorized lookups of
+    lookup_count instances and of the spot rules priced by the table
+    Parameters :
+    fleet - SyntheticFleet counting the response bytes
+    max_workers - number of regions refreshed at the same time
+    lookup_count - number of synthetic instances looked up
+    """
+    import numpy
+    import pandas
+
+    products = price_table.DEFAULT_PRODUCTS
+    instance_types = {region: list(mock_aws.INSTANCE_TYPES) for region in fleet.regions}
+
+    def measured(name, run):
+        calls = fleet.call_count()
+        response_bytes = fleet.response_bytes
+        start = time.perf_counter()
+        result = run()
+        print("  {}: {} calls, {:.0f} KB of responses, {:.2f}s".format(
+            name,
+            fleet.call_count() - calls,
+            (fleet.response_bytes - response_bytes) / 1024.0,
+            time.perf_counter() - start
+        ))
+        return result
+
+    price_directory = tempfile.mkdtemp()
+    try:
+        with fleet.serve():
+            pool = client_pool.ClientPool()
+
+            def per_instance_type():
+                for region, region_instance_types in instance_types.items():
+                    for instance_type in region_instance_types:
+                        list(inventory_stream.iter_records(
+                            pool.client("ec2", region),
+                            "describe_spot_price_history",
+                            "SpotPriceHistory",
+                            InstanceTypes=[instance_type],
+                            ProductDescriptions=[price_table.PRODUCTS[product][0] for product in products]
+                        ))
+            measured("spot price history per region and instance type", per_instance_type)
+
+            table = price_table.PriceTable(price_directory)
+            spot_count, on_demand_count = measured(
+                "first refresh of the price table",
+                lambda: price_table.refresh_prices(table, instance_types, products, pool, max_workers=max_workers)
+            )
+            table.save()
+            expected_count = len(fleet.regions) * len(mock_aws.INSTANCE_TYPES) * len(products)
+            assert on_demand_count == expected_count, on_demand_count
+            assert spot_count == expected_count * 3, spot_count
+
+            pricing_calls = fleet.calls.get(("pricing", "GetProducts"), 0)
+            table = price_table.PriceTable(price_directory)
+            measured(
+                "incremental refresh",
+                lambda: price_table.refresh_prices(table, instance_types, products, pool, max_workers=max_workers)
+            )
+            table.save()
+            # The on-demand prices are not stale yet
+            assert fleet.calls.get(("pricing", "GetProducts"), 0) == pricing_calls
+
+        table = price_table.PriceTable(price_directory)
+        assert isinstance(table.arrays["prices"], numpy.memmap)
+        assert len(table) == expected_count, len(table)
+        random = numpy.random.default_rng(0)
+        zone_indexes = random.integers(0, 3, lookup_count)
+        type_indexes = random.integers(0, len(mock_aws.INSTANCE_TYPES), lookup_count)
+        regions = numpy.array(fleet.regions)[random.integers(0, len(fleet.regions), lookup_count)]
+        instances = pandas.DataFrame({
+            "account_id": pandas.Categorical(numpy.full(lookup_count, mock_aws.DEFAULT_ACCOUNT_ID)),
+            "region": pandas.Categorical(regions),
+            "instance_id": ["i-%017x" % index for index in range(lookup_count)],
+            "instance_type": pandas.Categorical(numpy.array(mock_aws.INSTANCE_TYPES)[type_indexes]),
+            "state": pandas.Categorical(numpy.full(lookup_count, "running")),
+            "spot": False,
+            "tenancy": pandas.Categorical(numpy.full(lookup_count, "default")),
+            "platform": pandas.Categorical(numpy.where(random.random(lookup_count) < 0.9, "linux", "windows")),
+            "availability_zone": pandas.Categorical(
+                numpy.char.add(regions.astype(str), numpy.array(list("abc"))[zone_indexes])
+            ),
+            "autoscaling_group": "asg",
+            "emr_cluster_id": None,
+            "has_load_balancer": False
+        })
+
+        start = time.perf_counter()
+        on_demand_prices, spot_prices = table.monthly_prices(
+            instances["region"], instances["instance_type"], instances["platform"], instances["availability_zone"]
+        )
+        elapsed = time.perf_counter() - start
+        # The latest interval served by the fleet is the one in effect
+        interval = int(time.time()) // mock_aws.SPOT_PRICE_INTERVAL
+        for index in range(0, lookup_count, max(1, lookup_count // 1000)):
+            instance_type = mock_aws.INSTANCE_TYPES[type_indexes[index]]
+            description = price_table.PRODUCTS[instances["platform"][index]][0]
+            factor = mock_aws.OPERATING_SYSTEMS[description][1]
+            expected_spot = mock_aws.spot_price(instance_type, description, zone_indexes[index], interval)
+            assert abs(spot_prices[index] - expected_spot * price_table.HOURS_PER_MONTH) < 0.01, index
+            expected_on_demand = mock_aws.ON_DEMAND_PRICES[instance_type] * factor * price_table.HOURS_PER_MONTH
+            assert abs(on_demand_prices[index] - expected_on_demand) < 0.01, index
+        print("  lookups of {} instances in the memory mapped table: {:.3f}s".format(lookup_count, elapsed))
+
+        start = time.perf_counter()
+        results = recommendation_engine.evaluate_spot_rules(
+            instances, recommendation_engine.load_prices(None), price_table=table
+        )
+        elapsed = time.perf_counter() - start
+        assert len(results) == lookup_count and results["spot_price"].notna().all()
+        assert (results["savings"] > 0).all()
+        print("  spot rules priced by the table: {:.2f}s, {:.0f} USD of monthly savings".format(
+            elapsed,
+            results["savings"].sum()
+        ))
+    finally:
+        shutil.rmtree(price_directory)
+
+def import_time(module):
+    """
+    Returns the import time of a module in seconds, as python -X importtime
+    reports it in a fresh interpreter, and the LAZY_MODULES it loaded
+    """
+    directory = os.path.dirname(os.path.abspath(__file__))
+    process = subprocess.run(
+        [
+            sys.executable, "-X", "importtime", "-c",
+            "import sys, {}; print(','.join(name for name in {!r} if name in sys.modules))".format(
+                module, LAZY_MODULES
+            )
+        ],
+        cwd=directory,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True
+    )
+    microseconds = None
+    for line in process.stderr.splitlines():
+        _, cumulative, name = line.split("|")
+        if name.strip() == module and not name[1:].startswith(" "):
+            microseconds = int(cumulative)
+    loaded = [name for name in process.stdout.strip().split(",") if name]
+    return microseconds / 1e6, loaded
+
+def benchmark_startup(budget, runs=5):
+    """
+    Imports every one of the STARTUP_MODULES in fresh interpreters, checks
+    that none loads the LAZY_MODULES and that the fastest of runs imports
+    stays within the budget, and prints the import times next to those of
+    boto3 and of fetch_inventory.py --help
+    Parameters :
+    budget - seconds every module may take to import
+    runs - imports of every module, the fastest one is kept
+    """
+    directory = os.path.dirname(os.path.abspath(__file__))
+    boto3_seconds = min(import_time("boto3")[0] for _ in range(runs))
+    print("  boto3 alone: {:.1f}ms".format(boto3_seconds * 1000))
+    for module in STARTUP_MODULES:
+        seconds = None
+        for _ in range(runs):
+            run_seconds, loaded = import_time(module)
+            assert not loaded, "{} imports {}".format(module, ", ".join(loaded))
+            seconds = run_seconds if seconds is None else min(seconds, run_seconds)
+        print("  import {}: {:.1f}ms, budget {:.0f}ms".format(module, seconds * 1000, budget * 1000))
+        assert seconds <= budget, "{} takes {:.1f}ms to import".format(module, seconds * 1000)
+    help_seconds = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, "fetch_inventory.py", "--help"],
+            cwd=directory,
+            stdout=subprocess.DEVNULL,
+            check=True
+        )
+        elapsed = time.perf_counter() - start
+        help_seconds = elapsed if help_seconds is None else min(help_seconds, elapsed)
+    print("  fetch_inventory.py --help: {:.1f}ms wall time".format(help_seconds * 1000))
+
+def write_synthetic_recommendation_response(path, detail_count):
+    """
+    Writes a recommendation response of detail_count spot and reservation
+    details spread over the stubbed regions, indented as recommendation_engine.py writes it
+    """
+    instance_types = ["t3.large", "m5.xlarge", "c5.2xlarge", "r5.large"]
+    per_region = detail_count // len(STUB_REGIONS)
+    savings_by_region = []
+    for region_index, region in enumerate(STUB_REGIONS):
+        spot_count = per_region * 3 // 4
+        savings_by_region.append({
+            "account_id": "123456789012",
+            "region": region,
+            "savings_by_rule_type": [
+                {
+                    "recommended_type": "SPOT",
+                    "total_savings": str(spot_count * 10),
+                    "details": [
+                        {
+                            "InstanceId": "i-%08x%08x" % (region_index, index),
+                            "InstanceType": instance_types[index % len(instance_types)],
+                            "OnDemandPrice": str(20 + index % 97),
+                            "SpotPrice": str(10 + index % 13)
+                        }
+                        for index in range(spot_count)
+                    ]
+                },
+                {
+                    "recommended_type": "RESERVATIONS",
+                    "total_savings": str((per_region - spot_count) * 30),
+                    "details": [
+                        {
+                            "InstanceType": instance_types[index % len(instance_types)],
+                            "RecommendedNumberOfInstancesToPurchase": str(1 + index % 5),
+                            "Term": "1",
+                            "UpfrontCost": str(100 + index % 50),
+                            "EstimatedMonthlySavingsAmount": str(5 + index % 89)
+                        }
+                        for index in range(per_region - spot_count)
+                    ]
+                }
+            ]
+        })
+    with open(path, "w") as response_file:
+        json.dump(
+            {"time_stamp": "2019-10-21 12:32:41.003628", "account_id": "123456789012",
+             "savings_by_region": savings_by_region},
+            response_file,
+            indent=4
+        )
+
+class DigestOutput(object):
+    """
+    Text output keeping only a digest and the length of what is written to it
+    """
+
+    def __init__(self):
+        self.digest = hashlib.sha1()
+        self.length = 0
+
+    def write(self, text):
+        self.digest.update(text.encode("utf-8"))
+        self.length += len(text)
+
+def legacy_print_recommendation(path, output):
+    """
+    Prints the text report the way print_recommendation.py did before it streamed the response
+    """
+    with open(path) as json_file:
+        data = json.load(json_file)
+        account_id = data["account_id"]
+        print(file=output)
+        print("FOR THE AWS ACCOUNT ID "+account_id, file=output)
+        for saving in data["savings_by_region"]:
+            print("---------------------------------------------------------------------", file=output)
+            print("IN THE REGION "+saving["region"], file=output)
+            print(file=output)
+            for saving_type in saving["savings_by_rule_type"]:
+                if saving_type["recommended_type"] == "SPOT":
+                    print("Convert the following instances to SPOT to save "+saving_type["total_savings"]+" USD ",
+                          file=output)
+                    for index, detail in enumerate(saving_type["details"]):
+                        print("{}) Instance ID: ".format(index+1)+detail["InstanceId"]+" of type "+
+                              detail["InstanceType"], file=output)
+                    print(file=output)
+                elif saving_type["recommended_type"] == "RESERVATIONS":
+                    print("RESERVE the following instances to save "+saving_type["total_savings"]+" USD",
+                          file=output)
+                    for index, detail in enumerate(saving_type["details"]):
+                        print("{}) ".format(index+1)+detail["RecommendedNumberOfInstancesToPurchase"]+" "+
+                              detail["InstanceType"]+" for a period of "+detail["Term"]+
+                              " years for the upfront cost of "+detail["UpfrontCost"], file=output)
+                    print(file=output)
+            print(file=output)
+
+def benchmark_report(detail_counts):
+    """
+    Reports synthetic recommendation responses of every detail count with the
+    legacy json.load and print report and with the streaming renderer in every
+    format, checks that both text reports are identical and prints the time,
+    peak traced memory and throughput of every run
+    Parameters :
+    detail_counts - numbers of details of the responses
+    """
+    output_directory = tempfile.mkdtemp()
+    path = os.path.join(output_directory, "recommendation_response.json")
+    try:
+        for detail_count in detail_counts:
+            write_synthetic_recommendation_response(path, detail_count)
+            print("  {} details, {:.1f} MB response".format(detail_count, os.path.getsize(path) / 1024.0 / 1024.0))
+
+            def stream(report_format, top=None, rule_types=None):
+                def run(output):
+                    with open(path, encoding="utf-8") as response_file:
+                        recommendation_report.write_report(
+                            response_file, output, report_format, rule_types=rule_types, top=top
+                        )
+                return run
+
+            runs = [("legacy json.load and print", lambda output: legacy_print_recommendation(path, output))]
+            runs.extend(
+                ("streaming " + report_format, stream(report_format))
+                for report_format in recommendation_report.REPORT_FORMATS
+            )
+            runs.append(("streaming csv of the top 100 spot details", stream("csv", 100, ["SPOT"])))
+            digests = {}
+            for name, run in runs:
+                output = DigestOutput()
+                tracemalloc.start()
+                start = time.perf_counter()
+                run(output)
+                elapsed = time.perf_counter() - start
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                digests[name] = output.digest.hexdigest()
+                print("    {}: {:.2f}s, {:.0f} details/s, peak traced memory {:.1f} MB".format(
+                    name,
+                    elapsed,
+                    detail_count / elapsed,
+                    peak / 1024.0 / 1024.0
+                ))
+            assert digests["legacy json.load and print"] == digests["streaming text"], "text reports differ"
+    finally:
+        shutil.rmtree(output_directory)
+
+def benchmark_rate_limits(quota, max_workers, latency, calls=300):
+    """
+    Hammers one region and service of a synthetic fleet that throttles the
+    attempts past quota per second from max_workers threads, with botocore's
+    adaptive retries alone and with the AdaptiveRateLimiter, and prints the
+    successful calls per second against the quota, the throttled attempts and
+    the calls that failed. Then collects a fleet that throttles a third of the
+    attempts with botocore retries turned off and checks that the throttled
+    pages are asked for again without losing or duplicating instances
+    Parameters :
+    quota - attempts per second the fleet accepts per (account, region, service)
+    max_workers - number of threads calling at the same time
+    latency - seconds every attempt takes
+    calls - number of calls of every run
+    """
+    for name, limiter in (
+        ("adaptive retries", None),
+        ("adaptive rate limiter", rate_limiter.AdaptiveRateLimiter())
+    ):
+        fleet = mock_aws.SyntheticFleet(region_count=1, target_group_count=10, latency=latency, quota=quota)
+        target_group_arn = fleet.region_fleets[fleet.regions[0]].target_group(0)["TargetGroupArn"]
+        failures = []
+        with fleet.serve():
+            elbv2 = client_pool.ClientPool(rate_limiter=limiter).client("elbv2", fleet.regions[0])
+
+            def describe_target_health(_):
+                try:
+                    elbv2.describe_target_health(TargetGroupArn=target_group_arn)
+                except botocore.exceptions.ClientError as error:
+                    failures.append(error)
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                list(executor.map(describe_target_health, range(calls)))
+            elapsed = time.perf_counter() - start
+        print("  {}: {:.1f} calls/s of a {} calls/s quota, {} throttled attempts, {} failed calls".format(
+            name,
+            (calls - len(failures)) / elapsed,
+            quota,
+            fleet.throttles,
+            len(failures)
+        ))
+
+    fleet = mock_aws.SyntheticFleet(region_count=4, instance_count=4000, throttle_rate=0.3, quota=1000)
+    with mock.patch.object(inventory_stream, "PAGE_RETRY_BACKOFF", 0.01):
+        elapsed, calls, throttles, _, collected = run_against_fleet(
+            fleet,
+            lambda: fetch_inventory.fetch_data(
+                max_workers=max_workers,
+                client_pool=client_pool.ClientPool(max_attempts=1, rate_limiter=rate_limiter.AdaptiveRateLimiter())
+            ),
+            "inventory/instances.json"
+        )
+    assert collected == fleet.instance_count, (collected, fleet.instance_count)
+    print("  fetch_data without botocore retries: {:.2f}s, {} API calls, {} throttled, {} of {} instances".format(
+        elapsed,
+        calls,
+        throttles,
+        collected,
+        fleet.instance_count
+    ))
+
+BENCHMARKS = (
+    "matching",
+    "recommendations",
+    "report",
+    "model",
+    "serializers",
+    "store",
+    "client-setup",
+    "streaming",
+    "target-health",
+    "organization",
+    "fetch-data",
+    "relationships",
+    "daemon",
+    "rate-limits",
+    "resume",
+    "collectors",
+    "filters",
+    "startup",
+    "prices",
+    "end-to-end"
+)
+
+def main():
+    """
+    Runs the selected benchmarks out of the reservation matching, the
+    recommendation rules, the streaming recommendation reports, the in-memory
+    inventory model, the serializer backends, the inventory store, the client
+    setup, the streaming collection, the target health refreshes of the
+    relationship index, the organization collection, fetch_data serially and
+    with the requested worker count, the relationship index refreshes, the
+    inventory daemon, the rate limiting of throttled calls, the
+    resumption of a partially failed run, the collection of selected
+    resources, the server side filters and projection of the instances, the
+    import time of the entry points, the price table and the entry points end
+    to end against a synthetic fleet and prints the results
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--max-workers", type=int, default=fetch_inventory.DEFAULT_MAX_WORKERS)
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds per stubbed API call")
+    parser.add_argument(
+        "--load-balancers",
+        type=int,
+        default=500,
+        help="Number of v2 load balancers of the target health benchmark"
+    )
+    parser.add_argument(
+        "--target-groups",
+        type=int,
+        default=2000,
+        help="Number of target groups of the target health benchmark"
+    )
+    parser.add_argument("--instances", type=int, default=100000)
+    parser.add_argument("--accounts", type=int, default=16, help="Number of accounts of the organization benchmark")
+    parser.add_argument(
+        "--processes",
+        default="1,2,4",
+        help="Comma separated process counts of the organization benchmark"
+    )
+    parser.add_argument(
+        "--model-instances",
+        type=int,
+        default=200000,
+        help="Number of instances of the in-memory inventory model benchmark"
+    )
+    parser.add_argument(
+        "--serializer-instances",
+        type=int,
+        default=100000,
+        help="Number of instances of the serializer benchmark payload"
+    )
+    parser.add_argument(
+        "--store-instances",
+        type=int,
+        default=200000,
+        help="Number of instances of every run loaded by the inventory store benchmark"
+    )
+    parser.add_argument("--store-runs", type=int, default=10, help="Number of runs loaded into the inventory store")
+    parser.add_argument(
+        "--recommendation-sizes",
+        default="10000,100000",
+        help="Comma separated instance counts of the synthetic recommendation inventories"
+    )
+    parser.add_argument(
+        "--report-sizes",
+        default="10000,100000",
+        help="Comma separated detail counts of the synthetic recommendation responses"
+    )
+    parser.add_argument(
+        "--benchmarks",
+        default=",".join(BENCHMARKS),
+        help="Comma separated benchmarks to run out of " + ", ".join(BENCHMARKS)
+    )
+    parser.add_argument("--fleet-regions", type=int, default=len(STUB_REGIONS))
+    parser.add_argument("--fleet-instances", type=int, default=20000)
+    parser.add_argument("--fleet-reservations", type=int, default=500)
+    parser.add_argument("--fleet-load-balancers", type=int, default=200)
+    parser.add_argument("--fleet-v2-load-balancers", type=int, default=200)
+    parser.add_argument("--fleet-target-groups", type=int, default=400)
+    parser.add_argument("--fleet-autoscaling-groups", type=int, default=100)
+    parser.add_argument(
+        "--import-budget",
+        type=float,
+        default=150.0,
+        help="Milliseconds every entry point may take to import in the startup benchmark"
+    )
+    parser.add_argument(
+        "--terminated-ratio",
+        type=float,
+        default=0.3,
+        help="Share of the synthetic fleet instances that are terminated in the filters benchmark"
+    )
+    parser.add_argument("--fleet-latency", type=float, default=0.01, help="Seconds per synthetic fleet API call")
+    parser.add_argument(
+        "--quota",
+        type=float,
+        default=20,
+        help="Attempts per second the synthetic fleet accepts per region and service in the rate limit benchmark"
+    )
+    parser.add_argument(
+        "--throttle-rate",
+        type=float,
+        default=0.02,
+        help="Share of the synthetic fleet API calls throttled and retried"
+    )
+    args = parser.parse_args()
+    selected = set(args.benchmarks.split(","))
+    unknown = selected.difference(BENCHMARKS)
+    if unknown:
+        parser.error("unknown benchmarks: " + ", ".join(sorted(unknown)))
+
+    if "matching" in selected:
+        print("reserved instance matching over synthetic fleets")
+        benchmark_reservation_matching([1000, 10000, 100000, 1000000])
+
+    if "recommendations" in selected:
+        print("recommendation rules over synthetic inventories")
+        benchmark_recommendations([int(size) for size in args.recommendation_sizes.split(",")])
+
+    if "report" in selected:
+        print("recommendation reports of synthetic responses")
+        benchmark_report([int(size) for size in args.report_sizes.split(",")])
+
+    if "model" in selected:
+        print("in-memory inventory of {} instances over {} regions".format(args.model_instances, len(STUB_REGIONS)))
+        benchmark_instance_model(args.model_instances)
+
+    if "serializers" in selected:
+        print("instances file of {} instances".format(args.serializer_instances))
+        benchmark_serializers(args.serializer_instances)
+
+    if "store" in selected:
+        print("inventory store of {} runs of {} instances".format(args.store_runs, args.store_instances))
+        benchmark_store(args.store_instances, args.store_runs)
+
+    if "client-setup" in selected:
+        print("client setup over {} regions with {}s per call".format(len(STUB_REGIONS), args.latency))
+        benchmark_client_setup(args.latency)
+
+    if "streaming" in selected:
+        print("streaming collection of a region with {} instances".format(args.instances))
+        benchmark_streaming(args.instances)
+
+    if "target-health" in selected:
+        print("target health over {} load balancers and {} target groups with {}s per call".format(
+            args.load_balancers,
+            args.target_groups,
+            args.latency
+        ))
+        benchmark_target_health(args.load_balancers, args.target_groups, args.latency, args.max_workers)
+
+    if "organization" in selected:
+        print("organization collection of {} accounts over {} regions with {}s per call ({} cores)".format(
+            args.accounts,
+            len(STUB_REGIONS),
+            args.latency,
+            os.cpu_count()
+        ))
+        benchmark_org_collection(args.accounts, args.latency, [int(count) for count in args.processes.split(",")])
+
+    if "fetch-data" in selected:
+        serial = benchmark_fetch_data(1, args.latency)
+        parallel = benchmark_fetch_data(args.max_workers, args.latency)
+        print("fetch_data over {} regions with {}s per call".format(len(STUB_REGIONS), args.latency))
+        print("  max_workers=1: {:.2f}s".format(serial))
+        print("  max_workers={}: {:.2f}s".format(args.max_workers, parallel))
+        print("  speedup: {:.1f}x".format(serial / parallel))
+
+    if "relationships" in selected:
+        fleet = mock_aws.SyntheticFleet(
+            region_count=args.fleet_regions,
+            instance_count=args.fleet_instances,
+            load_balancer_count=args.fleet_load_balancers,
+            v2_load_balancer_count=args.fleet_v2_load_balancers,
+            target_group_count=args.fleet_target_groups,
+            autoscaling_group_count=args.fleet_autoscaling_groups
+        )
+        print("relationship index of a region of a synthetic fleet of {} instances over {} regions".format(
+            args.fleet_instances,
+            args.fleet_regions
+        ))
+        benchmark_relationships(fleet)
+
+    if "daemon" in selected:
+        fleet = mock_aws.SyntheticFleet(
+            region_count=args.fleet_regions,
+            instance_count=args.fleet_instances,
+            reservation_count=args.fleet_reservations,
+            load_balancer_count=args.fleet_load_balancers,
+            v2_load_balancer_count=args.fleet_v2_load_balancers,
+            target_group_count=args.fleet_target_groups,
+            autoscaling_group_count=args.fleet_autoscaling_groups,
+            latency=args.fleet_latency
+        )
+        print("inventory daemon over a synthetic fleet of {} instances over {} regions with {}s per call".format(
+            args.fleet_instances,
+            args.fleet_regions,
+            args.fleet_latency
+        ))
+        benchmark_daemon(fleet, args.max_workers)
+
+    if "rate-limits" in selected:
+        print("calls from {} threads to a synthetic fleet throttling past {} calls/s with {}s per call".format(
+            args.max_workers,
+            args.quota,
+            args.fleet_latency
+        ))
+        benchmark_rate_limits(args.quota, args.max_workers, args.fleet_latency)
+
+    if "resume" in selected:
+        fleet = mock_aws.SyntheticFleet(
+            region_count=args.fleet_regions,
+            instance_count=args.fleet_instances,
+            reservation_count=args.fleet_reservations,
+            load_balancer_count=args.fleet_load_balancers,
+            v2_load_balancer_count=args.fleet_v2_load_balancers,
+            target_group_count=args.fleet_target_groups,
+            autoscaling_group_count=args.fleet_autoscaling_groups,
+            latency=args.fleet_latency
+        )
+        print("resumed fetch_data over a synthetic fleet of {} instances over {} regions with {}s per call".format(
+            args.fleet_instances,
+            args.fleet_regions,
+            args.fleet_latency
+        ))
+        benchmark_resume(fleet, args.max_workers)
+
+    if "collectors" in selected:
+        fleet = mock_aws.SyntheticFleet(
+            region_count=args.fleet_regions,
+            instance_count=args.fleet_instances,
+            reservation_count=args.fleet_reservations,
+            load_balancer_count=args.fleet_load_balancers,
+            v2_load_balancer_count=args.fleet_v2_load_balancers,
+            target_group_count=args.fleet_target_groups,
+            autoscaling_group_count=args.fleet_autoscaling_groups,
+            latency=args.fleet_latency
+        )
+        print("fetch_data of selected resources over a synthetic fleet of {} instances over {} regions".format(
+            args.fleet_instances,
+            args.fleet_regions
+        ))
+        benchmark_collectors(fleet, args.max_workers)
+
+    if "filters" in selected:
+        fleet = mock_aws.SyntheticFleet(
+            region_count=args.fleet_regions,
+            instance_count=args.fleet_instances,
+            reservation_count=args.fleet_reservations,
+            load_balancer_count=args.fleet_load_balancers,
+            v2_load_balancer_count=args.fleet_v2_load_balancers,
+            target_group_count=args.fleet_target_groups,
+            autoscaling_group_count=args.fleet_autoscaling_groups,
+            latency=args.fleet_latency,
+            terminated_ratio=args.terminated_ratio,
+            count_bytes=True
+        )
+        print("filtered fetch_data over a synthetic fleet of {} instances, {:.0%} terminated, over {} regions".format(
+            args.fleet_instances,
+            args.terminated_ratio,
+            args.fleet_regions
+        ))
+        benchmark_filters(fleet, args.max_workers)
+
+    if "startup" in selected:
+        print("startup of the entry points in fresh interpreters")
+        benchmark_startup(args.import_budget / 1000.0)
+
+    if "prices" in selected:
+        fleet = mock_aws.SyntheticFleet(
+            region_count=args.fleet_regions,
+            latency=args.fleet_latency,
+            count_bytes=True
+        )
+        print("price table of the instance types of a synthetic fleet over {} regions with {}s per call".format(
+            args.fleet_regions,
+            args.fleet_latency
+        ))
+        benchmark_prices(fleet, args.max_workers)
+
+    if "end-to-end" in selected:
+        fleet = mock_aws.SyntheticFleet(
+            region_count=args.fleet_regions,
+            instance_count=args.fleet_instances,
+            reservation_count=args.fleet_reservations,
+            load_balancer_count=args.fleet_load_balancers,
+            v2_load_balancer_count=args.fleet_v2_load_balancers,
+            target_group_count=args.fleet_target_groups,
+            autoscaling_group_count=args.fleet_autoscaling_groups,
+            latency=args.fleet_latency,
+            throttle_rate=args.throttle_rate
+        )
+        print("entry points against a synthetic fleet of {} instances over {} regions "
+              "with {}s per call and {:.0%} throttled".format(
+                  args.fleet_instances,
+                  args.fleet_regions,
+                  args.fleet_latency,
+                  args.throttle_rate
+              ))
+        benchmark_end_to_end(fleet, args.max_workers)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""
+Caches boto3 sessions and clients so that every region worker reuses the
+clients, loaded service models and connection pools built for earlier regions
+and runs instead of building five new clients per region, and resolves the
+account id of every set of credentials once
+"""
+import threading
+import time
+
+# Connections every client keeps open, enough for the concurrent page and
+# target health requests of a region worker
+DEFAULT_MAX_POOL_CONNECTIONS = 32
+
+# Attempts of every call before a throttling or transient error is raised
+DEFAULT_MAX_ATTEMPTS = 10
+
+# Services of the clients of a region worker
+REGION_SERVICES = ("ec2", "elb", "elbv2", "autoscaling")
+
+def client_config(max_pool_connections=DEFAULT_MAX_POOL_CONNECTIONS, max_attempts=DEFAULT_MAX_ATTEMPTS,
+                  retry_mode="adaptive"):
+    """
+    Returns the botocore Config of the pooled clients, retrying by default
+    with the adaptive mode that slows the client down when it gets throttled
+    Parameters :
+    max_pool_connections - connections every client keeps open
+    max_attempts - attempts of every call
+    retry_mode - botocore retry mode
+    """
+    from botocore.config import Config
+
+    return Config(
+        max_pool_connections=max_pool_connections,
+        retries={"max_attempts": max_attempts, "mode": retry_mode}
+    )
+
+class ClientPool(object):
+    """
+    Sessions per set of credentials and clients per (credentials, region, service).
+    Credentials are an (access_key_id, secret_access_key, session_token) tuple,
+    or None for the credentials and config stored in the .aws file. Clients are
+    thread safe once built, building them is serialized by the pool. When
+    metrics are given, every client built is instrumented with them, when
+    a ResponseCache is given, every client serves its cached operations from it,
+    and when an AdaptiveRateLimiter is given, every client takes its attempts
+    from the limiter's buckets, which replace the per-client rate limiting of
+    the adaptive retry mode
+    """
+
+    def __init__(self, max_pool_connections=DEFAULT_MAX_POOL_CONNECTIONS, max_attempts=DEFAULT_MAX_ATTEMPTS,
+                 metrics=None, cache=None, rate_limiter=None):
+        self.config = client_config(
+            max_pool_connections,
+            max_attempts,
+            "adaptive" if rate_limiter is None else "standard"
+        )
+        self.metrics = metrics
+        self.cache = cache
+        self.rate_limiter = rate_limiter
+        self.lock = threading.Lock()
+        self.account_lock = threading.Lock()
+        self.sessions = {}
+        self.clients = {}
+        self.account_ids = {}
+        self.setup_seconds = {}
+
+    def session(self, credentials=None):
+        """
+        Returns the cached boto3 session of the credentials
+        """
+        with self.lock:
+            return self._session(credentials)
+
+    def _session(self, credentials):
+        session = self.sessions.get(credentials)
+        if session is None:
+            # boto3 takes a few hundred milliseconds to import, paid by the first session only
+            import boto3
+
+            if credentials is None:
+                session = boto3.session.Session()
+            else:
+                access_key_id, secret_access_key, session_token = credentials
+                session = boto3.session.Session(
+                    aws_access_key_id=access_key_id,
+                    aws_secret_access_key=secret_access_key,
+                    aws_session_token=session_token
+                )
+            self.sessions[credentials] = session
+        return session
+
+    def client(self, service, region, credentials=None):
+        """
+        Returns the cached client of a service in a region
+        Parameters :
+        service - boto3 service name such as ec2
+        region - AWS region of the client, or None for the session default
+        credentials - credentials tuple, or None for the .aws file
+        """
+        key = (credentials, region, service)
+        client = self.clients.get(key)
+        if client is None:
+            with self.lock:
+                client = self.clients.get(key)
+                if client is None:
+                    client = self._session(credentials).client(service, region_name=region, config=self.config)
+                    if self.metrics is not None:
+                        self.metrics.instrument(client, lambda: self.account_ids.get(credentials))
+                    if self.cache is not None and service != "sts":
+                        self.cache.instrument(client, lambda: self.account_id(region, credentials))
+                    if self.rate_limiter is not None:
+                        self.rate_limiter.instrument(client, lambda: self.account_ids.get(credentials))
+                    self.clients[key] = client
+        return client
+
+    def account_id(self, region=None, credentials=None):
+        """
+        Returns the account id of the credentials, calling sts only the first time
+        Parameters :
+        region - AWS region of the sts client used for the first call
+        credentials - credentials tuple, or None for the .aws file
+        """
+        account_id = self.account_ids.get(credentials)
+        if account_id is None:
+            with self.account_lock:
+                account_id = self.account_ids.get(credentials)
+                if account_id is None:
+                    account_id = self.client("sts", region, credentials).get_caller_identity()["Account"]
+                    self.account_ids[credentials] = account_id
+        return account_id
+
+    def release(self, credentials):
+        """
+        Drops the session, clients, account id and setup times of credentials
+        that are no longer used, such as the expired role of a collected account
+        """
+        with self.lock:
+            self.sessions.pop(credentials, None)
+            for key in [key for key in self.clients if key[0] == credentials]:
+                del self.clients[key]
+            for key in [key for key in self.setup_seconds if key[0] == credentials]:
+                del self.setup_seconds[key]
+        with self.account_lock:
+            self.account_ids.pop(credentials, None)
+
+    def region_clients(self, region, credentials=None, services=REGION_SERVICES):
+        """
+        Returns a dictionary of service name to client of a region and the
+        account id, as a (clients, account_id) tuple, recording how long
+        getting them took in setup_seconds
+        Parameters :
+        region - AWS region of the clients
+        credentials - credentials tuple, or None for the .aws file
+        services - boto3 service names of the clients
+        """
+        start = time.perf_counter()
+        clients = {service: self.client(service, region, credentials) for service in services}
+        account_id = self.account_id(region, credentials)
+        self.setup_seconds[(credentials, region)] = time.perf_counter() - start
+        return clients, account_id
+
+    def print_setup_summary(self, credentials=None):
+        """
+        Prints the number of regions set up with the credentials and their
+        total and slowest setup time
+        Parameters :
+        credentials - credentials tuple, or None for the .aws file
+        """
+        setup_seconds = {
+            region: seconds for (key, region), seconds in self.setup_seconds.items() if key == credentials
+        }
+        if not setup_seconds:
+            return
+        slowest = max(setup_seconds, key=setup_seconds.get)
+        print("Client setup of {} regions took {:.3f}s, slowest {} {:.3f}s".format(
+            len(setup_seconds),
+            sum(setup_seconds.values()),
+            slowest,
+            setup_seconds[slowest]
+        ))
@@ -0,0 +1,102 @@
+"""
+Server side filters and client side projection of the instances and
+reserved instances. Filters are given as name=values arguments and turned
+into the Filters of the calls they apply to, so the records a run does not
+want never leave AWS:
+state=active - instances pending, running, stopping or stopped and active reserved instances
+state=<states> - instance and reserved instance states, each applied to the call it belongs to
+family=<families> - instance type families, e.g. family=m5,c5
+tag:<key>=<values> - resources tagged with the key and one of the values
+tag-key=<keys> - resources tagged with one of the keys
+asg=<names> - instances of the auto scaling groups, asg=* for those of any group
+The projection keeps only the fields of the instances the inventory is read
+for and drops the block device mappings, network interfaces, metadata
+options and the like before the instances are annotated and serialized
+"""
+import argparse
+
+from inventory_model import AUTOSCALING_GROUP_TAG, INSTANCE_FIELDS, RESERVATION_FIELDS
+
+# States of the instances and of the reserved instances, told apart by the state filter
+INSTANCE_STATES = ("pending", "running", "shutting-down", "terminated", "stopping", "stopped")
+RESERVATION_STATES = ("payment-pending", "active", "payment-failed", "retired")
+
+# Instance states state=active stands for, the instances that are not going or gone
+ACTIVE_INSTANCE_STATES = ("pending", "running", "stopping", "stopped")
+
+# Names of the filters besides the tag:<key> ones
+FILTER_NAMES = ("state", "family", "tag-key", "asg")
+
+def parse_filter(value):
+    """
+    Returns the (name, values) of a name=values argument
+    """
+    name, separator, values = value.partition("=")
+    values = [item.strip() for item in values.split(",") if item.strip()]
+    if not separator or not values:
+        raise argparse.ArgumentTypeError("expected name=values, got " + value)
+    if name not in FILTER_NAMES and not (name.startswith("tag:") and len(name) > len("tag:")):
+        raise argparse.ArgumentTypeError(
+            "unknown filter {}, choose from {} or tag:<key>".format(name, ", ".join(FILTER_NAMES))
+        )
+    if name == "state":
+        unknown = sorted(set(values).difference(INSTANCE_STATES + RESERVATION_STATES))
+        if unknown:
+            raise argparse.ArgumentTypeError("unknown states " + ", ".join(unknown))
+    return name, values
+
+def call_filters(filters):
+    """
+    Returns the Filters of the describe_instances and describe_reserved_instances
+    calls, keyed by the name of their collector. A state filter only filters
+    the calls whose states it names, so state=running leaves the reserved
+    instances unfiltered
+    Parameters :
+    filters - list of (name, values) from parse_filter
+    """
+    instance_filters = []
+    reservation_filters = []
+    for name, values in filters:
+        if name == "state":
+            instance_states = [
+                state
+                for value in values
+                for state in (ACTIVE_INSTANCE_STATES if value == "active" else (value,))
+                if state in INSTANCE_STATES
+            ]
+            reservation_states = [value for value in values if value in RESERVATION_STATES]
+            if instance_states:
+                instance_filters.append({"Name": "instance-state-name", "Values": instance_states})
+            if reservation_states:
+                reservation_filters.append({"Name": "state", "Values": reservation_states})
+        elif name == "family":
+            types = [family if "." in family else family + ".*" for family in values]
+            instance_filters.append({"Name": "instance-type", "Values": types})
+            reservation_filters.append({"Name": "instance-type", "Values": types})
+        elif name == "asg":
+            if "*" in values:
+                instance_filters.append({"Name": "tag-key", "Values": [AUTOSCALING_GROUP_TAG]})
+            else:
+                instance_filters.append({"Name": "tag:" + AUTOSCALING_GROUP_TAG, "Values": values})
+        else:
+            instance_filters.append({"Name": name, "Values": values})
+            reservation_filters.append({"Name": name, "Values": values})
+    call_filters_by_collector = {}
+    if instance_filters:
+        call_filters_by_collector["instances"] = instance_filters
+    if reservation_filters:
+        call_filters_by_collector["reservations"] = reservation_filters
+    return call_filters_by_collector
+
+def project_reservations(reservations):
+    """
+    Yields the reservations of describe_instances with only the
+    RESERVATION_FIELDS, and their instances with only the INSTANCE_FIELDS
+    """
+    for reservation in reservations:
+        projected = {key: reservation[key] for key in RESERVATION_FIELDS if key in reservation}
+        projected["Instances"] = [
+            {key: instance[key] for key in INSTANCE_FIELDS if key in instance}
+            for instance in reservation["Instances"]
+        ]
+        yield projected
@@ -0,0 +1,287 @@
+"""
+This script flattens the inventory files written by fetch_inventory.py and
+get_inventory.py into typed Arrow tables and stores them as Parquet files,
+one row per instance, reserved instance and auto scaling group
+"""
+import argparse
+import datetime
+import os
+
+from inventory_model import AUTOSCALING_GROUP_TAG, EMR_CLUSTER_TAG, load_balancer_names
+from inventory_stream import COMPRESSION_SUFFIXES, iter_inventory_records
+from reservation_matcher import normalize_platform
+
+# Number of rows converted to Arrow and written as one Parquet row group
+BATCH_SIZE = 65536
+
+def parse_timestamp(value):
+    """
+    Returns the datetime of a timestamp as written by the collectors, or None
+    Parameters :
+    value - timestamp string such as 2019-10-21T12:32:41+00:00 or 2019-10-21 12:32:41+00:00
+    """
+    if not value:
+        return None
+    # msgspec writes UTC timestamps with a Z suffix
+    if value.endswith("Z"):
+        value = value[:-1] + "+00:00"
+    timestamp = datetime.datetime.fromisoformat(value)
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=datetime.timezone.utc)
+    return timestamp
+
+def flatten_instances(reservations):
+    """
+    Yields one row per instance of the reservations
+    Parameters :
+    reservations - iterable of stamped reservations from instances.json
+    """
+    for reservation in reservations:
+        for instance in reservation["Instances"]:
+            placement = instance.get("Placement", {})
+            tags = {tag["Key"]: tag["Value"] for tag in instance.get("Tags", [])}
+            yield {
+                "account_id": reservation.get("account_id"),
+                "region": reservation.get("region"),
+                "reservation_id": reservation.get("ReservationId"),
+                "instance_id": instance["InstanceId"],
+                "instance_type": instance.get("InstanceType"),
+                "state": instance.get("State", {}).get("Name"),
+                "lifecycle": instance.get("InstanceLifecycle", "on-demand"),
+                "spot": instance.get("spot", instance.get("InstanceLifecycle") == "spot"),
+                "platform": normalize_platform(instance.get("PlatformDetails") or instance.get("Platform")),
+                "availability_zone": placement.get("AvailabilityZone"),
+                "tenancy": placement.get("Tenancy"),
+                "launch_time": parse_timestamp(instance.get("LaunchTime")),
+                "autoscaling_group": tags.get(AUTOSCALING_GROUP_TAG),
+                "emr_cluster_id": tags.get(EMR_CLUSTER_TAG),
+                "load_balancer_names": load_balancer_names(instance.get("LoadBalancerName")),
+                "image_id": instance.get("ImageId"),
+                "vpc_id": instance.get("VpcId"),
+                "subnet_id": instance.get("SubnetId")
+            }
+
+def flatten_reservations(reserved_instances):
+    """
+    Yields one row per reserved instance purchase
+    Parameters :
+    reserved_instances - iterable of stamped records from reservations.json
+    """
+    for reserved_instance in reserved_instances:
+        yield {
+            "account_id": reserved_instance.get("account_id"),
+            "region": reserved_instance.get("region"),
+            "reserved_instances_id": reserved_instance["ReservedInstancesId"],
+            "instance_type": reserved_instance.get("InstanceType"),
+            "availability_zone": reserved_instance.get("AvailabilityZone"),
+            "scope": reserved_instance.get("Scope"),
+            "product_description": reserved_instance.get("ProductDescription"),
+            "instance_tenancy": reserved_instance.get("InstanceTenancy"),
+            "offering_class": reserved_instance.get("OfferingClass"),
+            "offering_type": reserved_instance.get("OfferingType"),
+            "state": reserved_instance.get("State"),
+            "instance_count": reserved_instance.get("InstanceCount"),
+            "duration": reserved_instance.get("Duration"),
+            "fixed_price": reserved_instance.get("FixedPrice"),
+            "usage_price": reserved_instance.get("UsagePrice"),
+            "currency_code": reserved_instance.get("CurrencyCode"),
+            "start": parse_timestamp(reserved_instance.get("Start")),
+            "end": parse_timestamp(reserved_instance.get("End"))
+        }
+
+def flatten_autoscaling_groups(autoscaling_groups):
+    """
+    Yields one row per auto scaling group
+    Parameters :
+    autoscaling_groups - iterable of stamped records from autoscaling_groups.json
+    """
+    for autoscaling_group in autoscaling_groups:
+        yield {
+            "account_id": autoscaling_group.get("account_id"),
+            "region": autoscaling_group.get("region"),
+            "autoscaling_group_name": autoscaling_group["AutoScalingGroupName"],
+            "autoscaling_group_arn": autoscaling_group.get("AutoScalingGroupARN"),
+            "launch_configuration_name": autoscaling_group.get("LaunchConfigurationName"),
+            "min_size": autoscaling_group.get("MinSize"),
+            "max_size": autoscaling_group.get("MaxSize"),
+            "desired_capacity": autoscaling_group.get("DesiredCapacity"),
+            "availability_zones": autoscaling_group.get("AvailabilityZones", []),
+            "load_balancer_names": autoscaling_group.get("LoadBalancerNames", []),
+            "target_group_arns": autoscaling_group.get("TargetGroupARNs", []),
+            "instance_ids": [
+                instance["InstanceId"] for instance in autoscaling_group.get("Instances", [])
+            ],
+            "created_time": parse_timestamp(autoscaling_group.get("CreatedTime"))
+        }
+
+def table_schemas():
+    """
+    Returns the Arrow schema of every exported table, with the low cardinality
+    string columns dictionary encoded
+    """
+    import pyarrow
+
+    category = pyarrow.dictionary(pyarrow.int32(), pyarrow.string())
+    timestamp = pyarrow.timestamp("us", tz="UTC")
+    return {
+        "instances": pyarrow.schema([
+            ("account_id", category),
+            ("region", category),
+            ("reservation_id", pyarrow.string()),
+            ("instance_id", pyarrow.string()),
+            ("instance_type", category),
+            ("state", category),
+            ("lifecycle", category),
+            ("spot", pyarrow.bool_()),
+            ("platform", category),
+            ("availability_zone", category),
+            ("tenancy", category),
+            ("launch_time", timestamp),
+            ("autoscaling_group", category),
+            ("emr_cluster_id", category),
+            ("load_balancer_names", pyarrow.list_(category)),
+            ("image_id", category),
+            ("vpc_id", category),
+            ("subnet_id", category)
+        ]),
+        "reservations": pyarrow.schema([
+            ("account_id", category),
+            ("region", category),
+            ("reserved_instances_id", pyarrow.string()),
+            ("instance_type", category),
+            ("availability_zone", category),
+            ("scope", category),
+            ("product_description", category),
+            ("instance_tenancy", category),
+            ("offering_class", category),
+            ("offering_type", category),
+            ("state", category),
+            ("instance_count", pyarrow.int32()),
+            ("duration", pyarrow.int64()),
+            ("fixed_price", pyarrow.float64()),
+            ("usage_price", pyarrow.float64()),
+            ("currency_code", category),
+            ("start", timestamp),
+            ("end", timestamp)
+        ]),
+        "autoscaling_groups": pyarrow.schema([
+            ("account_id", category),
+            ("region", category),
+            ("autoscaling_group_name", pyarrow.string()),
+            ("autoscaling_group_arn", pyarrow.string()),
+            ("launch_configuration_name", category),
+            ("min_size", pyarrow.int32()),
+            ("max_size", pyarrow.int32()),
+            ("desired_capacity", pyarrow.int32()),
+            ("availability_zones", pyarrow.list_(category)),
+            ("load_balancer_names", pyarrow.list_(category)),
+            ("target_group_arns", pyarrow.list_(pyarrow.string())),
+            ("instance_ids", pyarrow.list_(pyarrow.string())),
+            ("created_time", timestamp)
+        ])
+    }
+
+# Inventory file, json field and flattening of every exported table
+EXPORTS = {
+    "instances": ("instances", "instances", flatten_instances),
+    "reservations": ("reservations", "reservations", flatten_reservations),
+    "autoscaling_groups": ("autoscaling_groups", "autoscaling_groups", flatten_autoscaling_groups)
+}
+
+def find_inventory_file(inventory_dir, name):
+    """
+    Returns the path of the inventory file called name in any of the formats
+    and compressions the collectors write, or None when there is none. When
+    runs in several formats left a file each, the most recently modified one
+    is returned, as the others are left over from earlier runs
+    Parameters :
+    inventory_dir - directory holding the inventory files
+    name - inventory file name without extension, e.g. instances
+    """
+    paths = []
+    for extension in (".json", ".ndjson"):
+        for suffix in [""] + list(COMPRESSION_SUFFIXES.values()):
+            path = os.path.join(inventory_dir, name + extension + suffix)
+            try:
+                paths.append((os.stat(path).st_mtime_ns, path))
+            except FileNotFoundError:
+                continue
+    if not paths:
+        return None
+    return max(paths, key=lambda modified_path: modified_path[0])[1]
+
+def write_parquet(rows, schema, path, batch_size=BATCH_SIZE):
+    """
+    Writes the rows to a Parquet file batch_size rows at a time
+    Returns the number of rows written
+    Parameters :
+    rows - iterable of row dictionaries matching the schema
+    schema - Arrow schema of the table
+    path - path of the Parquet file
+    batch_size - number of rows per row group
+    """
+    import pyarrow
+    import pyarrow.parquet
+
+    count = 0
+    with pyarrow.parquet.ParquetWriter(path, schema, compression="zstd") as writer:
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == batch_size:
+                writer.write_table(pyarrow.Table.from_pylist(batch, schema=schema))
+                count += len(batch)
+                batch = []
+        if batch or not count:
+            writer.write_table(pyarrow.Table.from_pylist(batch, schema=schema))
+            count += len(batch)
+    return count
+
+def export_inventory(inventory_dir, output_dir, batch_size=BATCH_SIZE):
+    """
+    Exports the instances, reservations and auto scaling groups found in
+    inventory_dir as Parquet files into output_dir
+    Returns a dictionary of table name to the number of rows written
+    Parameters :
+    inventory_dir - directory holding the inventory files
+    output_dir - directory the Parquet files are written to
+    batch_size - number of rows per row group
+    """
+    schemas = table_schemas()
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    counts = {}
+    for table_name, (file_name, field, flatten) in EXPORTS.items():
+        path = find_inventory_file(inventory_dir, file_name)
+        if path is None:
+            continue
+        counts[table_name] = write_parquet(
+            flatten(iter_inventory_records(path, field)),
+            schemas[table_name],
+            os.path.join(output_dir, table_name + ".parquet"),
+            batch_size
+        )
+    return counts
+
+def main(argv=None):
+    """
+    Parses the command line arguments and exports the inventory files to
+    Parquet files, printing the rows of every table
+    Parameters :
+    argv - command line arguments, sys.argv[1:] when None
+    """
+    # Initializing the parser
+    parser = argparse.ArgumentParser()
+
+    # Adding parameters
+    parser.add_argument("--inventory-dir", default="./inventory", help="Directory of the inventory files")
+    parser.add_argument("--output-dir", default="./inventory/parquet", help="Directory of the Parquet files")
+
+    # Parse the arguments
+    args = parser.parse_args(argv)
+
+    for table_name, row_count in export_inventory(args.inventory_dir, args.output_dir).items():
+        print("{}: {} rows".format(table_name, row_count))
+
+if __name__ == "__main__":
+    main()
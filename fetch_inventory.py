@@ -2,149 +2,148 @@
 This script needs to be run on an aws instance and it will generate instances,
 load_balancers, v2_load_balancers, autoscaling_groups json files
 """
-import boto3
-import datetime
-import json
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-def get_aws_data_for_region(region):
+from client_pool import ClientPool
+from collection_filters import parse_filter
+from instrumentation import CallMetrics, StageProfiler
+from inventory_model import track_instance_records
+from inventory_store import InventoryStore
+from inventory_stream import (
+    COMPRESSIONS,
+    OUTPUT_FORMATS,
+    inventory_file_path,
+    iter_non_empty,
+    open_inventory_file,
+    write_records
+)
+from rate_limiter import AdaptiveRateLimiter
+from relationship_index import RelationshipIndex
+from resource_collectors import COLLECTORS, CollectionPlan, collect_region, parse_resources
+from response_cache import DEFAULT_CACHE_FILE, ResponseCache
+from run_checkpoint import RunCheckpoint
+from serializers import SERIALIZER_NAMES
+from snapshot_store import SnapshotStore
+
+# Default number of regions fetched at the same time
+DEFAULT_MAX_WORKERS = 8
+
+# Directory the inventory files are written to
+DEFAULT_INVENTORY_DIR = "./inventory"
+
+# Serializes appends to the shared ./inventory/*.json files across region workers
+INVENTORY_FILE_LOCK = threading.Lock()
+
+def get_aws_data_for_region(region, output_format="json", compression=None, snapshot_store=None,
+                            instance_records=None, client_pool=None, credentials=None,
+                            inventory_dir=DEFAULT_INVENTORY_DIR, stage_profiler=None, relationship_dir=None,
+                            serializer=None, checkpoint=None, plan=None):
     """
     Fetching aws data using boto3 and the credentials and config details stored in
     .aws file and writing it into respective json files
+    Parameters :
+    region - AWS region to fetch the data from
+    output_format - format of the inventory files, json or ndjson
+    compression - compression of the inventory files, gzip, zstd or None
+    snapshot_store - SnapshotStore recording the records for the delta files, or None
+    instance_records - list the InstanceRecords of the region are appended to, or None
+    client_pool - ClientPool shared by the region workers, or None for a new one
+    credentials - (access_key_id, secret_access_key, session_token) tuple, or None for the .aws file
+    inventory_dir - directory the inventory files are written to
+    stage_profiler - StageProfiler capturing the fetch, annotate and serialize stages, or None
+    relationship_dir - directory the RelationshipIndex of the region is kept in between runs,
+                       or None to look up every target group
+    serializer - serializer backend of the inventory files, one of SERIALIZER_NAMES or None for the fastest
+    checkpoint - RunCheckpoint the resource types of the region are written to as units, skipping
+                 the units it already completed, or None to append to the inventory files
+    plan - CollectionPlan of the resources to fetch, or None for every resource
     """
     try:
-        # Using boto3 to get ec2
-        ec2_response = boto3.client("ec2",region_name=region)
-
-        # Using boto3 to get elb
-        elb_response = boto3.client("elb",region_name=region)
-
-        # Using boto3 to get elb_v2
-        elbv2_response = boto3.client("elbv2",region_name=region)
-
-        # Using boto3 to get asg
-        asg_response = boto3.client("autoscaling",region_name=region)
-
-        # Using boto3 to get sts
-        sts_response = boto3.client("sts",region_name=region)
-
-        # Get aws_account_id from sts
-        account_id = sts_response.get_caller_identity()["Account"]
-
-        # Extracting all the instances and reserved instances from the response
-        if ec2_response is not None:
-            ec2_instances = ec2_response.describe_instances()
-            ec2_reserved_instances = ec2_response.describe_reserved_instances()
-        else:
-            ec2_instances = None
-            ec2_reserved_instances = None
-
-        # Extracting all the v1 load_balancers from the response
-        if elb_response is not None:
-            load_balancers = elb_response.describe_load_balancers()
-        else:
-            load_balancers = None
-
-        # Extracting all the v2 load_balancers from the response
-        if elbv2_response is not None:
-            v2_load_balancers = elbv2_response.describe_load_balancers()
-        else:
-            v2_load_balancers = None
-
-        # Extracting all asg groups
-        if asg_response is not None:
-            asg_groups = asg_response.describe_auto_scaling_groups()
-        else:
-            asg_groups = None
-
-        # Getting a map of instance_id to load_balancer_name for v1_load_balancers
-        instance_to_v1_load_balancer_map = instance_to_v1_load_balancers_map(load_balancers)
-
-        # Getting a map of instance_id to load_balancer_name for v2_load_balancers
-        instance_to_v2_load_balancer_map = instance_to_v2_load_balancers_map(v2_load_balancers,elbv2_response)
-
-        for ec2_instance in ec2_instances['Reservations']:
-            for ec2i in ec2_instance["Instances"]:
-                if ec2i.get('InstanceLifecycle') == 'spot':
-                    ec2i['spot'] = True
-                else:
-                    ec2i['spot'] = False
-                id = ec2i["InstanceId"]
-                lb_v1 = instance_to_v1_load_balancer_map.get(id)
-                lb_v2 = instance_to_v2_load_balancer_map.get(id)
-                if lb_v1 is not None:
-                    ec2i["LoadBalancerName"] = lb_v1
-                elif lb_v2 is not None:
-                    ec2i["LoadBalancerName"] = lb_v2
-                else:
-                    ec2i["LoadBalancerName"] = None
-
-    
-        # Stores the instances into instances.json
-        if (ec2_instances["Reservations"] and len(ec2_instances["Reservations"])):
-            instances_file = open("./inventory/instances.json","a+")
-            create_json_file(
-                instances_file,
-                ec2_instances,
-                "Reservations",
-                "instances",
-                account_id,
-                region
-            )
-            instances_file.close()
-
-        # Stores the reserved instances into reservations.json
-        if (ec2_reserved_instances["ReservedInstances"] and len(ec2_reserved_instances["ReservedInstances"])):
-            reservations_file = open("./inventory/reservations.json","a+")
-            create_json_file(
-                reservations_file,
-                ec2_reserved_instances,
-                "ReservedInstances",
-                "reservations",
-                account_id,
-                region
-            )
-            reservations_file.close()
-
-        # Stores v1_load_balancers into load_balancers.json
-        if (load_balancers["LoadBalancerDescriptions"] and len(load_balancers["LoadBalancerDescriptions"])):
-            load_balancers_file = open("./inventory/load_balancers.json","a+")
-            create_json_file_for_load_balancers(
-                load_balancers_file,
-                load_balancers,
-                "LoadBalancerDescriptions",
-                "load_balancers",
-                "elb",
-                account_id,
-                region
-            )
-            load_balancers_file.close()
-
-        # Stores v2_load_balancers into v2_load_balancers.json
-        if (v2_load_balancers["LoadBalancers"] and len(v2_load_balancers["LoadBalancers"])):
-            v2_load_balancers_file = open("./inventory/v2_load_balancers.json","a+")
-            create_json_file_for_load_balancers(
-                v2_load_balancers_file,
-                v2_load_balancers,
-                "LoadBalancers",
-                "load_balancers",
-                "elbv2",
-                account_id,
-                region
-            )
-            v2_load_balancers_file.close()
-
-        # Stores all asg_groups into autoscaling_groups.json
-        if (asg_groups["AutoScalingGroups"] and len(asg_groups["AutoScalingGroups"])):
-            asg_file = open("./inventory/autoscaling_groups.json","a+")
-            create_json_file(
-                asg_file,
-                asg_groups,
-                "AutoScalingGroups",
-                "autoscaling_groups",
+        if plan is None:
+            plan = CollectionPlan()
+
+        # Reusing the clients of the services the plan calls and the account id
+        # the pool already holds, so only the first region pays for building them
+        if client_pool is None:
+            client_pool = ClientPool()
+        clients, account_id = client_pool.region_clients(region, credentials, plan.services)
+
+        def completed(resource_type):
+            # Units written by the run being resumed are not fetched again
+            return checkpoint is not None and checkpoint.completed(account_id, region, resource_type)
+
+        def tracked(resource_type, records):
+            # Recording the records for the snapshot when one is kept
+            if snapshot_store is None:
+                return records
+            return snapshot_store.track(resource_type, account_id, region, records)
+
+        def modelled(reservations):
+            # Keeping only the compact records of the instances in memory when asked to
+            if instance_records is None:
+                return reservations
+            return track_instance_records(reservations, account_id, region, instance_records)
+
+        def staged(stage, records):
+            # Profiling the work of producing the records as the stage when asked to
+            if stage_profiler is None:
+                return records
+            return stage_profiler.iterate(stage, records)
+
+        # Listing the load balancers and auto scaling groups the instances are
+        # related to concurrently and relating them, only for the resource
+        # types of the plan whose units are missing
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            outputs = collect_region(
+                plan,
+                clients,
                 account_id,
-                region
+                region,
+                completed=completed,
+                relationship_dir=relationship_dir,
+                healthy_only=True,
+                executor=executor,
+                staged=staged
             )
-            asg_file.close()
+
+        if "instances" in plan.written and completed("instances") and instance_records is not None:
+            # Reading the instances written by the run being resumed back for the store
+            for _ in modelled(checkpoint.iter_unit_records(account_id, region, "instances", "instances")):
+                pass
+
+        # Serializing the records into the inventory files, profiled when asked to
+        write_file = create_json_file
+        write_load_balancers_file = create_json_file_for_load_balancers
+        if stage_profiler is not None:
+            write_file = stage_profiler.wrap("serialize", create_json_file)
+            write_load_balancers_file = stage_profiler.wrap("serialize", create_json_file_for_load_balancers)
+
+        # Streaming the instances and reserved instances page by page into their
+        # json files while the load balancers and asg groups are written out
+        with ThreadPoolExecutor(max_workers=max(1, len(outputs))) as executor:
+            futures = []
+            for collector, records in outputs:
+                records = tracked(collector.name, records)
+                if collector.name == "instances":
+                    records = modelled(records)
+                path = os.path.join(inventory_dir, collector.name + ".json")
+                if collector.version is None:
+                    futures.append(executor.submit(
+                        write_file, path, records, collector.field, account_id, region,
+                        output_format, compression, serializer, checkpoint
+                    ))
+                else:
+                    futures.append(executor.submit(
+                        write_load_balancers_file, path, records, collector.field, collector.version,
+                        account_id, region, output_format, compression, serializer, checkpoint
+                    ))
+        for future in futures:
+            future.result()
 
     except Exception as custom_error:
         print(custom_error)
@@ -153,116 +152,330 @@ def instance_to_v1_load_balancers_map(load_balancers):
     """
     Returns a dictionary of instance_id to v1_load_balancer_name
     of all instances under v1 load balancers
-    Parameters : 
-    load_balancers - list of v1 load balancers
+    Parameters :
+    load_balancers - describe_load_balancers response of elb
     """
-    instance_to_v1_load_balancer_map = {}
-    for load_balancer in load_balancers["LoadBalancerDescriptions"]:
-        for instance in load_balancer['Instances']:
-            list_of_load_balancer_names = instance_to_v1_load_balancer_map.get(instance["InstanceId"])
-            if list_of_load_balancer_names is None:
-                list_of_load_balancer_names = []
-                list_of_load_balancer_names.append(load_balancer["LoadBalancerName"])
-                instance_to_v1_load_balancer_map[instance["InstanceId"]] = list_of_load_balancer_names
-            else:
-                list_of_load_balancer_names.append(load_balancer["LoadBalancerName"])
-                instance_to_v1_load_balancer_map[instance["InstanceId"]] = list_of_load_balancer_names
-    return instance_to_v1_load_balancer_map
+    relationship_index = RelationshipIndex()
+    relationship_index.update_load_balancers(load_balancers["LoadBalancerDescriptions"])
+    return relationship_index.instance_to_load_balancers_map()
 
 def instance_to_v2_load_balancers_map(v2_load_balancers, elbv2_response):
     """
     Returns a dictionary of instance_id to v2_load_balancer_name
-    of all instances under v2 load balancers
+    of all healthy instances under v2 load balancers
     Parameters :
-    v2_load_balancers - list of v2 load balancers
+    v2_load_balancers - describe_load_balancers response of elbv2
+    elbv2_response - boto3 elbv2 client of the region
     """
-    instance_to_v2_load_balancer_map = {}
-    for elbv2_lb in v2_load_balancers["LoadBalancers"]:
-        load_balancer_arn = elbv2_lb['LoadBalancerArn']
-        load_balancer_name = elbv2_lb["LoadBalancerName"]
-        target_groups = elbv2_response.describe_target_groups(
-                    LoadBalancerArn=load_balancer_arn
-                )
-        if target_groups is None:
-            continue
-                
-        for target_group in target_groups["TargetGroups"]:
-            target_group_arn = target_group['TargetGroupArn']
-
-            target_healths = elbv2_response.describe_target_health(
-                TargetGroupArn=target_group_arn
-                )
-            
-            if target_healths is None:
-                continue
-
-            for target_health in target_healths["TargetHealthDescriptions"]:
-                if target_health['TargetHealth']['State'] == 'healthy':
-                    list_of_v2_load_balancer_names = instance_to_v2_load_balancer_map.get(
-                        target_health["Target"]["Id"]
-                        )
-                    if list_of_v2_load_balancer_names is None:
-                        list_of_v2_load_balancer_names = []
-                        list_of_v2_load_balancer_names.append(load_balancer_name)
-                        instance_to_v2_load_balancer_map[target_health["Target"]["Id"]] = list_of_v2_load_balancer_names
-                    else:
-                        list_of_v2_load_balancer_names.append(load_balancer_name)
-                        instance_to_v2_load_balancer_map[target_health["Target"]["Id"]] = list_of_v2_load_balancer_names
-    return instance_to_v2_load_balancer_map
-
-def create_json_file(file_name, dictionary, key, field, account_id, region):
+    relationship_index = RelationshipIndex()
+    relationship_index.refresh(elbv2_response, [], v2_load_balancers["LoadBalancers"], [])
+    return relationship_index.instance_to_load_balancers_map(healthy_only=True)
+
+def create_json_file(path, records, field, account_id, region, output_format="json", compression=None,
+                     serializer=None, checkpoint=None):
     """
-    This will accept the parameters and create the json files
+    This will accept the parameters and append the records of the region
+    to the json file at path, or write them as a unit of the checkpoint
     """
-    data = {}
-    data["account_id"] = account_id
-    data["region"] = region
-    data[field] = dictionary[key]
-    json_data = json.dumps(data, default = myconverter)
-    file_name.write(json_data)
-
-def create_json_file_for_load_balancers(file_name, dictionary, key, field, version, account_id, region):
+    if checkpoint is not None:
+        checkpoint.write_unit(
+            account_id, region, inventory_resource_type(path), field, records,
+            [("account_id", account_id), ("region", region)], serializer=serializer
+        )
+        return
+    append_region_json_file(
+        path,
+        field,
+        records,
+        [("account_id", account_id), ("region", region)],
+        output_format=output_format,
+        compression=compression,
+        serializer=serializer
+    )
+
+def create_json_file_for_load_balancers(path, records, field, version, account_id, region,
+                                        output_format="json", compression=None, serializer=None, checkpoint=None):
     """
+    This will accept the parameters and append the load balancers of the region
+    along with their version to the json file at path, or write them as a unit
+    of the checkpoint
     """
-    data = {}
-    data["account_id"] = account_id
-    data["region"] = region
-    data[field] = dictionary[key]
-    data["version"] = version
-    json_data = json.dumps(data, default = myconverter)
-    file_name.write(json_data)
-    
-
-def fetch_data():
+    if checkpoint is not None:
+        checkpoint.write_unit(
+            account_id, region, inventory_resource_type(path), field, records,
+            [("account_id", account_id), ("region", region)], [("version", version)], serializer=serializer
+        )
+        return
+    append_region_json_file(
+        path,
+        field,
+        records,
+        [("account_id", account_id), ("region", region)],
+        [("version", version)],
+        output_format=output_format,
+        compression=compression,
+        serializer=serializer
+    )
+
+def inventory_resource_type(path):
+    """
+    Returns the resource type an inventory file path in the json format is named after
+    """
+    return os.path.basename(path)[:-len(".json")]
+
+def append_region_json_file(path, field, records, before, after=(), output_format="json", compression=None,
+                            serializer=None):
+    """
+    Streams the records into a temporary file and appends that to the inventory
+    file in one go, so regions finishing at the same time do not interleave.
+    Nothing is written when there are no records
+    Parameters :
+    path - json file in ./inventory to append to, renamed for ndjson and compression
+    field - key the records are stored under
+    records - iterable of the records
+    before - list of (key, value) pairs written before the records
+    after - list of (key, value) pairs written after the records
+    output_format - format of the inventory file, json or ndjson
+    compression - compression of the inventory file, gzip, zstd or None
+    serializer - serializer backend, one of SERIALIZER_NAMES or None for the fastest installed one
+    """
+    records = iter_non_empty(records)
+    if records is None:
+        return
+    with tempfile.TemporaryFile("w+b") as buffer:
+        write_records(buffer, output_format, field, records, before, after, serializer)
+        buffer.seek(0)
+        path = inventory_file_path(path, output_format, compression)
+        with INVENTORY_FILE_LOCK:
+            with open_inventory_file(path, "a+", compression) as inventory_file:
+                shutil.copyfileobj(buffer, inventory_file)
+
+def fetch_data(max_workers=DEFAULT_MAX_WORKERS, output_format="json", compression=None, snapshot_dir=None,
+               instance_records=None, client_pool=None, credentials=None, inventory_dir=DEFAULT_INVENTORY_DIR,
+               stage_profiler=None, relationship_dir=None, serializer=None, resume=False, resources=None,
+               filters=None, projection=False):
     """
     This function is called when the user does not pass the region
     as an argument and subsequently the inventory is fetched from all
-    aws regions and stored into a file
+    aws regions and stored into a file. Every resource type of every region
+    is checkpointed as it completes and the inventory files are replaced
+    once the regions are done, with the regions that failed left out of them
+    until a resumed run fetches them
+    Returns whether the run completed, False when some regions failed or the run did
+    not get to fetch them
     Parameters:
-    access_key_id - AWS access key id
-    secret_access_key - AWS secret access key
+    max_workers - number of regions fetched at the same time
+    output_format - format of the inventory files, json or ndjson
+    compression - compression of the inventory files, gzip, zstd or None
+    snapshot_dir - directory of the snapshot the delta files are written to, or None
+    instance_records - list the InstanceRecords of every region are appended to, or None
+    client_pool - ClientPool kept across runs, or None for a new one
+    credentials - (access_key_id, secret_access_key, session_token) tuple, or None for the .aws file
+    inventory_dir - directory the inventory files are written to
+    stage_profiler - StageProfiler capturing the fetch, annotate and serialize stages, or None
+    relationship_dir - directory the RelationshipIndex of every region is kept in between runs,
+                       or None to look up every target group
+    serializer - serializer backend of the inventory files, one of SERIALIZER_NAMES or None for the fastest
+    resume - only fetch the resource types of the regions the checkpoint of the previous run
+             in inventory_dir is missing, instead of fetching everything again
+    resources - names of the collectors of the resources to fetch, or None for every resource
+    filters - list of (name, values) filters of the instances and reserved instances, or None
+    projection - keep only the fields of the instances the inventory is read for
     """
     try:
-        ec2_regions = boto3.client(
-            "ec2",
-            "us-west-2"
-        )
+        # Planning only the calls the requested resources need, filtered server side
+        plan = CollectionPlan(resources, filters, projection)
+        print("Fetching " + ", ".join(plan.written) + " with " + ", ".join(plan.calls))
+
+        # Checkpointing every resource type of every region, keeping those of
+        # the previous run when resuming it
+        checkpoint = RunCheckpoint(inventory_dir, output_format, compression, resume=resume)
+
+        # Keeping a snapshot of the previous run to write only the changes
+        snapshot_store = SnapshotStore(snapshot_dir, serializer) if snapshot_dir else None
+
+        # Sharing the sessions, clients and account id across all region workers
+        if client_pool is None:
+            client_pool = ClientPool()
+
+        ec2_regions = client_pool.client("ec2", "us-west-2", credentials)
 
         # Getting all AWS regions
         regions = ec2_regions.describe_regions()
-        for region in regions["Regions"]:
-            print("For region "+region["RegionName"])
-            get_aws_data_for_region(
-                region=region["RegionName"]
+        region_names = [region["RegionName"] for region in regions["Regions"]]
+
+        # Fetching the regions concurrently, at most max_workers at a time
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            for region_name in region_names:
+                print("For region "+region_name)
+                executor.submit(
+                    get_aws_data_for_region,
+                    region=region_name,
+                    output_format=output_format,
+                    compression=compression,
+                    snapshot_store=snapshot_store,
+                    instance_records=instance_records,
+                    client_pool=client_pool,
+                    credentials=credentials,
+                    inventory_dir=inventory_dir,
+                    stage_profiler=stage_profiler,
+                    relationship_dir=relationship_dir,
+                    serializer=serializer,
+                    checkpoint=checkpoint,
+                    plan=plan
                 )
+
+        client_pool.print_setup_summary(credentials)
+
+        # Replacing the inventory files with the units of every region, and
+        # dropping the checkpoint when no region failed
+        account_id = client_pool.account_id("us-west-2", credentials)
+        checkpoint.assemble(account_id, region_names, plan.written)
+        complete = checkpoint.finish(account_id, region_names, plan.written)
+        if not complete:
+            print("Some regions failed, run again with --resume to fetch only them")
+
+        # Writing the delta files and the current view of the snapshot
+        if snapshot_store is not None:
+            for resource_type, (added, removed, changed) in snapshot_store.commit().items():
+                print("{}: {} added, {} removed, {} changed".format(resource_type, added, removed, changed))
         print("File executed successfully")
+        return complete
 
     except Exception as error:
         print(error)
+        return False
+
+def main(argv=None):
+    """
+    Parses the command line arguments and fetches the inventory of every
+    region into the inventory files
+    Parameters :
+    argv - command line arguments, sys.argv[1:] when None
+    """
+    # Initializing the parser
+    parser = argparse.ArgumentParser()
+
+    # Adding parameters
+    parser.add_argument(
+        "--max-workers",
+        type=int,
+        default=DEFAULT_MAX_WORKERS,
+        help="Number of regions fetched at the same time"
+    )
+    parser.add_argument(
+        "--format",
+        choices=OUTPUT_FORMATS,
+        default="json",
+        help="Write one json document per region or one record per line (ndjson)"
+    )
+    parser.add_argument("--compression", choices=COMPRESSIONS, help="Compress the inventory files")
+    parser.add_argument(
+        "--serializer",
+        choices=SERIALIZER_NAMES,
+        help="JSON backend of the inventory files, the fastest installed one by default"
+    )
+    parser.add_argument(
+        "--snapshot-dir",
+        help="Keep a snapshot in this directory and write only the changes since the last run"
+    )
+    parser.add_argument("--metrics-json", help="Write the per call metrics as a JSON summary to this file")
+    parser.add_argument("--metrics-prometheus", help="Write the per call metrics in Prometheus text format here")
+    parser.add_argument("--profile-dir", help="Write profiles of the fetch, annotate and serialize stages here")
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        help="Serve the regions, reserved instances and target groups from a response cache kept across runs, "
+             "up to 24, 6 and 1 hours old"
+    )
+    parser.add_argument("--cache-file", default=DEFAULT_CACHE_FILE, help="File of the response cache of --cache")
+    parser.add_argument("--refresh", action="store_true", help="Fetch the responses of --cache again")
+    parser.add_argument(
+        "--relationship-dir",
+        help="Keep the instance to load balancer index here and only look up the target groups that changed"
+    )
+    parser.add_argument("--store", help="Load the instances into this inventory store (SQLite file) as a new run")
+    parser.add_argument(
+        "--resources",
+        type=parse_resources,
+        help="Comma separated resources to fetch out of " + ", ".join(COLLECTORS) + ", all of them by default. "
+             "The instances are only annotated with their load balancers along with load_balancer_map"
+    )
+    parser.add_argument(
+        "--filter",
+        type=parse_filter,
+        action="append",
+        default=[],
+        help="Filter the instances and reserved instances server side, e.g. state=active, family=m5,c5, "
+             "tag:team=web, tag-key=owner or asg=* for the instances of any auto scaling group, repeatable"
+    )
+    parser.add_argument(
+        "--projection",
+        action="store_true",
+        help="Keep only the instance fields the inventory is read for, dropping devices, interfaces and the like"
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Only fetch the regions and resource types the previous run in ./inventory did not complete"
+    )
+    parser.add_argument(
+        "--no-rate-limit",
+        action="store_true",
+        help="Send the calls as fast as botocore's adaptive retries allow instead of pacing them to the API quotas"
+    )
+
+    # Parse the arguments
+    args = parser.parse_args(argv)
+
+    # Instrumenting every client when the metrics are exported
+    metrics = CallMetrics() if args.metrics_json or args.metrics_prometheus else None
+    stage_profiler = StageProfiler(args.profile_dir) if args.profile_dir else None
+
+    # Serving the slow-changing responses from the cache kept across runs
+    cache = ResponseCache(args.cache_file, refresh=args.refresh) if args.cache else None
+
+    # Pacing the calls of every account, region and service to its API quota
+    rate_limiter = None if args.no_rate_limit else AdaptiveRateLimiter()
+
+    # Keeping the records of the instances to load them into the store
+    instance_records = [] if args.store else None
+
+    fetch_data(
+        max_workers=args.max_workers,
+        output_format=args.format,
+        compression=args.compression,
+        snapshot_dir=args.snapshot_dir,
+        instance_records=instance_records,
+        client_pool=ClientPool(metrics=metrics, cache=cache, rate_limiter=rate_limiter),
+        stage_profiler=stage_profiler,
+        relationship_dir=args.relationship_dir,
+        serializer=args.serializer,
+        resume=args.resume,
+        resources=args.resources,
+        filters=args.filter,
+        projection=args.projection
+    )
+
+    if args.store:
+        store = InventoryStore(args.store)
+        print("Loaded {} instances into run {} of {}".format(
+            len(instance_records), store.load(instance_records), args.store
+        ))
+        store.close()
 
-# To handle the date cannot be serialized error
-def myconverter(o):
-    if isinstance(o, datetime.datetime):
-        return o.__str__()
+    if rate_limiter is not None:
+        rate_limiter.print_summary()
+    if cache is not None:
+        cache.print_summary()
+        cache.close()
+    if args.metrics_json:
+        metrics.write_json(args.metrics_json)
+    if args.metrics_prometheus:
+        metrics.write_prometheus(args.metrics_prometheus)
+    if stage_profiler is not None:
+        for profile_path in stage_profiler.dump():
+            print("Profile written to " + profile_path)
 
-fetch_data()
+if __name__ == "__main__":
+    main()
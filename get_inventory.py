@@ -4,172 +4,74 @@ and stores the details of the instances, load_balancers, auto scaling groups, re
 file specified by the user
 """
 
-import boto3
 import argparse
-import sys
-import json
-import datetime
 
-def get_default_aws_details():
+from client_pool import ClientPool
+from collection_filters import parse_filter
+from instrumentation import CallMetrics
+from inventory_model import track_instance_records
+from inventory_store import InventoryStore
+from inventory_stream import (
+    COMPRESSIONS,
+    OUTPUT_FORMATS,
+    inventory_file_path,
+    iter_non_empty,
+    open_inventory_file,
+    write_records
+)
+from rate_limiter import AdaptiveRateLimiter
+from resource_collectors import COLLECTORS, CollectionPlan, collect_region, parse_resources
+from response_cache import DEFAULT_CACHE_FILE, ResponseCache
+from serializers import SERIALIZER_NAMES
+from snapshot_store import SnapshotStore
+
+def get_default_aws_details(output_format="json", compression=None, snapshot_store=None, instance_records=None,
+                            client_pool=None, relationship_dir=None, serializer=None, plan=None):
     """
     Fetching aws data using boto3 and the credentials and config details stored in
     .aws file and writing it into respective json files
+    Parameters:
+    output_format - format of the inventory files, json or ndjson
+    compression - compression of the inventory files, gzip, zstd or None
+    snapshot_store - SnapshotStore recording the records for the delta files, or None
+    instance_records - list the InstanceRecords of the instances are appended to, or None
+    client_pool - ClientPool the clients are taken from, or None for a new one
+    relationship_dir - directory the RelationshipIndex of the region is kept in between runs, or None
+    serializer - serializer backend of the json files, one of SERIALIZER_NAMES or None for the fastest
+    plan - CollectionPlan of the resources to fetch, or None for every resource
     """
     try:
-        # Using boto3 to get ec2
-        ec2_response = boto3.client("ec2")
-
-        # Using boto3 to get elb
-        elb_response = boto3.client("elb")
-
-        # Using boto3 to get elb_v2
-        elbv2_response = boto3.client("elbv2")
-
-        # Using boto3 to get asg
-        asg_response = boto3.client("autoscaling")
-
-        # Using boto3 to get sts
-        sts_response = boto3.client("sts")
+        if client_pool is None:
+            client_pool = ClientPool()
 
         # Get current session using boto3 and then use that to get region
-        session = boto3.session.Session()
-        region = session.region_name
-
-        # Get aws_account_id from sts
-        account_id = sts_response.get_caller_identity()["Account"]
-
-        # Extracting all the instances and reserved instances from the response
-        if ec2_response is not None:
-            ec2_instances = ec2_response.describe_instances()
-            ec2_reserved_instances = ec2_response.describe_reserved_instances()
-        else:
-            ec2_instances = None
-            ec2_reserved_instances = None
-
-        # Extracting all the v1 load_balancers from the response
-        if elb_response is not None:
-            load_balancers = elb_response.describe_load_balancers()
-        else:
-            load_balancers = None
-
-        # Extracting all the v2 load_balancers from the response
-        if elbv2_response is not None:
-            v2_load_balancers = elbv2_response.describe_load_balancers()
-        else:
-            v2_load_balancers = None
-
-        # Extracting all asg groups
-        if asg_response is not None:
-            asg_groups = asg_response.describe_auto_scaling_groups()
-        else:
-            asg_groups = None
-
-        instance_to_v1_load_balancer_map = {}
-        # Creating a map of instance_id to load_balancer_name for v1_load_balancer
-        if load_balancers is not None:
-            for load_balancer in load_balancers["LoadBalancerDescriptions"]:
-                for instance in load_balancer['Instances']:
-                    instance_to_v1_load_balancer_map[instance["InstanceId"]] = load_balancer["LoadBalancerName"]
-                    
-
-        instance_to_v2_load_balancer_map = {}
-        # Creating a map of instance_id to load_balancer_name for v2_load_balancer
-        if v2_load_balancers is not None:
-            for elbv2_lb in v2_load_balancers["LoadBalancers"]:
-                load_balancer_arn = elbv2_lb['LoadBalancerArn']
-                load_balancer_name = elbv2_lb["LoadBalancerName"]
-                target_groups = elbv2_response.describe_target_groups(
-                    LoadBalancerArn=load_balancer_arn
-                )
-                if target_groups is None:
-                    continue
-                for target_group in target_groups["TargetGroups"]:
-                    target_group_arn = target_group['TargetGroupArn']
-
-                    target_healths = elbv2_response.describe_target_health(
-                        TargetGroupArn=target_group_arn
-                    )
-                    if target_healths is None:
-                        continue
-                    for target_health in target_healths["TargetHealthDescriptions"]:
-                        instance_to_v2_load_balancer_map[target_health["Target"]["Id"]] = load_balancer_name
-
-        for ec2_instance in ec2_instances['Reservations']:
-            for ec2i in ec2_instance["Instances"]:
-                id = ec2i["InstanceId"]
-                lb_v1 = instance_to_v1_load_balancer_map.get(id)
-                lb_v2 = instance_to_v2_load_balancer_map.get(id)
-                if lb_v1 is not None:
-                    ec2i["LoadBalancerName"] = lb_v1
-                elif lb_v2 is not None:
-                    ec2i["LoadBalancerName"] = lb_v2
-                else:
-                    ec2i["LoadBalancerName"] = None
-        
-        data = {}
-        # Stores instances into instances.json file
-        if ec2_instances["Reservations"] and len(ec2_instances["Reservations"]):
-            instances_file = open("instances.json","w+")
-            data["account_id"] = account_id
-            data["region"] = region
-            data["instances"] = ec2_instances["Reservations"]
-            json_data = json.dumps(data, default = myconverter)
-            instances_file.write(json_data)
-            instances_file.close()
-        
-        data = {}
-        # Stores reserved instances into reservations.json file
-        if (ec2_reserved_instances["ReservedInstances"] and len(ec2_reserved_instances["ReservedInstances"])):
-            reservations_file = open("reservations.json","w+")
-            data["account_id"] = account_id
-            data["region"] = region
-            data["reservations"] = ec2_reserved_instances["ReservedInstances"]
-            json_data = json.dumps(data, default = myconverter)
-            reservations_file.write(json_data)
-            reservations_file.close()
-
-        data = {}        
-        # Stores v1_load_balancers into load_balancers.json
-        if (load_balancers["LoadBalancerDescriptions"] and len(load_balancers["LoadBalancerDescriptions"])):
-            load_balancers_file = open("load_balancers.json","w+")
-            data["account_id"] = account_id
-            data["region"] = region
-            data["version"] = "elb"
-            data["load_balancers"] = load_balancers["LoadBalancerDescriptions"]
-            json_data = json.dumps(data, default = myconverter)
-            load_balancers_file.write(json_data)
-            load_balancers_file.close()
-
-        data = {}
-        # Stores v2_load_balancers into v2_load_balancers.json
-        if (v2_load_balancers["LoadBalancers"] and len(v2_load_balancers["LoadBalancers"])):
-            v2_load_balancers_file = open("v2_load_balancers.json","w+")
-            data["account_id"] = account_id
-            data["region"] = region
-            data["version"] = "elbv2"
-            data["load_balancers"] = v2_load_balancers["LoadBalancers"]
-            json_data = json.dumps(data, default = myconverter)
-            v2_load_balancers_file.write(json_data)
-            v2_load_balancers_file.close()
-
-        data = {}
-        # Stores all asg_groups into autoscaling_groups.json
-        if (asg_groups["AutoScalingGroups"] and len(asg_groups["AutoScalingGroups"])):
-            asg_file = open("autoscaling_groups.json","w+")
-            data["account_id"] = account_id
-            data["region"] = region
-            data["autoscaling_groups"] = asg_groups["AutoScalingGroups"]
-            json_data = json.dumps(data, default = myconverter)
-            asg_file.write(json_data)
-            asg_file.close()
-        
+        region = client_pool.session().region_name
+
+        # Streaming the inventory of the region into the json files
+        write_region_inventory(
+            client_pool,
+            region,
+            None,
+            "w+",
+            output_format,
+            compression,
+            snapshot_store,
+            instance_records,
+            relationship_dir,
+            serializer,
+            plan
+        )
+
         print("File executed successfully")
 
     except Exception as custom_error:
         print(custom_error)
 
 
-def get_specified_aws_details_for_region(access_key_id, secret_access_key, region):
+def get_specified_aws_details_for_region(access_key_id, secret_access_key, region,
+                                         output_format="json", compression=None, snapshot_store=None,
+                                         instance_records=None, client_pool=None, relationship_dir=None,
+                                         serializer=None, plan=None):
     """
     Fetching aws data using boto3 and the access_key_id and secret_access_key
     passed by the user and writing it into respective json file
@@ -177,180 +79,128 @@ def get_specified_aws_details_for_region(access_key_id, secret_access_key, regio
     access_key_id - AWS access key id
     secret_access_key - AWS secret access key
     region - AWS region to fetch the data from
+    output_format - format of the inventory files, json or ndjson
+    compression - compression of the inventory files, gzip, zstd or None
+    snapshot_store - SnapshotStore recording the records for the delta files, or None
+    instance_records - list the InstanceRecords of the instances are appended to, or None
+    client_pool - ClientPool the clients are taken from, or None for a new one
+    relationship_dir - directory the RelationshipIndex of the region is kept in between runs, or None
+    serializer - serializer backend of the json files, one of SERIALIZER_NAMES or None for the fastest
+    plan - CollectionPlan of the resources to fetch, or None for every resource
     """
     try:
-        # Using boto3 to get ec2
-        ec2_response = boto3.client(
-            "ec2",
-            region_name=region,
-            aws_access_key_id=access_key_id,
-            aws_secret_access_key=secret_access_key
-            )
-
-        # Using boto3 to get elb
-        elb_response = boto3.client(
-            "elb",
-            region_name=region,
-            aws_access_key_id=access_key_id,
-            aws_secret_access_key=secret_access_key
-            )
-        
-        # Using boto3 to get elb_v2
-        elbv2_response = boto3.client(
-            "elbv2",
-            region_name=region,
-            aws_access_key_id=access_key_id,
-            aws_secret_access_key=secret_access_key
-            )
-
-        # Using boto3 to get asg
-        asg_response = boto3.client(
-            "autoscaling",
-            region_name=region,
-            aws_access_key_id=access_key_id,
-            aws_secret_access_key=secret_access_key
-            )
-
-        # Using boto3 to get sts
-        sts_response = boto3.client(
-            "sts",
-            region_name=region,
-            aws_access_key_id=access_key_id,
-            aws_secret_access_key=secret_access_key
-            )
-
-        # Get aws_account_id from sts
-        account_id = sts_response.get_caller_identity()["Account"]
-
-        # Extracting all the instances and reserved instances from the response
-        if ec2_response is not None:
-            ec2_instances = ec2_response.describe_instances()
-            ec2_reserved_instances = ec2_response.describe_reserved_instances()
-        else:
-            ec2_instances = None
-            ec2_reserved_instances = None
-
-        # Extracting all the v1 load_balancers from the response
-        if elb_response is not None:
-            load_balancers = elb_response.describe_load_balancers()
-        else:
-            load_balancers = None
-
-        # Extracting all the v2 load_balancers from the response
-        if elbv2_response is not None:
-            v2_load_balancers = elbv2_response.describe_load_balancers()
-        else:
-            v2_load_balancers = None
-
-        # Extracting all asg groups
-        if asg_response is not None:
-            asg_groups = asg_response.describe_auto_scaling_groups()
-        else:
-            asg_groups = None
-
-        instance_to_v1_load_balancer_map = {}
-        # Creating a map of instance_id to load_balancer_name for v1_load_balancer
-        if load_balancers is not None:
-            for load_balancer in load_balancers["LoadBalancerDescriptions"]:
-                for instance in load_balancer['Instances']:
-                    instance_to_v1_load_balancer_map[instance["InstanceId"]] = load_balancer["LoadBalancerName"]
-
-        instance_to_v2_load_balancer_map = {}
-        # Creating a map of instance_id to load_balancer_name for v2_load_balancer
-        if v2_load_balancers is not None:
-            for elbv2_lb in v2_load_balancers["LoadBalancers"]:
-                load_balancer_arn = elbv2_lb['LoadBalancerArn']
-                load_balancer_name = elbv2_lb["LoadBalancerName"]
-                target_groups = elbv2_response.describe_target_groups(
-                    LoadBalancerArn=load_balancer_arn
-                )
-                if target_groups is None:
-                    continue
-                for target_group in target_groups["TargetGroups"]:
-                    target_group_arn = target_group['TargetGroupArn']
-
-                    target_healths = elbv2_response.describe_target_health(
-                        TargetGroupArn=target_group_arn
-                    )
-                    if target_healths is None:
-                        continue
-                    for target_health in target_healths["TargetHealthDescriptions"]:
-                        instance_to_v2_load_balancer_map[target_health["Target"]["Id"]] = load_balancer_name
-
-
-        for ec2_instance in ec2_instances['Reservations']:
-            for ec2i in ec2_instance["Instances"]:
-                id = ec2i["InstanceId"]
-                lb_v1 = instance_to_v1_load_balancer_map.get(id)
-                lb_v2 = instance_to_v2_load_balancer_map.get(id)
-                if lb_v1 is not None:
-                    ec2i["LoadBalancerName"] = lb_v1
-                elif lb_v2 is not None:
-                    ec2i["LoadBalancerName"] = lb_v2
-                else:
-                    ec2i["LoadBalancerName"] = None
-
-        data = {}
-        # Stores instances into instances.json file
-        if ec2_instances["Reservations"] and len(ec2_instances["Reservations"]):
-            instances_file = open("instances.json","a+")
-            data["account_id"] = account_id
-            data["region"] = region
-            data["instances"] = ec2_instances["Reservations"]
-            json_data = json.dumps(data, default = myconverter)
-            instances_file.write(json_data)
-            instances_file.close()
-        
-        data = {}
-        # Stores reserved instances into reservations.json file
-        if (ec2_reserved_instances["ReservedInstances"] and len(ec2_reserved_instances["ReservedInstances"])):
-            reservations_file = open("reservations.json","a+")
-            data["account_id"] = account_id
-            data["region"] = region
-            data["reservations"] = ec2_reserved_instances["ReservedInstances"]
-            json_data = json.dumps(data, default = myconverter)
-            reservations_file.write(json_data)
-            reservations_file.close()
-                
-        data = {}
-        # Stores v1_load_balancers into load_balancers.json
-        if (load_balancers["LoadBalancerDescriptions"] and len(load_balancers["LoadBalancerDescriptions"])):
-            load_balancers_file = open("load_balancers.json","a+")
-            data["account_id"] = account_id
-            data["region"] = region
-            data["version"] = "elb"
-            data["load_balancers"] = load_balancers["LoadBalancerDescriptions"]
-            json_data = json.dumps(data, default = myconverter)
-            load_balancers_file.write(json_data)
-            load_balancers_file.close()
-
-        data = {}
-        # Stores v2_load_balancers into v2_load_balancers.json
-        if (v2_load_balancers["LoadBalancers"] and len(v2_load_balancers["LoadBalancers"])):
-            v2_load_balancers_file = open("v2_load_balancers.json","a+")
-            data["account_id"] = account_id
-            data["region"] = region
-            data["version"] = "elbv2"
-            data["load_balancers"] = v2_load_balancers["LoadBalancers"]
-            json_data = json.dumps(data, default = myconverter)
-            v2_load_balancers_file.write(json_data)
-            v2_load_balancers_file.close()
-
-        data = {}
-        # Stores all asg_groups into autoscaling_groups.json
-        if (asg_groups["AutoScalingGroups"] and len(asg_groups["AutoScalingGroups"])):
-            asg_file = open("autoscaling_groups.json","a+")
-            data["account_id"] = account_id
-            data["region"] = region
-            data["autoscaling_groups"] = asg_groups["AutoScalingGroups"]
-            json_data = json.dumps(data, default = myconverter)
-            asg_file.write(json_data)
-            asg_file.close()
+        if client_pool is None:
+            client_pool = ClientPool()
+
+        # Streaming the inventory of the region into the json files, with the
+        # clients and the aws_account_id of the access key from the pool,
+        # which resolves the account only once
+        write_region_inventory(
+            client_pool,
+            region,
+            (access_key_id, secret_access_key, None),
+            "a+",
+            output_format,
+            compression,
+            snapshot_store,
+            instance_records,
+            relationship_dir,
+            serializer,
+            plan
+        )
 
     except Exception as custom_error:
         print(custom_error)
 
-def get_specified_aws_details(access_key_id, secret_access_key):
+def write_region_inventory(client_pool, region, credentials, mode, output_format="json", compression=None,
+                           snapshot_store=None, instance_records=None, relationship_dir=None, serializer=None,
+                           plan=None):
+    """
+    Pulls the resources of the plan in a region page by page, annotates the
+    instances with their load balancers and streams every resource type into
+    its json file
+    Parameters:
+    client_pool - ClientPool the clients of the region are taken from
+    region - AWS region the inventory is fetched from
+    credentials - (access_key_id, secret_access_key, session_token) tuple, or None for the .aws file
+    mode - mode the json files are opened with
+    output_format - format of the inventory files, json or ndjson
+    compression - compression of the inventory files, gzip, zstd or None
+    snapshot_store - SnapshotStore recording the records for the delta files, or None
+    instance_records - list the InstanceRecords of the instances are appended to, or None
+    relationship_dir - directory the RelationshipIndex of the region is kept in between runs, or None
+    serializer - serializer backend of the json files, one of SERIALIZER_NAMES or None for the fastest
+    plan - CollectionPlan of the resources to fetch, or None for every resource
+    """
+    if plan is None:
+        plan = CollectionPlan()
+
+    # Get the clients of the services the plan calls and the aws_account_id from the pool
+    clients, account_id = client_pool.region_clients(region, credentials, plan.services)
+
+    def tracked(resource_type, records):
+        # Recording the records for the snapshot when one is kept
+        if snapshot_store is None:
+            return records
+        return snapshot_store.track(resource_type, account_id, region, records)
+
+    def modelled(reservations):
+        # Keeping only the compact records of the instances in memory when asked to
+        if instance_records is None:
+            return reservations
+        return track_instance_records(reservations, account_id, region, instance_records)
+
+    # Listing the load balancers and asg groups and creating a map of
+    # instance_id to the names of all its v1 and v2 load_balancers, looking up
+    # only the target groups that changed since the index of the region was
+    # last saved, then storing every resource type into its json file
+    for collector, records in collect_region(plan, clients, account_id, region, relationship_dir=relationship_dir):
+        records = tracked(collector.name, records)
+        if collector.name == "instances":
+            records = modelled(records)
+        write_json_file(
+            collector.name + ".json",
+            mode,
+            collector.field,
+            records,
+            account_id,
+            region,
+            version=collector.version,
+            output_format=output_format,
+            compression=compression,
+            serializer=serializer
+        )
+
+def write_json_file(path, mode, field, records, account_id, region, version=None,
+                    output_format="json", compression=None, serializer=None):
+    """
+    Streams the records into the json file at path one record at a time.
+    The file is left untouched when there are no records
+    Parameters:
+    path - json file to write to
+    mode - mode the file is opened with
+    field - key the records are stored under
+    records - iterable of the records
+    account_id - AWS account id the records belong to
+    region - AWS region the records were fetched from
+    version - load balancer version stored along with load balancers
+    output_format - format of the file, json or ndjson
+    compression - compression of the file, gzip, zstd or None
+    serializer - serializer backend, one of SERIALIZER_NAMES or None for the fastest installed one
+    """
+    records = iter_non_empty(records)
+    if records is None:
+        return
+    before = [("account_id", account_id), ("region", region)]
+    if version is not None:
+        before.append(("version", version))
+    path = inventory_file_path(path, output_format, compression)
+    with open_inventory_file(path, mode, compression) as json_file:
+        write_records(json_file, output_format, field, records, before, serializer=serializer)
+
+def get_specified_aws_details(access_key_id, secret_access_key, output_format="json", compression=None,
+                              snapshot_store=None, instance_records=None, client_pool=None,
+                              relationship_dir=None, serializer=None, plan=None):
     """
     This function is called when the user does not pass the region
     as an argument and subsequently the inventory is fetched from all
@@ -358,14 +208,21 @@ def get_specified_aws_details(access_key_id, secret_access_key):
     Parameters:
     access_key_id - AWS access key id
     secret_access_key - AWS secret access key
+    output_format - format of the inventory files, json or ndjson
+    compression - compression of the inventory files, gzip, zstd or None
+    snapshot_store - SnapshotStore recording the records for the delta files, or None
+    instance_records - list the InstanceRecords of the instances are appended to, or None
+    client_pool - ClientPool shared by the regions, or None for a new one
+    relationship_dir - directory the RelationshipIndex of every region is kept in between runs, or None
+    serializer - serializer backend of the json files, one of SERIALIZER_NAMES or None for the fastest
+    plan - CollectionPlan of the resources to fetch, or None for every resource
     """
     try:
-        ec2_regions = boto3.client(
-            "ec2",
-            "us-west-2",
-            aws_access_key_id=access_key_id,
-            aws_secret_access_key=secret_access_key
-        )
+        # Sharing the session, clients and account id across all regions
+        if client_pool is None:
+            client_pool = ClientPool()
+
+        ec2_regions = client_pool.client("ec2", "us-west-2", (access_key_id, secret_access_key, None))
 
         # Getting all AWS regions
         regions = ec2_regions.describe_regions()
@@ -374,44 +231,148 @@ def get_specified_aws_details(access_key_id, secret_access_key):
             get_specified_aws_details_for_region(
                 access_key_id=access_key_id,
                 secret_access_key=secret_access_key,
-                region=region["RegionName"]
+                region=region["RegionName"],
+                output_format=output_format,
+                compression=compression,
+                snapshot_store=snapshot_store,
+                instance_records=instance_records,
+                client_pool=client_pool,
+                relationship_dir=relationship_dir,
+                serializer=serializer,
+                plan=plan
                 )
 
+        client_pool.print_setup_summary((access_key_id, secret_access_key, None))
+
         print("File executed successfully")
 
     except Exception as error:
         print(error)
 
-# To handle the date cannot be serialized error
-def myconverter(o):
-    if isinstance(o, datetime.datetime):
-        return o.__str__()
-
-# Initializing the parser
-PARSER = argparse.ArgumentParser()
-
-# Adding parameters
-PARSER.add_argument("--accesskeyid", help="AWS Access Key")
-PARSER.add_argument("--secretaccesskey", help="AWS Secret Access key")
-PARSER.add_argument("--region", help="Enter region")
-
-# Parse the arguments
-ARGS = PARSER.parse_args()
-
-# Extracting the access key id
-access_key_id = ARGS.accesskeyid
-
-# Extracting the secret access key
-secret_access_key =ARGS.secretaccesskey
-
-# Extracting the region
-region = ARGS.region
+def main(argv=None):
+    """
+    Parses the command line arguments and fetches the inventory of the
+    default region, of a region or of every region into the json files
+    Parameters:
+    argv - command line arguments, sys.argv[1:] when None
+    """
+    # Initializing the parser
+    parser = argparse.ArgumentParser()
+
+    # Adding parameters
+    parser.add_argument("--accesskeyid", help="AWS Access Key")
+    parser.add_argument("--secretaccesskey", help="AWS Secret Access key")
+    parser.add_argument("--region", help="Enter region")
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, default="json", help="Enter output format")
+    parser.add_argument("--compression", choices=COMPRESSIONS, help="Enter output compression")
+    parser.add_argument("--serializer", choices=SERIALIZER_NAMES, help="Enter JSON backend, the fastest one by default")
+    parser.add_argument("--snapshot-dir", help="Enter snapshot directory to write only the changes since the last run")
+    parser.add_argument("--metrics-json", help="Enter file to write the per call metrics to as JSON")
+    parser.add_argument("--metrics-prometheus", help="Enter file to write the per call metrics to in Prometheus format")
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        help="Serve the regions, reserved instances and target groups from the response cache, up to 24 hours old"
+    )
+    parser.add_argument("--cache-file", default=DEFAULT_CACHE_FILE, help="Enter response cache file of --cache")
+    parser.add_argument("--refresh", action="store_true", help="Fetch the responses of --cache again")
+    parser.add_argument("--relationship-dir", help="Enter directory to keep the instance to load balancer index in")
+    parser.add_argument("--store", help="Enter inventory store (SQLite file) to load the instances into as a new run")
+    parser.add_argument(
+        "--no-rate-limit",
+        action="store_true",
+        help="Send the calls without pacing them to the API quotas"
+    )
+    parser.add_argument(
+        "--resources",
+        type=parse_resources,
+        help="Enter comma separated resources out of " + ", ".join(COLLECTORS) + ", all of them by default"
+    )
+    parser.add_argument(
+        "--filter",
+        type=parse_filter,
+        action="append",
+        default=[],
+        help="Enter filter of the instances and reserved instances, e.g. state=active or family=m5,c5, repeatable"
+    )
+    parser.add_argument("--projection", action="store_true", help="Keep only the instance fields the inventory reads")
+
+    # Parse the arguments
+    args = parser.parse_args(argv)
+
+    # Extracting the access key id
+    access_key_id = args.accesskeyid
+
+    # Extracting the secret access key
+    secret_access_key =args.secretaccesskey
+
+    # Extracting the region
+    region = args.region
+
+    # Extracting the output format and compression
+    output_format = args.format
+    compression = args.compression
+
+    # Keeping a snapshot of the previous run to write only the changes
+    snapshot_store = SnapshotStore(args.snapshot_dir, args.serializer) if args.snapshot_dir else None
+
+    # Instrumenting every client when the metrics are exported
+    metrics = CallMetrics() if args.metrics_json or args.metrics_prometheus else None
+
+    # Serving the slow-changing responses from the cache kept across runs
+    cache = ResponseCache(args.cache_file, refresh=args.refresh) if args.cache else None
+
+    # Pacing the calls of every region and service to its API quota
+    rate_limiter = None if args.no_rate_limit else AdaptiveRateLimiter()
+    client_pool = ClientPool(metrics=metrics, cache=cache, rate_limiter=rate_limiter)
+
+    # Keeping the records of the instances to load them into the store
+    instance_records = [] if args.store else None
+
+    # Planning only the calls the requested resources need, filtered server side
+    plan = CollectionPlan(args.resources, args.filter, args.projection)
+
+    if access_key_id is None or secret_access_key is None:
+        get_default_aws_details(
+            output_format, compression, snapshot_store, instance_records=instance_records, client_pool=client_pool,
+            relationship_dir=args.relationship_dir, serializer=args.serializer, plan=plan
+        )
 
-if access_key_id is None or secret_access_key is None:
-    get_default_aws_details()
+    elif region is not None:
+        get_specified_aws_details_for_region(
+            access_key_id, secret_access_key, region, output_format, compression, snapshot_store,
+            instance_records=instance_records, client_pool=client_pool, relationship_dir=args.relationship_dir,
+            serializer=args.serializer, plan=plan
+        )
 
-elif region is not None:
-    get_specified_aws_details_for_region(access_key_id, secret_access_key, region)
+    else:
+        get_specified_aws_details(
+            access_key_id, secret_access_key, output_format, compression, snapshot_store,
+            instance_records=instance_records, client_pool=client_pool, relationship_dir=args.relationship_dir,
+            serializer=args.serializer, plan=plan
+        )
 
-else:
-    get_specified_aws_details(access_key_id, secret_access_key)
+    # Loading the instances into the store as a new run
+    if args.store:
+        store = InventoryStore(args.store)
+        run_id = store.load(instance_records)
+        print("Loaded {} instances into run {} of {}".format(len(instance_records), run_id, args.store))
+        store.close()
+
+    # Writing the delta files and the current view of the snapshot
+    if snapshot_store is not None:
+        for resource_type, (added, removed, changed) in snapshot_store.commit().items():
+            print("{}: {} added, {} removed, {} changed".format(resource_type, added, removed, changed))
+
+    if cache is not None:
+        cache.print_summary()
+        cache.close()
+
+    # Writing the per call metrics
+    if args.metrics_json:
+        metrics.write_json(args.metrics_json)
+    if args.metrics_prometheus:
+        metrics.write_prometheus(args.metrics_prometheus)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,325 @@
+"""
+Instrumentation of the collectors. CallMetrics hooks into the event system of
+every boto3 client to record call counts, latency histograms, retries,
+throttling errors and bytes received per (account, region, service, operation)
+and exports them as a JSON summary or in the Prometheus text format.
+StageProfiler captures cProfile profiles of the fetch, annotate and serialize
+stages of the collectors
+"""
+import json
+import os
+import threading
+import time
+
+# Upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Error codes AWS services answer with when a caller is throttled
+THROTTLING_ERROR_CODES = frozenset([
+    "Throttling",
+    "ThrottlingException",
+    "ThrottledException",
+    "RequestThrottled",
+    "RequestThrottledException",
+    "RequestLimitExceeded",
+    "TooManyRequestsException",
+    "ProvisionedThroughputExceededException",
+    "SlowDown",
+    "EC2ThrottledException",
+    "BandwidthLimitExceeded"
+])
+
+# Labels of every series, in the order of the keys of CallMetrics.calls
+LABELS = ("account", "region", "service", "operation")
+
+def error_code(parsed):
+    """
+    Returns the error code of a parsed response, or None for a successful one
+    """
+    if not isinstance(parsed, dict):
+        return None
+    return parsed.get("Error", {}).get("Code")
+
+def response_size(http_response):
+    """
+    Returns the number of bytes of an http response body, or 0 when unknown
+    """
+    if http_response is None:
+        return 0
+    content_length = http_response.headers.get("content-length")
+    if content_length is not None:
+        return int(content_length)
+    try:
+        return len(http_response.content or b"")
+    except Exception:
+        return 0
+
+class CallStats(object):
+    """
+    Counters of the calls of a single operation
+    """
+
+    __slots__ = ("calls", "errors", "throttles", "retries", "bytes_received", "latency_sum", "buckets")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.throttles = 0
+        self.retries = 0
+        self.bytes_received = 0
+        self.latency_sum = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def observe(self, latency):
+        self.calls += 1
+        self.latency_sum += latency
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if latency <= bound:
+                self.buckets[index] += 1
+                return
+        self.buckets[-1] += 1
+
+    def to_json(self):
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "throttles": self.throttles,
+            "retries": self.retries,
+            "bytes_received": self.bytes_received,
+            "latency_seconds_sum": round(self.latency_sum, 6),
+            "latency_seconds_buckets": dict(zip(
+                [str(bound) for bound in LATENCY_BUCKETS] + ["+Inf"],
+                self.buckets
+            ))
+        }
+
+class CallMetrics(object):
+    """
+    Metrics of the calls of the instrumented boto3 clients, keyed by
+    (account, region, service, operation)
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def stats(self, key):
+        stats = self.calls.get(key)
+        if stats is None:
+            stats = self.calls[key] = CallStats()
+        return stats
+
+    def instrument(self, client, account_label):
+        """
+        Registers the handlers recording the calls of a boto3 client
+        Parameters :
+        client - boto3 client to instrument
+        account_label - function returning the account id of the client, or
+                        an empty string while it is not resolved yet
+        """
+        region = client.meta.region_name or ""
+        service = client.meta.service_model.service_name
+
+        def key(operation_name):
+            return (account_label() or "", region, service, operation_name)
+
+        def before_call(context, **kwargs):
+            context["instrumentation_start"] = time.perf_counter()
+
+        def after_call(http_response, parsed, model, context, **kwargs):
+            # Responses served by the ResponseCache never reached AWS
+            if context.get("response_cache_hit"):
+                return
+            latency = time.perf_counter() - context.get("instrumentation_start", time.perf_counter())
+            retries = parsed.get("ResponseMetadata", {}).get("RetryAttempts", 0) if isinstance(parsed, dict) else 0
+            code = error_code(parsed)
+            size = response_size(http_response)
+            with self.lock:
+                stats = self.stats(key(model.name))
+                stats.observe(latency)
+                stats.retries += retries
+                stats.bytes_received += size
+                if code is not None:
+                    stats.errors += 1
+                    if code in THROTTLING_ERROR_CODES:
+                        stats.throttles += 1
+
+        def after_call_error(model, context, **kwargs):
+            latency = time.perf_counter() - context.get("instrumentation_start", time.perf_counter())
+            with self.lock:
+                stats = self.stats(key(model.name))
+                stats.observe(latency)
+                stats.errors += 1
+
+        def needs_retry(response, operation, **kwargs):
+            # Counts the throttled attempts that were retried before the
+            # call succeeded or failed, which after-call does not see
+            if response is None or error_code(response[1]) not in THROTTLING_ERROR_CODES:
+                return None
+            with self.lock:
+                self.stats(key(operation.name)).throttles += 1
+            return None
+
+        events = client.meta.events
+        events.register("before-call.*.*", before_call)
+        events.register("after-call.*.*", after_call)
+        events.register("after-call-error.*.*", after_call_error)
+        events.register("needs-retry.*.*", needs_retry)
+
+    def to_json(self):
+        """
+        Returns the summary of the calls as a list of one dictionary per operation
+        """
+        with self.lock:
+            return [
+                dict(zip(LABELS, key), **stats.to_json())
+                for key, stats in sorted(self.calls.items())
+            ]
+
+    def write_json(self, path):
+        """
+        Writes the JSON summary of the calls to path
+        """
+        with open(path, "w") as json_file:
+            json.dump({"calls": self.to_json()}, json_file, indent=2)
+
+    def to_prometheus(self):
+        """
+        Returns the metrics of the calls in the Prometheus text exposition format
+        """
+        counters = (
+            ("inventory_aws_calls_total", "Calls made to AWS", "calls"),
+            ("inventory_aws_call_errors_total", "Calls that failed", "errors"),
+            ("inventory_aws_call_throttles_total", "Attempts throttled by AWS", "throttles"),
+            ("inventory_aws_call_retries_total", "Attempts retried by botocore", "retries"),
+            ("inventory_aws_response_bytes_total", "Bytes received from AWS", "bytes_received")
+        )
+        with self.lock:
+            items = sorted(self.calls.items())
+            lines = []
+            for name, description, field in counters:
+                lines.append("# HELP {} {}".format(name, description))
+                lines.append("# TYPE {} counter".format(name))
+                for key, stats in items:
+                    lines.append("{}{{{}}} {}".format(name, prometheus_labels(key), getattr(stats, field)))
+
+            name = "inventory_aws_call_duration_seconds"
+            lines.append("# HELP {} Latency of the calls made to AWS".format(name))
+            lines.append("# TYPE {} histogram".format(name))
+            for key, stats in items:
+                labels = prometheus_labels(key)
+                cumulative = 0
+                for bound, count in zip([repr(bound) for bound in LATENCY_BUCKETS] + ["+Inf"], stats.buckets):
+                    cumulative += count
+                    lines.append('{}_bucket{{{},le="{}"}} {}'.format(name, labels, bound, cumulative))
+                lines.append("{}_sum{{{}}} {}".format(name, labels, repr(stats.latency_sum)))
+                lines.append("{}_count{{{}}} {}".format(name, labels, stats.calls))
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        """
+        Writes the metrics of the calls to path in the Prometheus text format
+        """
+        with open(path, "w") as prometheus_file:
+            prometheus_file.write(self.to_prometheus())
+
+def prometheus_labels(key):
+    """
+    Returns the Prometheus label set of an (account, region, service, operation) key
+    """
+    return ",".join(
+        '{}="{}"'.format(label, value.replace("\\", "\\\\").replace('"', '\\"'))
+        for label, value in zip(LABELS, key)
+    )
+
+class StageProfiler(object):
+    """
+    cProfile profiles of the stages of the collectors, one profile per thread
+    and stage. Stages nest, e.g. serialize pulls records through annotate which
+    pulls pages through fetch, and only the innermost running stage of a
+    thread is profiled, so every stage shows its own work
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.profiles = {}
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def profile(self, stage):
+        """
+        Returns the profile of the stage of the current thread
+        """
+        profiles = getattr(self.local, "profiles", None)
+        if profiles is None:
+            profiles = self.local.profiles = {}
+            self.local.stack = []
+        profile = profiles.get(stage)
+        if profile is None:
+            import cProfile
+
+            profile = profiles[stage] = cProfile.Profile()
+            with self.lock:
+                self.profiles.setdefault(stage, []).append(profile)
+        return profile
+
+    def enter(self, stage):
+        profile = self.profile(stage)
+        stack = self.local.stack
+        if stack:
+            stack[-1].disable()
+        stack.append(profile)
+        profile.enable()
+
+    def exit(self):
+        stack = self.local.stack
+        stack.pop().disable()
+        if stack:
+            stack[-1].enable()
+
+    def wrap(self, stage, function):
+        """
+        Returns function profiled as the stage
+        """
+        def profiled(*args, **kwargs):
+            self.enter(stage)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.exit()
+        return profiled
+
+    def iterate(self, stage, iterable):
+        """
+        Yields the items of iterable, profiling the work of producing them as the stage
+        """
+        iterator = iter(iterable)
+        while True:
+            self.enter(stage)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.exit()
+            yield item
+
+    def dump(self):
+        """
+        Writes the merged profile of every stage to <directory>/<stage>.prof
+        Returns the list of paths written
+        """
+        import pstats
+
+        paths = []
+        with self.lock:
+            for stage, profiles in sorted(self.profiles.items()):
+                path = os.path.join(self.directory, stage + ".prof")
+                stats = pstats.Stats(profiles[0])
+                for profile in profiles[1:]:
+                    stats.add(profile)
+                stats.dump_stats(path)
+                paths.append(path)
+        return paths
@@ -0,0 +1,414 @@
+"""
+Long running service keeping the inventory fresh in memory. Every resource
+type of every region is refreshed on its own interval over warm clients of a
+shared ClientPool, overlapping refreshes of the same region and resource type
+are coalesced into one, and the latest snapshot is served from memory over a
+local HTTP endpoint:
+GET /health - state of every refresh
+GET /inventory/<resource_type>[?region=<region>] - latest records, as a list of
+    the per region documents the json inventory files hold
+POST /refresh/<resource_type>[?region=<region>] - refresh now, coalesced with
+    a refresh already running
+"""
+import argparse
+import asyncio
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+from client_pool import ClientPool
+from rate_limiter import AdaptiveRateLimiter
+from relationship_index import RelationshipIndex
+from resource_collectors import COLLECTORS
+from response_cache import DEFAULT_CACHE_FILE, ResponseCache
+from serializers import SERIALIZER_NAMES, get_serializer
+
+# Seconds between two refreshes of every resource type
+DEFAULT_INTERVALS = {
+    "instances": 300,
+    "reservations": 3600,
+    "load_balancers": 900,
+    "v2_load_balancers": 900,
+    "autoscaling_groups": 600
+}
+
+# Resource types the instances are related to, refreshed before the instances
+RELATIONSHIP_RESOURCE_TYPES = COLLECTORS["load_balancer_map"].requires
+
+# Address the HTTP endpoint listens on, local only by default
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8080
+
+# Number of threads the blocking boto3 calls run on
+DEFAULT_MAX_WORKERS = 8
+
+# Largest request line and header block the HTTP endpoint reads
+MAX_REQUEST_BYTES = 64 * 1024
+
+HTTP_REASONS = {200: "OK", 202: "Accepted", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed"}
+
+class RefreshState(object):
+    """
+    Latest snapshot of a resource type of a region and the state of its refreshes
+    """
+
+    __slots__ = ("document", "record_count", "refreshed_at", "duration", "error", "refreshes", "coalesced")
+
+    def __init__(self):
+        self.document = None
+        self.record_count = 0
+        self.refreshed_at = None
+        self.duration = None
+        self.error = None
+        self.refreshes = 0
+        self.coalesced = 0
+
+    def to_json(self):
+        return {
+            "records": self.record_count,
+            "refreshed_at": self.refreshed_at,
+            "duration_seconds": None if self.duration is None else round(self.duration, 6),
+            "error": self.error,
+            "refreshes": self.refreshes,
+            "coalesced": self.coalesced
+        }
+
+class InventoryDaemon(object):
+    """
+    Refreshes the inventory of every region on a schedule and serves it over HTTP
+    Parameters :
+    client_pool - ClientPool the warm clients are taken from
+    intervals - dictionary of resource type to seconds between refreshes
+    regions - names of the regions to refresh, or None for every region
+    max_workers - number of threads the boto3 calls run on
+    serializer - serializer backend of the served documents, one of SERIALIZER_NAMES or None
+    """
+
+    def __init__(self, client_pool=None, intervals=None, regions=None, max_workers=DEFAULT_MAX_WORKERS,
+                 serializer=None):
+        self.client_pool = client_pool if client_pool is not None else ClientPool()
+        self.intervals = dict(DEFAULT_INTERVALS, **(intervals or {}))
+        self.regions = regions
+        self.executor = ThreadPoolExecutor(max_workers=max(1, max_workers))
+        self.encode = get_serializer(serializer).encode
+        self.states = {}
+        self.in_flight = {}
+        self.responses = {}
+        self.relationship_indexes = {}
+        self.relationship_locks = {}
+        self.load_balancer_maps = {}
+        self.relationships_ready = {}
+        self.ready = None
+        self.tasks = []
+        self.server = None
+
+    def fetch(self, region, resource_type):
+        """
+        Fetches the records of a resource type of a region and encodes the
+        document served for them. Runs on the executor
+        Returns (document, record count)
+        """
+        clients, account_id = self.client_pool.region_clients(region)
+        collector = COLLECTORS[resource_type]
+        records = collector.iter_records(clients)
+        if collector.annotate is not None:
+            records = collector.annotate(records, self.load_balancer_maps.get(region, {}))
+        records = list(records)
+
+        document = {"account_id": account_id, "region": region, collector.field: records}
+        if collector.version is not None:
+            document["version"] = collector.version
+        if resource_type in RELATIONSHIP_RESOURCE_TYPES:
+            self.relate(region, resource_type, records, clients["elbv2"])
+        return self.encode(document), len(records)
+
+    def relate(self, region, resource_type, records, elbv2):
+        """
+        Refreshes the RelationshipIndex of the region with the fresh records of
+        one of the RELATIONSHIP_RESOURCE_TYPES and the latest of the others,
+        once all of them were fetched. Runs on the executor
+        """
+        with self.relationship_locks.setdefault(region, threading.Lock()):
+            index = self.relationship_indexes.get(region)
+            if index is None:
+                index = self.relationship_indexes[region] = [RelationshipIndex(), {}]
+            index[1][resource_type] = records
+            if len(index[1]) < len(RELATIONSHIP_RESOURCE_TYPES):
+                return
+            index[0].refresh(
+                elbv2,
+                index[1]["load_balancers"],
+                index[1]["v2_load_balancers"],
+                index[1]["autoscaling_groups"]
+            )
+            self.load_balancer_maps[region] = index[0].instance_to_load_balancers_map(healthy_only=True)
+
+    def refresh(self, region, resource_type):
+        """
+        Returns the task refreshing a resource type of a region, the one
+        already running when there is one so overlapping refreshes coalesce
+        """
+        key = (region, resource_type)
+        task = self.in_flight.get(key)
+        if task is not None and not task.done():
+            self.states[key].coalesced += 1
+            return task
+        task = self.in_flight[key] = asyncio.ensure_future(self.run_refresh(region, resource_type))
+        return task
+
+    async def run_refresh(self, region, resource_type):
+        key = (region, resource_type)
+        state = self.states.setdefault(key, RefreshState())
+        start = time.perf_counter()
+        try:
+            document, record_count = await asyncio.get_running_loop().run_in_executor(
+                self.executor, self.fetch, region, resource_type
+            )
+            state.document = document
+            state.record_count = record_count
+            state.error = None
+            self.responses.pop(resource_type, None)
+        except Exception as error:
+            state.error = str(error)
+        state.refreshes += 1
+        state.refreshed_at = time.time()
+        state.duration = time.perf_counter() - start
+        if resource_type in RELATIONSHIP_RESOURCE_TYPES and all(
+                (region, related) in self.states and self.states[(region, related)].refreshes
+                for related in RELATIONSHIP_RESOURCE_TYPES):
+            self.relationships_ready[region].set()
+        if all(state.refreshes for state in self.states.values()):
+            self.ready.set()
+
+    async def schedule(self, region, resource_type):
+        """
+        Refreshes a resource type of a region every interval seconds. The
+        instances wait for the first refresh of the resources they are
+        related to, so they are annotated with their load balancers
+        """
+        if resource_type == "instances":
+            await self.relationships_ready[region].wait()
+        while True:
+            await asyncio.shield(self.refresh(region, resource_type))
+            await asyncio.sleep(self.intervals[resource_type])
+
+    def schedule_keys(self):
+        return [(region, resource_type) for region in self.regions for resource_type in self.intervals]
+
+    def response(self, resource_type, region=None):
+        """
+        Returns the encoded list of the latest documents of a resource type,
+        of a single region or of every region, reused until a refresh replaces one
+        """
+        cache_key = (resource_type, region)
+        body = self.responses.get(resource_type, {}).get(cache_key)
+        if body is None:
+            regions = self.regions if region is None else [region]
+            documents = [
+                self.states[(name, resource_type)].document
+                for name in regions
+                if (name, resource_type) in self.states and self.states[(name, resource_type)].document is not None
+            ]
+            body = b"[" + b",".join(documents) + b"]"
+            self.responses.setdefault(resource_type, {})[cache_key] = body
+        return body
+
+    def health(self):
+        return self.encode({
+            "ready": self.ready.is_set(),
+            "regions": {
+                region: {
+                    resource_type: self.states[(region, resource_type)].to_json()
+                    for resource_type in self.intervals
+                    if (region, resource_type) in self.states
+                }
+                for region in self.regions
+            }
+        })
+
+    def route(self, method, target):
+        """
+        Returns the (status, body) of a request
+        """
+        url = urlsplit(target)
+        query = parse_qs(url.query)
+        region = query.get("region", [None])[0]
+        parts = [part for part in url.path.split("/") if part]
+        if region is not None and region not in self.regions:
+            return 404, self.encode({"error": "unknown region " + region})
+        if parts == ["health"]:
+            return 200, self.health()
+        if len(parts) != 2 or parts[0] not in ("inventory", "refresh"):
+            return 404, self.encode({"error": "unknown path " + url.path})
+        resource_type = parts[1]
+        if resource_type not in self.intervals:
+            return 404, self.encode({"error": "unknown resource type " + resource_type})
+        if parts[0] == "inventory":
+            if method != "GET":
+                return 405, self.encode({"error": "use GET"})
+            return 200, self.response(resource_type, region)
+        if method != "POST":
+            return 405, self.encode({"error": "use POST"})
+        for name in self.regions if region is None else [region]:
+            self.refresh(name, resource_type)
+        return 202, self.encode({"refreshing": resource_type})
+
+    async def handle(self, reader, writer):
+        """
+        Serves the requests of a connection, kept alive until the client closes it
+        """
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                    return
+                lines = head.decode("latin-1").split("\r\n")
+                request = lines[0].split()
+                headers = dict(
+                    (name.strip().lower(), value.strip())
+                    for name, _, value in (line.partition(":") for line in lines[1:] if line)
+                )
+                content_length = int(headers.get("content-length", 0) or 0)
+                if content_length:
+                    await reader.readexactly(content_length)
+                if len(request) != 3:
+                    status, body = 400, self.encode({"error": "bad request line"})
+                else:
+                    status, body = self.route(request[0].upper(), request[1])
+                close = headers.get("connection", "").lower() == "close" or request[-1:] == ["HTTP/1.0"]
+                writer.write(
+                    "HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\n{}\r\n".format(
+                        status,
+                        HTTP_REASONS[status],
+                        len(body),
+                        "Connection: close\r\n" if close else ""
+                    ).encode("latin-1") + body
+                )
+                await writer.drain()
+                if close:
+                    return
+        finally:
+            writer.close()
+
+    async def start(self, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        """
+        Starts the schedules of every region and resource type and the HTTP endpoint
+        Returns the port the endpoint listens on
+        """
+        loop = asyncio.get_running_loop()
+        self.ready = asyncio.Event()
+        if self.regions is None:
+            ec2_regions = self.client_pool.client("ec2", "us-west-2")
+            response = await loop.run_in_executor(self.executor, ec2_regions.describe_regions)
+            self.regions = [region["RegionName"] for region in response["Regions"]]
+        for region in self.regions:
+            self.relationships_ready[region] = asyncio.Event()
+            if not any(resource_type in self.intervals for resource_type in RELATIONSHIP_RESOURCE_TYPES):
+                self.relationships_ready[region].set()
+        for region, resource_type in self.schedule_keys():
+            self.states[(region, resource_type)] = RefreshState()
+        for region, resource_type in self.schedule_keys():
+            self.tasks.append(asyncio.ensure_future(self.schedule(region, resource_type)))
+        self.server = await asyncio.start_server(self.handle, host, port, limit=MAX_REQUEST_BYTES)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        """
+        Stops the schedules and the HTTP endpoint
+        """
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        self.executor.shutdown(wait=False)
+
+async def serve(daemon, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    """
+    Runs the daemon until it receives SIGINT or SIGTERM
+    """
+    port = await daemon.start(host, port)
+    print("Serving the inventory of {} regions on http://{}:{}".format(len(daemon.regions), host, port))
+    stopped = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signal_number, stopped.set)
+    await stopped.wait()
+    await daemon.stop()
+
+def parse_interval(value):
+    """
+    Returns the (resource_type, seconds) of a resource_type=seconds argument
+    """
+    resource_type, _, seconds = value.partition("=")
+    if resource_type not in DEFAULT_INTERVALS:
+        raise argparse.ArgumentTypeError("unknown resource type " + resource_type)
+    try:
+        return resource_type, float(seconds)
+    except ValueError:
+        raise argparse.ArgumentTypeError("seconds must be a number, got " + seconds)
+
+def main(argv=None):
+    """
+    Parses the command line arguments and serves the inventory, refreshing
+    every resource type on its interval until interrupted
+    Parameters :
+    argv - command line arguments, sys.argv[1:] when None
+    """
+    # Initializing the parser
+    parser = argparse.ArgumentParser()
+
+    # Adding parameters
+    parser.add_argument("--host", default=DEFAULT_HOST, help="Address the HTTP endpoint listens on")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="Port the HTTP endpoint listens on")
+    parser.add_argument("--regions", help="Comma separated regions to refresh, every region by default")
+    parser.add_argument(
+        "--interval",
+        type=parse_interval,
+        action="append",
+        default=[],
+        help="Seconds between refreshes of a resource type, e.g. instances=60, repeatable"
+    )
+    parser.add_argument(
+        "--max-workers",
+        type=int,
+        default=DEFAULT_MAX_WORKERS,
+        help="Number of refreshes running at the same time"
+    )
+    parser.add_argument("--serializer", choices=SERIALIZER_NAMES, help="JSON backend of the served documents")
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        help="Serve the regions, reserved instances and target groups from a response cache kept across restarts, "
+             "up to 24, 6 and 1 hours old"
+    )
+    parser.add_argument("--cache-file", default=DEFAULT_CACHE_FILE, help="File of the response cache of --cache")
+    parser.add_argument(
+        "--no-rate-limit",
+        action="store_true",
+        help="Send the calls as fast as botocore's adaptive retries allow instead of pacing them to the API quotas"
+    )
+
+    # Parse the arguments
+    args = parser.parse_args(argv)
+
+    # Serving the slow-changing responses from the cache kept across restarts
+    cache = ResponseCache(args.cache_file) if args.cache else None
+
+    daemon = InventoryDaemon(
+        client_pool=ClientPool(cache=cache, rate_limiter=None if args.no_rate_limit else AdaptiveRateLimiter()),
+        intervals=dict(args.interval),
+        regions=args.regions.split(",") if args.regions else None,
+        max_workers=args.max_workers,
+        serializer=args.serializer
+    )
+    asyncio.run(serve(daemon, args.host, args.port))
+    if cache is not None:
+        cache.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+Compact in-memory model of the inventory. Instead of keeping the raw boto3
+dictionaries, with every tag, block device mapping, network interface and
+security group, the collectors can convert the pages they stream into
+InstanceRecords holding only the fields the recommendation and print path use
+"""
+import sys
+
+# Tag EC2 puts on the instances launched by an auto scaling group
+AUTOSCALING_GROUP_TAG = "aws:autoscaling:groupName"
+
+# Tag EMR puts on the instances of a cluster
+EMR_CLUSTER_TAG = "aws:elasticmapreduce:job-flow-id"
+
+# Fields of the instances read by the inventory model, the columnar export, the
+# store and the recommendations, the ones the projection of collection_filters keeps
+INSTANCE_FIELDS = (
+    "InstanceId",
+    "InstanceType",
+    "InstanceLifecycle",
+    "SpotInstanceRequestId",
+    "State",
+    "Placement",
+    "LaunchTime",
+    "Platform",
+    "PlatformDetails",
+    "Architecture",
+    "ImageId",
+    "VpcId",
+    "SubnetId",
+    "PrivateIpAddress",
+    "PublicIpAddress",
+    "Tags"
+)
+
+# Fields of the reservations of the instances the projection keeps
+RESERVATION_FIELDS = ("ReservationId", "OwnerId", "Instances")
+
+def load_balancer_names(value):
+    """
+    Returns the LoadBalancerName annotation as a list, as fetch_inventory.py
+    stores a list of names and get_inventory.py a single name
+    """
+    if value is None:
+        return []
+    if isinstance(value, list):
+        return value
+    return [value]
+
+def intern(value):
+    """
+    Returns the interned string, so repeated values such as instance types,
+    regions and availability zones are stored once, or None
+    """
+    if value is None:
+        return None
+    return sys.intern(value)
+
+class InstanceRecord(object):
+    """
+    Fields of an instance used by the recommendation and print path
+    """
+
+    __slots__ = (
+        "account_id",
+        "region",
+        "instance_id",
+        "instance_type",
+        "lifecycle",
+        "state",
+        "availability_zone",
+        "load_balancer_names",
+        "autoscaling_group",
+        "launch_time"
+    )
+
+    def __init__(self, account_id, region, instance_id, instance_type, lifecycle, state,
+                 availability_zone, load_balancer_names, autoscaling_group, launch_time):
+        self.account_id = account_id
+        self.region = region
+        self.instance_id = instance_id
+        self.instance_type = instance_type
+        self.lifecycle = lifecycle
+        self.state = state
+        self.availability_zone = availability_zone
+        self.load_balancer_names = load_balancer_names
+        self.autoscaling_group = autoscaling_group
+        self.launch_time = launch_time
+
+    def __repr__(self):
+        return "InstanceRecord({})".format(", ".join(
+            "{}={!r}".format(field, getattr(self, field)) for field in self.__slots__
+        ))
+
+    def __eq__(self, other):
+        return isinstance(other, InstanceRecord) and all(
+            getattr(self, field) == getattr(other, field) for field in self.__slots__
+        )
+
+    def __hash__(self):
+        # Equal records share their instance id, which is never changed once read
+        return hash(self.instance_id)
+
+    @property
+    def spot(self):
+        """
+        Whether the instance is a spot instance
+        """
+        return self.lifecycle == "spot"
+
+    @classmethod
+    def from_instance(cls, instance, account_id, region):
+        """
+        Returns the record of an annotated instance dictionary from describe_instances
+        Parameters :
+        instance - instance from the Instances of a reservation
+        account_id - AWS account id the instance belongs to
+        region - AWS region the instance runs in
+        """
+        autoscaling_group = None
+        for tag in instance.get("Tags", ()):
+            if tag["Key"] == AUTOSCALING_GROUP_TAG:
+                autoscaling_group = intern(tag["Value"])
+                break
+        return cls(
+            intern(account_id),
+            intern(region),
+            instance["InstanceId"],
+            intern(instance.get("InstanceType")),
+            intern(instance.get("InstanceLifecycle", "on-demand")),
+            intern(instance.get("State", {}).get("Name")),
+            intern(instance.get("Placement", {}).get("AvailabilityZone")),
+            tuple(intern(name) for name in load_balancer_names(instance.get("LoadBalancerName"))),
+            autoscaling_group,
+            instance.get("LaunchTime")
+        )
+
+def track_instance_records(reservations, account_id, region, instance_records):
+    """
+    Yields the reservations unchanged while appending an InstanceRecord for
+    every instance to instance_records
+    Parameters :
+    reservations - iterable of annotated reservations from describe_instances
+    account_id - AWS account id the instances belong to
+    region - AWS region the instances run in
+    instance_records - list the records are appended to
+    """
+    for reservation in reservations:
+        instance_records.extend(
+            InstanceRecord.from_instance(instance, account_id, region)
+            for instance in reservation["Instances"]
+        )
+        yield reservation
@@ -0,0 +1,376 @@
+"""
+Embedded store of the collected instances, a SQLite database holding every
+load as a run so that the history of the inventory can be queried. The
+instances are indexed on instance id, instance type, region, account,
+lifecycle, load balancer and auto scaling group, so lookups never scan the
+inventory files. The collectors load their InstanceRecords into the store,
+and inventory files written earlier can be loaded with the load command
+"""
+import argparse
+import datetime
+import json
+import sqlite3
+
+from columnar_export import find_inventory_file, parse_timestamp
+from inventory_model import InstanceRecord
+from inventory_stream import iter_inventory_records
+
+# File the collectors load the instances into
+DEFAULT_STORE_FILE = "./inventory/inventory.sqlite"
+
+# Number of rows inserted per executemany call within the load transaction
+BATCH_SIZE = 10000
+
+# Rows of every index sampled by ANALYZE after a load
+ANALYSIS_LIMIT = 1000
+
+# Separator of the load balancer names gathered by group_concat, a character
+# that never appears in a load balancer name
+LOAD_BALANCER_SEPARATOR = "\x1f"
+
+# Columns of the instances table, in the order of the InstanceRecord fields
+INSTANCE_COLUMNS = (
+    "account_id",
+    "region",
+    "instance_id",
+    "instance_type",
+    "lifecycle",
+    "state",
+    "availability_zone",
+    "autoscaling_group",
+    "launch_time"
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY,
+    loaded_at TEXT NOT NULL,
+    instance_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS instances (
+    run_id INTEGER NOT NULL,
+    account_id TEXT,
+    region TEXT,
+    instance_id TEXT NOT NULL,
+    instance_type TEXT,
+    lifecycle TEXT,
+    state TEXT,
+    availability_zone TEXT,
+    autoscaling_group TEXT,
+    launch_time TEXT,
+    PRIMARY KEY (run_id, instance_id)
+);
+CREATE TABLE IF NOT EXISTS instance_load_balancers (
+    run_id INTEGER NOT NULL,
+    load_balancer_name TEXT NOT NULL,
+    instance_id TEXT NOT NULL,
+    PRIMARY KEY (run_id, instance_id, load_balancer_name)
+);
+CREATE INDEX IF NOT EXISTS instances_instance_id ON instances (instance_id, run_id);
+CREATE INDEX IF NOT EXISTS instances_type ON instances (run_id, instance_type, region, lifecycle);
+CREATE INDEX IF NOT EXISTS instances_region ON instances (run_id, region, lifecycle);
+CREATE INDEX IF NOT EXISTS instances_account ON instances (run_id, account_id, region);
+CREATE INDEX IF NOT EXISTS instances_lifecycle ON instances (run_id, lifecycle);
+CREATE INDEX IF NOT EXISTS instances_autoscaling_group ON instances (run_id, autoscaling_group);
+CREATE INDEX IF NOT EXISTS load_balancers_name ON instance_load_balancers (run_id, load_balancer_name, instance_id);
+"""
+
+def iter_inventory_instance_records(inventory_dir):
+    """
+    Yields an InstanceRecord for every instance of the instances file found in
+    inventory_dir, in any of the formats and compressions the collectors write
+    Parameters :
+    inventory_dir - directory holding the inventory files
+    """
+    path = find_inventory_file(inventory_dir, "instances")
+    if path is None:
+        return
+    for reservation in iter_inventory_records(path, "instances"):
+        for instance in reservation["Instances"]:
+            yield InstanceRecord.from_instance(instance, reservation.get("account_id"), reservation.get("region"))
+
+class InventoryStore(object):
+    """
+    SQLite store of the instances of every run
+    Parameters :
+    path - path of the SQLite file
+    """
+
+    def __init__(self, path=DEFAULT_STORE_FILE):
+        self.path = path
+        self.connection = sqlite3.connect(path, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def load(self, instance_records, batch_size=BATCH_SIZE):
+        """
+        Loads the records as a new run in a single transaction, inserting
+        batch_size rows per statement
+        Returns the id of the run
+        Parameters :
+        instance_records - iterable of InstanceRecords
+        batch_size - number of rows per executemany call
+        """
+        cursor = self.connection.cursor()
+        cursor.execute("BEGIN")
+        try:
+            cursor.execute(
+                "INSERT INTO runs (loaded_at) VALUES (?)",
+                (datetime.datetime.now(datetime.timezone.utc).isoformat(sep=" ", timespec="seconds"),)
+            )
+            run_id = cursor.lastrowid
+            count = 0
+            instances = []
+            load_balancers = []
+            for record in instance_records:
+                launch_time = record.launch_time
+                if launch_time is not None and not isinstance(launch_time, str):
+                    launch_time = str(launch_time)
+                instances.append((
+                    run_id,
+                    record.account_id,
+                    record.region,
+                    record.instance_id,
+                    record.instance_type,
+                    record.lifecycle,
+                    record.state,
+                    record.availability_zone,
+                    record.autoscaling_group,
+                    launch_time
+                ))
+                load_balancers.extend(
+                    (run_id, load_balancer_name, record.instance_id)
+                    for load_balancer_name in record.load_balancer_names
+                )
+                if len(instances) >= batch_size:
+                    count += self.insert_batch(cursor, instances, load_balancers)
+                    instances = []
+                    load_balancers = []
+            count += self.insert_batch(cursor, instances, load_balancers)
+            cursor.execute("UPDATE runs SET instance_count = ? WHERE run_id = ?", (count, run_id))
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+
+        # Refreshing the statistics of the indexes from a sample of every one
+        # so the planner picks the most selective index of a query
+        cursor.execute("PRAGMA analysis_limit = {}".format(ANALYSIS_LIMIT))
+        cursor.execute("ANALYZE")
+        return run_id
+
+    def insert_batch(self, cursor, instances, load_balancers):
+        """
+        Inserts a batch of instance and load balancer rows
+        Returns the number of instance rows
+        """
+        cursor.executemany(
+            "INSERT OR REPLACE INTO instances (run_id, {}) VALUES (?, {})".format(
+                ", ".join(INSTANCE_COLUMNS),
+                ", ".join("?" * len(INSTANCE_COLUMNS))
+            ),
+            instances
+        )
+        cursor.executemany(
+            "INSERT OR IGNORE INTO instance_load_balancers (run_id, load_balancer_name, instance_id) "
+            "VALUES (?, ?, ?)",
+            load_balancers
+        )
+        return len(instances)
+
+    def latest_run_id(self):
+        """
+        Returns the id of the latest run, or None when nothing was loaded
+        """
+        return self.connection.execute("SELECT MAX(run_id) FROM runs").fetchone()[0]
+
+    def runs(self):
+        """
+        Returns the list of (run_id, loaded_at, instance_count) of every run
+        """
+        return self.connection.execute(
+            "SELECT run_id, loaded_at, instance_count FROM runs ORDER BY run_id"
+        ).fetchall()
+
+    def select(self, where, parameters, join="", suffix=""):
+        """
+        Returns the InstanceRecords of the instances rows matching where, with
+        the names of their load balancers gathered by a correlated subquery
+        """
+        sql = (
+            "SELECT {}, (SELECT group_concat(load_balancer_name, ?) FROM instance_load_balancers"
+            " WHERE instance_load_balancers.run_id = instances.run_id"
+            " AND instance_load_balancers.instance_id = instances.instance_id)"
+            " FROM instances{} WHERE {}{}"
+        ).format(", ".join("instances." + column for column in INSTANCE_COLUMNS), join, where, suffix)
+        records = []
+        for row in self.connection.execute(sql, [LOAD_BALANCER_SEPARATOR] + list(parameters)):
+            load_balancer_names = tuple(sorted(row[-1].split(LOAD_BALANCER_SEPARATOR))) if row[-1] else ()
+            values = dict(zip(INSTANCE_COLUMNS, row))
+            records.append(InstanceRecord(
+                values["account_id"],
+                values["region"],
+                values["instance_id"],
+                values["instance_type"],
+                values["lifecycle"],
+                values["state"],
+                values["availability_zone"],
+                load_balancer_names,
+                values["autoscaling_group"],
+                parse_timestamp(values["launch_time"])
+            ))
+        return records
+
+    def instance(self, instance_id, run_id=None):
+        """
+        Returns the InstanceRecord of an instance in a run, by default the
+        latest run it was seen in, or None
+        Parameters :
+        instance_id - id of the instance
+        run_id - id of the run, or None
+        """
+        if run_id is None:
+            records = self.select(
+                "instances.instance_id = ?", (instance_id,), suffix=" ORDER BY instances.run_id DESC LIMIT 1"
+            )
+        else:
+            records = self.select("instances.run_id = ? AND instances.instance_id = ?", (run_id, instance_id))
+        return records[0] if records else None
+
+    def history(self, instance_id):
+        """
+        Returns the list of (run_id, InstanceRecord) of every run the instance was seen in
+        """
+        run_ids = [run_id for (run_id,) in self.connection.execute(
+            "SELECT run_id FROM instances WHERE instance_id = ? ORDER BY run_id", (instance_id,)
+        )]
+        return list(zip(run_ids, self.select(
+            "instances.instance_id = ?", (instance_id,), suffix=" ORDER BY instances.run_id"
+        )))
+
+    def query(self, run_id=None, account_id=None, region=None, instance_type=None, lifecycle=None,
+              state=None, load_balancer_name=None, autoscaling_group=None, limit=None):
+        """
+        Returns the InstanceRecords of a run, by default the latest, matching
+        every filter that is not None, ordered by instance id
+        Parameters :
+        run_id - id of the run, or None for the latest
+        account_id - AWS account id of the instances
+        region - AWS region of the instances
+        instance_type - instance type such as t3.large
+        lifecycle - on-demand, spot or scheduled
+        state - state name such as running
+        load_balancer_name - name of a classic or v2 load balancer the instances sit behind
+        autoscaling_group - name of the auto scaling group the instances belong to
+        limit - largest number of records returned, or None
+        """
+        if run_id is None:
+            run_id = self.latest_run_id()
+            if run_id is None:
+                return []
+        join = ""
+        parameters = []
+        if load_balancer_name is not None:
+            join = (" JOIN instance_load_balancers AS behind ON behind.run_id = instances.run_id"
+                    " AND behind.instance_id = instances.instance_id AND behind.load_balancer_name = ?")
+            parameters.append(load_balancer_name)
+        where = "instances.run_id = ?"
+        parameters.append(run_id)
+        filters = (
+            ("account_id", account_id),
+            ("region", region),
+            ("instance_type", instance_type),
+            ("lifecycle", lifecycle),
+            ("state", state),
+            ("autoscaling_group", autoscaling_group)
+        )
+        for column, value in filters:
+            if value is not None:
+                where += " AND instances.{} = ?".format(column)
+                parameters.append(value)
+        # The unary plus keeps the planner from walking the primary key of the
+        # run for its order instead of searching the index of the filters
+        suffix = " ORDER BY +instances.instance_id"
+        if limit is not None:
+            suffix += " LIMIT ?"
+            parameters.append(limit)
+        return self.select(where, parameters, join, suffix)
+
+def record_to_json(record):
+    """
+    Returns the dictionary of an InstanceRecord as printed by the query command
+    """
+    document = {field: getattr(record, field) for field in InstanceRecord.__slots__}
+    document["load_balancer_names"] = list(record.load_balancer_names)
+    if document["launch_time"] is not None:
+        document["launch_time"] = str(document["launch_time"])
+    return document
+
+def main(argv=None):
+    """
+    Parses the command line arguments and loads an inventory directory into
+    the store, lists its runs or prints the matching instances
+    Parameters :
+    argv - command line arguments, sys.argv[1:] when None
+    """
+    # Initializing the parser
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--store", default=DEFAULT_STORE_FILE, help="Path of the inventory store")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    # Loading the instances file of an inventory directory as a new run
+    load_parser = commands.add_parser("load", help="Load the instances of an inventory directory")
+    load_parser.add_argument("--inventory-dir", default="./inventory", help="Directory of the inventory files")
+
+    # Listing the runs
+    commands.add_parser("runs", help="List the loaded runs")
+
+    # Querying the instances
+    query_parser = commands.add_parser("query", help="Print the matching instances as json lines")
+    query_parser.add_argument("--run-id", type=int, help="Run to query, the latest by default")
+    query_parser.add_argument("--instance-id", help="Print the history of this instance over all runs")
+    query_parser.add_argument("--account-id")
+    query_parser.add_argument("--region")
+    query_parser.add_argument("--instance-type")
+    query_parser.add_argument("--lifecycle", help="on-demand, spot or scheduled")
+    query_parser.add_argument("--state")
+    query_parser.add_argument("--load-balancer", help="Name of a classic or v2 load balancer")
+    query_parser.add_argument("--autoscaling-group")
+    query_parser.add_argument("--limit", type=int)
+
+    # Parse the arguments
+    args = parser.parse_args(argv)
+
+    store = InventoryStore(args.store)
+    try:
+        if args.command == "load":
+            if find_inventory_file(args.inventory_dir, "instances") is None:
+                parser.error("no instances file in " + args.inventory_dir)
+            run_id = store.load(iter_inventory_instance_records(args.inventory_dir))
+            print("Loaded run {} with {} instances".format(run_id, store.runs()[-1][2]))
+        elif args.command == "runs":
+            for run in store.runs():
+                print("{}\t{}\t{}".format(*run))
+        elif args.instance_id is not None:
+            for run_id, record in store.history(args.instance_id):
+                print(json.dumps(dict(record_to_json(record), run_id=run_id)))
+        else:
+            for record in store.query(
+                    run_id=args.run_id,
+                    account_id=args.account_id,
+                    region=args.region,
+                    instance_type=args.instance_type,
+                    lifecycle=args.lifecycle,
+                    state=args.state,
+                    load_balancer_name=args.load_balancer,
+                    autoscaling_group=args.autoscaling_group,
+                    limit=args.limit):
+                print(json.dumps(record_to_json(record)))
+    finally:
+        store.close()
+
+if __name__ == "__main__":
+    main()
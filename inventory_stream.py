@@ -0,0 +1,349 @@
+"""
+Generator pipeline shared by the collectors: pages are pulled from the boto3
+paginators, annotated and written out one record at a time so that memory is
+bounded by the page size rather than by the size of the account
+"""
+import functools
+import gzip
+import io
+import itertools
+import json
+import random
+import time
+
+from instrumentation import THROTTLING_ERROR_CODES
+from recommendation_report import JsonStreamScanner
+from serializers import get_serializer
+
+# Marks an exhausted iterator in iter_non_empty
+_EMPTY = object()
+
+# Formats the inventory files can be written in
+OUTPUT_FORMATS = ("json", "ndjson")
+
+# Compressions the inventory files can be written with
+COMPRESSIONS = ("gzip", "zstd")
+
+# File name suffixes of the compressions
+COMPRESSION_SUFFIXES = {"gzip": ".gz", "zstd": ".zst"}
+
+# Size of the write buffer in front of the inventory files
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+# Times a page still throttled after all the attempts of botocore is asked for again
+PAGE_RETRIES = 5
+
+# Seconds before a throttled page is asked for again, doubling on every retry
+PAGE_RETRY_BACKOFF = 1.0
+
+def is_throttling_error(error):
+    """
+    Returns whether an exception is a ClientError with a throttling error code
+    """
+    from botocore.exceptions import ClientError
+
+    return isinstance(error, ClientError) and error.response.get("Error", {}).get("Code") in THROTTLING_ERROR_CODES
+
+def wait_for_page_retry(retries, error):
+    """
+    Sleeps before asking again for a page throttled for the retries-th time
+    with jittered exponential backoff, raising the error past PAGE_RETRIES
+    """
+    if retries > PAGE_RETRIES:
+        raise error
+    time.sleep(PAGE_RETRY_BACKOFF * 2 ** (retries - 1) * (0.5 + random.random() / 2))
+
+def call_with_retries(client, operation_name, **kwargs):
+    """
+    Returns the response of a single call, asking for it again when it is
+    still throttled once botocore gave up retrying it
+    Parameters :
+    client - boto3 client to make the call with
+    operation_name - name of the operation
+    kwargs - parameters passed on to the operation
+    """
+    retries = 0
+    while True:
+        try:
+            return getattr(client, operation_name)(**kwargs)
+        except Exception as error:
+            if not is_throttling_error(error):
+                raise
+            retries += 1
+            wait_for_page_retry(retries, error)
+
+@functools.lru_cache(maxsize=None)
+def paginator_model(service_name, api_version):
+    """
+    Returns the PaginatorModel of a version of a service, loaded once by a
+    botocore session of its own
+    """
+    import botocore.session
+
+    return botocore.session.get_session().get_paginator_model(service_name, api_version)
+
+def pagination_tokens(client, operation_name):
+    """
+    Returns the (input tokens, output tokens, more_results) of the paginator
+    of an operation, as its paginator model declares them
+    Parameters :
+    client - boto3 client the operation belongs to
+    operation_name - name of the operation, e.g. describe_instances
+    """
+    service_model = client.meta.service_model
+    config = paginator_model(service_model.service_name, service_model.api_version).get_paginator(
+        client.meta.method_to_api_mapping[operation_name]
+    )
+    input_tokens = config["input_token"]
+    output_tokens = config["output_token"]
+    return (
+        input_tokens if isinstance(input_tokens, list) else [input_tokens],
+        output_tokens if isinstance(output_tokens, list) else [output_tokens],
+        config.get("more_results")
+    )
+
+def iter_pages(client, operation_name, result_key, **kwargs):
+    """
+    Yields the list of records of every page of a describe_* call. Operations
+    with a paginator are called page by page with the input tokens set from
+    the output tokens of the previous page, as their paginator model declares
+    them, and a page that is still throttled once botocore gave up retrying it
+    is asked for again with the same tokens, so that the pages already
+    yielded are neither lost nor fetched twice
+    Parameters :
+    client - boto3 client to make the call with
+    operation_name - name of the describe_* operation
+    result_key - key of the records in the response
+    kwargs - parameters passed on to the operation
+    """
+    if not client.can_paginate(operation_name):
+        yield call_with_retries(client, operation_name, **kwargs).get(result_key, [])
+        return
+
+    import jmespath
+
+    input_tokens, output_tokens, more_results = pagination_tokens(client, operation_name)
+    tokens = {}
+    while True:
+        page = call_with_retries(client, operation_name, **dict(kwargs, **tokens))
+        yield page.get(result_key, [])
+        next_tokens = {
+            input_token: value
+            for input_token, value in zip(input_tokens, (jmespath.search(token, page) for token in output_tokens))
+            if value is not None
+        }
+        if not next_tokens or (more_results is not None and not jmespath.search(more_results, page)):
+            return
+        if next_tokens == tokens:
+            raise RuntimeError("{} returned the same pagination token twice".format(operation_name))
+        tokens = next_tokens
+
+def iter_records(client, operation_name, result_key, **kwargs):
+    """
+    Yields the records of a describe_* call one at a time across all its pages
+    Parameters :
+    client - boto3 client to make the call with
+    operation_name - name of the describe_* operation
+    result_key - key of the records in the response
+    kwargs - parameters passed on to the operation
+    """
+    for records in iter_pages(client, operation_name, result_key, **kwargs):
+        for record in records:
+            yield record
+
+def annotate_reservations(reservations, instance_to_v1_load_balancer_map, instance_to_v2_load_balancer_map=None):
+    """
+    Yields the reservations with the spot flag and LoadBalancerName set on
+    every instance, the names of its v1 load balancers followed by those of
+    its v2 load balancers, or None when it is behind none
+    Parameters :
+    reservations - iterable of reservations from describe_instances
+    instance_to_v1_load_balancer_map - instance_id to v1 load balancer names, or
+                                       to the names of both versions as RelationshipIndex maps them
+    instance_to_v2_load_balancer_map - instance_id to v2 load balancer names, or None
+    """
+    for reservation in reservations:
+        for instance in reservation["Instances"]:
+            instance["spot"] = instance.get("InstanceLifecycle") == "spot"
+            instance_id = instance["InstanceId"]
+            lb_v1 = instance_to_v1_load_balancer_map.get(instance_id)
+            lb_v2 = instance_to_v2_load_balancer_map.get(instance_id) if instance_to_v2_load_balancer_map else None
+            if lb_v2 is None:
+                instance["LoadBalancerName"] = lb_v1
+            else:
+                instance["LoadBalancerName"] = list(lb_v1 or []) + [name for name in lb_v2 if name not in (lb_v1 or [])]
+        yield reservation
+
+def iter_non_empty(records):
+    """
+    Returns an iterator over the records, or None when there are no records,
+    pulling at most the first record to find out
+    Parameters :
+    records - iterable of records
+    """
+    iterator = iter(records)
+    first = next(iterator, _EMPTY)
+    if first is _EMPTY:
+        return None
+    return itertools.chain((first,), iterator)
+
+def write_json_stream(file_name, field, records, before, after=(), serializer=None):
+    """
+    Writes {**before, field: [records], **after} to the binary file one
+    record at a time, producing the same document as encoding the whole
+    dictionary at once
+    Returns the number of records written
+    Parameters :
+    file_name - binary file object to write to
+    field - key the records are stored under
+    records - iterable of the records
+    before - list of (key, value) pairs written before the records
+    after - list of (key, value) pairs written after the records
+    serializer - name of one of the SERIALIZER_NAMES, or None for the fastest installed one
+    """
+    encode = get_serializer(serializer).encode
+    file_name.write(b"{")
+    for key, value in before:
+        file_name.write(encode(key) + b":" + encode(value) + b",")
+    file_name.write(encode(field) + b":[")
+    count = 0
+    for record in records:
+        if count:
+            file_name.write(b",")
+        file_name.write(encode(record))
+        count += 1
+    file_name.write(b"]")
+    for key, value in after:
+        file_name.write(b"," + encode(key) + b":" + encode(value))
+    file_name.write(b"}")
+    return count
+
+def write_ndjson_stream(file_name, records, stamp, serializer=None):
+    """
+    Writes every record as a json document on its own line of the binary
+    file with the stamp key value pairs prepended to it
+    Returns the number of records written
+    Parameters :
+    file_name - binary file object to write to
+    records - iterable of the records
+    stamp - list of (key, value) pairs written into every record
+    serializer - name of one of the SERIALIZER_NAMES, or None for the fastest installed one
+    """
+    encode = get_serializer(serializer).encode
+    prefix = b"{" + b",".join(encode(key) + b":" + encode(value) for key, value in stamp)
+    count = 0
+    for record in records:
+        encoded = encode(record)
+        if encoded == b"{}":
+            file_name.write(prefix + b"}\n")
+        elif stamp:
+            file_name.write(prefix + b"," + encoded[1:] + b"\n")
+        else:
+            file_name.write(encoded + b"\n")
+        count += 1
+    return count
+
+def write_records(file_name, output_format, field, records, before, after=(), serializer=None):
+    """
+    Writes the records in the requested output format, either as a single
+    json document or as one stamped json document per line
+    Returns the number of records written
+    Parameters :
+    file_name - binary file object to write to
+    output_format - one of OUTPUT_FORMATS
+    field - key the records are stored under in the json format
+    records - iterable of the records
+    before - list of (key, value) pairs written before the records
+    after - list of (key, value) pairs written after the records
+    serializer - name of one of the SERIALIZER_NAMES, or None for the fastest installed one
+    """
+    if output_format == "ndjson":
+        return write_ndjson_stream(file_name, records, list(before) + list(after), serializer)
+    return write_json_stream(file_name, field, records, before, after, serializer)
+
+def inventory_file_path(path, output_format="json", compression=None):
+    """
+    Returns the path of an inventory file for the output format and compression,
+    e.g. instances.json becomes instances.ndjson.gz
+    Parameters :
+    path - path of the inventory file in the json format
+    output_format - one of OUTPUT_FORMATS
+    compression - one of COMPRESSIONS, or None
+    """
+    if output_format == "ndjson" and path.endswith(".json"):
+        path = path[:-len(".json")] + ".ndjson"
+    if compression:
+        path += COMPRESSION_SUFFIXES[compression]
+    return path
+
+def open_inventory_file(path, mode, compression=None):
+    """
+    Opens an inventory file for writing bytes through a WRITE_BUFFER_SIZE buffer,
+    compressing them on the fly when a compression is given
+    Parameters :
+    path - path of the inventory file
+    mode - "w+" to truncate the file or "a+" to append to it
+    compression - one of COMPRESSIONS, or None
+    """
+    binary_mode = mode[0] + "b"
+    if compression == "gzip":
+        raw_file = gzip.open(path, binary_mode)
+    elif compression == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise RuntimeError("zstd compression needs the zstandard package")
+        raw_file = zstandard.open(path, binary_mode)
+    else:
+        return open(path, binary_mode, buffering=WRITE_BUFFER_SIZE)
+    return io.BufferedWriter(raw_file, WRITE_BUFFER_SIZE)
+
+def open_inventory_file_for_reading(path):
+    """
+    Opens an inventory file for reading text, decompressing it when its name
+    ends with the suffix of one of the COMPRESSIONS
+    Parameters :
+    path - path of the inventory file
+    """
+    if path.endswith(COMPRESSION_SUFFIXES["gzip"]):
+        return gzip.open(path, "rt", encoding="utf-8")
+    if path.endswith(COMPRESSION_SUFFIXES["zstd"]):
+        try:
+            import zstandard
+        except ImportError:
+            raise RuntimeError("zstd compression needs the zstandard package")
+        return zstandard.open(path, "rt", encoding="utf-8")
+    return open(path, encoding="utf-8")
+
+def iter_inventory_records(path, field):
+    """
+    Yields the records of an inventory file written in either of the
+    OUTPUT_FORMATS, with account_id, region and version set on every record.
+    The file is read a chunk at a time, so only the records of the region
+    being read are held in memory
+    Parameters :
+    path - path of the inventory file
+    field - key the records are stored under in the json format
+    """
+    with open_inventory_file_for_reading(path) as inventory_file:
+        if ".ndjson" in path:
+            for line in inventory_file:
+                if line.strip():
+                    yield json.loads(line)
+            return
+
+        # The json format holds one document per region written back to back
+        scanner = JsonStreamScanner(inventory_file)
+        while not scanner.at_end():
+            # The version of a region is written after its records
+            stamp = []
+            records = []
+            for key in scanner.iter_object():
+                if key != field:
+                    stamp.append((key, scanner.value()))
+                    continue
+                for _ in scanner.iter_array():
+                    records.append(scanner.value())
+            for record in records:
+                record.update(stamp)
+                yield record
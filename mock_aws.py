@@ -0,0 +1,796 @@
+"""
+Serves a synthetic fleet to real boto3 clients without network access. The
+fleet is generated from parameterized counts of instances, reserved
+instances, classic and v2 load balancers, target groups and auto scaling
+groups spread over a number of regions, page by page as the clients ask for
+it, along with the spot price history of its zones and its price list. Every
+call goes through the botocore client and its paginators up to the
+before-call event, where the response is served with a configurable latency
+and rate of throttled attempts. With a quota, calls go on through botocore's
+retry loop instead and every attempt past the quota of its account, region
+and service is answered with a throttling error, as AWS does
+"""
+import datetime
+import fnmatch
+import json
+import random
+import threading
+import time
+from contextlib import contextmanager
+from unittest import mock
+
+import boto3
+from botocore.awsrequest import AWSResponse
+
+# Regions of the fleet, extended with numbered regions past the real ones
+MOCK_REGIONS = [
+    "us-east-1", "us-east-2", "us-west-1", "us-west-2", "ap-south-1",
+    "ap-northeast-1", "ap-northeast-2", "ap-northeast-3", "ap-southeast-1",
+    "ap-southeast-2", "ca-central-1", "eu-central-1", "eu-west-1",
+    "eu-west-2", "eu-west-3", "eu-north-1", "sa-east-1"
+]
+
+# Account of the credentials stored in .aws file
+DEFAULT_ACCOUNT_ID = "123456789012"
+
+# Prefix of the access keys handed out by AssumeRole, followed by the account id
+ASSUMED_KEY_PREFIX = "mock-"
+
+# Records per page when the caller does not ask for a page size, as AWS does
+DEFAULT_PAGE_SIZES = {
+    "DescribeInstances": 1000,
+    "DescribeLoadBalancers": 400,
+    "DescribeTargetGroups": 400,
+    "DescribeAutoScalingGroups": 50,
+    "DescribeSpotPriceHistory": 1000,
+    "GetProducts": 100
+}
+
+# State of the terminated instances of the fleet, every other instance is running
+TERMINATED_STATE = {"Code": 48, "Name": "terminated"}
+
+# Instance types of the fleet
+INSTANCE_TYPES = ("m5.large", "m5.xlarge", "c5.large", "c5.xlarge", "r5.large", "r5.xlarge", "t3.large")
+
+# Hourly on-demand prices of the instance types of the fleet running Linux
+ON_DEMAND_PRICES = {
+    "m5.large": 0.096,
+    "m5.xlarge": 0.192,
+    "c5.large": 0.085,
+    "c5.xlarge": 0.17,
+    "r5.large": 0.126,
+    "r5.xlarge": 0.252,
+    "t3.large": 0.0832
+}
+
+# operatingSystem of the price list and factor of the Linux price of the
+# products of the fleet, by their ProductDescription in the spot price history
+OPERATING_SYSTEMS = {
+    "Linux/UNIX": ("Linux", 1.0),
+    "Windows": ("Windows", 1.8),
+    "Red Hat Enterprise Linux": ("RHEL", 1.6),
+    "SUSE Linux": ("SUSE", 1.4)
+}
+
+# Seconds between the spot price changes of the fleet, and number of changes it keeps
+SPOT_PRICE_INTERVAL = 3600
+SPOT_PRICE_HISTORY = 24
+
+# Error code of the throttled attempts
+THROTTLING_ERROR_CODE = "RequestLimitExceeded"
+
+# Error code of the throttled attempts of the services using the query protocol
+QUERY_THROTTLING_ERROR_CODE = "Throttling"
+
+# Error responses of the throttled attempts, by whether the service uses the ec2 protocol
+THROTTLING_ERROR_BODIES = {
+    True: ("<Response><Errors><Error><Code>%s</Code><Message>Request limit exceeded.</Message></Error>"
+           "</Errors><RequestID>mock</RequestID></Response>" % THROTTLING_ERROR_CODE).encode("utf-8"),
+    False: ("<ErrorResponse><Error><Type>Sender</Type><Code>%s</Code><Message>Rate exceeded</Message>"
+            "</Error><RequestId>mock</RequestId></ErrorResponse>" % QUERY_THROTTLING_ERROR_CODE).encode("utf-8")
+}
+
+# Seconds the first retry of a throttled attempt waits, doubling on every retry
+THROTTLING_BACKOFF = 0.05
+
+LAUNCH_TIME = datetime.datetime(2019, 10, 21, 12, 32, 41, tzinfo=datetime.timezone.utc)
+
+def region_names(region_count):
+    """
+    Returns the names of region_count regions
+    """
+    names = MOCK_REGIONS[:region_count]
+    names.extend("mock-region-{}".format(index) for index in range(len(names), region_count))
+    return names
+
+def split_count(count, parts, part):
+    """
+    Returns the (start, stop) of part out of count items spread evenly over parts
+    """
+    size, extra = divmod(count, parts)
+    start = part * size + min(part, extra)
+    return start, start + size + (1 if part < extra else 0)
+
+def synthetic_instance(region, index, autoscaling_group=None, lifecycle=None):
+    """
+    Returns an instance in the shape describe_instances returns it, with its
+    tags, block device mappings, network interface and security groups.
+    Every string is built per instance the way the boto3 parser does
+    Parameters :
+    region - AWS region of the instance
+    index - number of the instance within the fleet
+    autoscaling_group - name of the auto scaling group the instance belongs to, or None
+    lifecycle - InstanceLifecycle of the instance, None for on-demand
+    """
+    instance_id = "i-%017x" % index
+    zone = "%s%s" % (region, "abc"[index % 3])
+    private_ip = "10.%d.%d.%d" % (index // 65536 % 256, index // 256 % 256, index % 256)
+    security_groups = [
+        {"GroupName": "%s-sg-%d" % (name, index % 40), "GroupId": "sg-%08x" % (index % 40 + offset)}
+        for offset, name in enumerate(("web", "ssh"))
+    ]
+    tags = [
+        {"Key": "Name", "Value": "%s-app-%d" % (region, index)},
+        {"Key": "team", "Value": "team-%d" % (index % 12)}
+    ]
+    if autoscaling_group is not None:
+        tags.append({"Key": "aws:autoscaling:groupName", "Value": autoscaling_group})
+    instance = {
+        "AmiLaunchIndex": 0,
+        "ImageId": "ami-%08x" % (index % 50),
+        "InstanceId": instance_id,
+        "InstanceType": "%s" % INSTANCE_TYPES[index % len(INSTANCE_TYPES)],
+        "KeyName": "%s-key" % region,
+        "LaunchTime": LAUNCH_TIME,
+        "Monitoring": {"State": "disabled"},
+        "Placement": {"AvailabilityZone": zone, "GroupName": "", "Tenancy": "default"},
+        "PrivateDnsName": "ip-%s.%s.compute.internal" % (private_ip.replace(".", "-"), region),
+        "PrivateIpAddress": private_ip,
+        "ProductCodes": [],
+        "PublicDnsName": "",
+        "State": {"Code": 16, "Name": "running"},
+        "StateTransitionReason": "",
+        "SubnetId": "subnet-%08x" % (index % 30),
+        "VpcId": "vpc-%08x" % (index % 5),
+        "Architecture": "x86_64",
+        "BlockDeviceMappings": [
+            {
+                "DeviceName": device_name,
+                "Ebs": {
+                    "AttachTime": LAUNCH_TIME,
+                    "DeleteOnTermination": True,
+                    "Status": "attached",
+                    "VolumeId": "vol-%017x" % (index * 2 + offset)
+                }
+            }
+            for offset, device_name in enumerate(("/dev/xvda", "/dev/xvdb"))
+        ],
+        "ClientToken": "%s-%d" % (region, index),
+        "EbsOptimized": True,
+        "EnaSupport": True,
+        "Hypervisor": "xen",
+        "NetworkInterfaces": [
+            {
+                "Attachment": {
+                    "AttachTime": LAUNCH_TIME,
+                    "AttachmentId": "eni-attach-%017x" % index,
+                    "DeleteOnTermination": True,
+                    "DeviceIndex": 0,
+                    "Status": "attached"
+                },
+                "Description": "",
+                "Groups": [dict(group) for group in security_groups],
+                "Ipv6Addresses": [],
+                "MacAddress": "0a:%02x:%02x:%02x:%02x:01" % (
+                    index >> 24 & 255, index >> 16 & 255, index >> 8 & 255, index & 255
+                ),
+                "NetworkInterfaceId": "eni-%017x" % index,
+                "OwnerId": DEFAULT_ACCOUNT_ID,
+                "PrivateIpAddress": private_ip,
+                "PrivateIpAddresses": [{"Primary": True, "PrivateIpAddress": private_ip}],
+                "SourceDestCheck": True,
+                "Status": "in-use",
+                "SubnetId": "subnet-%08x" % (index % 30),
+                "VpcId": "vpc-%08x" % (index % 5),
+                "InterfaceType": "interface"
+            }
+        ],
+        "RootDeviceName": "/dev/xvda",
+        "RootDeviceType": "ebs",
+        "SecurityGroups": security_groups,
+        "SourceDestCheck": True,
+        "Tags": tags,
+        "VirtualizationType": "hvm",
+        "CpuOptions": {"CoreCount": 1, "ThreadsPerCore": 2}
+    }
+    if lifecycle is not None:
+        instance["InstanceLifecycle"] = lifecycle
+    return instance
+
+class RegionFleet(object):
+    """
+    Resources of the fleet in a single region. Instance j of the region sits
+    behind classic load balancer j % load_balancers, is a target of target
+    group j % target_groups and belongs to auto scaling group j % autoscaling_groups
+    """
+
+    def __init__(self, fleet, region_index):
+        parts = len(fleet.regions)
+        self.region = fleet.regions[region_index]
+        self.spot_ratio = fleet.spot_ratio
+        self.terminated_ratio = fleet.terminated_ratio
+        self.instances = split_count(fleet.instance_count, parts, region_index)
+        self.reservation_count = len(range(*split_count(fleet.reservation_count, parts, region_index)))
+        self.load_balancer_count = len(range(*split_count(fleet.load_balancer_count, parts, region_index)))
+        self.v2_load_balancer_count = len(range(*split_count(fleet.v2_load_balancer_count, parts, region_index)))
+        self.target_group_count = len(range(*split_count(fleet.target_group_count, parts, region_index)))
+        self.autoscaling_group_count = len(range(*split_count(fleet.autoscaling_group_count, parts, region_index)))
+
+    @property
+    def instance_count(self):
+        return self.instances[1] - self.instances[0]
+
+    def instance_id(self, local_index):
+        return "i-%017x" % (self.instances[0] + local_index)
+
+    def members(self, group, group_count):
+        """
+        Returns the local indexes of the instances of a load balancer, target group or asg
+        """
+        return range(group, self.instance_count, group_count)
+
+    def autoscaling_group_name(self, group):
+        return "%s-asg-%d" % (self.region, group)
+
+    def instance(self, local_index):
+        index = self.instances[0] + local_index
+        autoscaling_group = None
+        if self.autoscaling_group_count:
+            autoscaling_group = self.autoscaling_group_name(local_index % self.autoscaling_group_count)
+        lifecycle = None
+        if self.spot_ratio and (index * 7919) % 1000 < self.spot_ratio * 1000:
+            lifecycle = "spot"
+        instance = synthetic_instance(self.region, index, autoscaling_group, lifecycle)
+        if self.terminated_ratio and (index * 104729) % 1000 < self.terminated_ratio * 1000:
+            instance["State"] = dict(TERMINATED_STATE)
+        return instance
+
+    def reserved_instance(self, index):
+        zonal = index % 2 == 0
+        return {
+            "ReservedInstancesId": "%s-ri-%08d" % (self.region, index),
+            "InstanceType": INSTANCE_TYPES[index % len(INSTANCE_TYPES)],
+            "AvailabilityZone": "%sa" % self.region if zonal else None,
+            "Scope": "Availability Zone" if zonal else "Region",
+            "ProductDescription": "Linux/UNIX",
+            "InstanceTenancy": "default",
+            "OfferingClass": "standard",
+            "OfferingType": "No Upfront",
+            "State": "active",
+            "InstanceCount": 1 + index % 4,
+            "Duration": 31536000,
+            "FixedPrice": 0.0,
+            "UsagePrice": 0.0,
+            "CurrencyCode": "USD",
+            "Start": LAUNCH_TIME,
+            "End": LAUNCH_TIME + datetime.timedelta(days=365)
+        }
+
+    def load_balancer(self, index):
+        return {
+            "LoadBalancerName": "%s-elb-%d" % (self.region, index),
+            "DNSName": "%s-elb-%d.%s.elb.amazonaws.com" % (self.region, index, self.region),
+            "Instances": [
+                {"InstanceId": self.instance_id(local_index)}
+                for local_index in self.members(index, self.load_balancer_count)
+            ],
+            "AvailabilityZones": ["%sa" % self.region, "%sb" % self.region],
+            "Scheme": "internet-facing",
+            "CreatedTime": LAUNCH_TIME
+        }
+
+    def v2_load_balancer_arn(self, index):
+        return "arn:aws:elasticloadbalancing:%s:%s:loadbalancer/app/%s-alb-%d/%016x" % (
+            self.region, DEFAULT_ACCOUNT_ID, self.region, index, index
+        )
+
+    def v2_load_balancer(self, index):
+        return {
+            "LoadBalancerArn": self.v2_load_balancer_arn(index),
+            "LoadBalancerName": "%s-alb-%d" % (self.region, index),
+            "DNSName": "%s-alb-%d.%s.elb.amazonaws.com" % (self.region, index, self.region),
+            "Scheme": "internet-facing",
+            "Type": "application",
+            "State": {"Code": "active"},
+            "CreatedTime": LAUNCH_TIME
+        }
+
+    def target_group_arn(self, index):
+        return "arn:aws:elasticloadbalancing:%s:%s:targetgroup/%s-tg-%d/%016x" % (
+            self.region, DEFAULT_ACCOUNT_ID, self.region, index, index
+        )
+
+    def target_group(self, index):
+        load_balancer_arns = []
+        if self.v2_load_balancer_count:
+            load_balancer_arns.append(self.v2_load_balancer_arn(index % self.v2_load_balancer_count))
+        return {
+            "TargetGroupArn": self.target_group_arn(index),
+            "TargetGroupName": "%s-tg-%d" % (self.region, index),
+            "Protocol": "HTTP",
+            "Port": 80,
+            "TargetType": "instance",
+            "LoadBalancerArns": load_balancer_arns
+        }
+
+    def target_health(self, target_group_arn):
+        index = int(target_group_arn.rsplit("/", 1)[1], 16)
+        return [
+            {
+                "Target": {"Id": self.instance_id(local_index), "Port": 80},
+                "TargetHealth": {"State": "unhealthy" if local_index % 10 == 9 else "healthy"}
+            }
+            for local_index in self.members(index, self.target_group_count)
+        ]
+
+    def spot_price_history(self, start_time, instance_types, product_descriptions, availability_zone=None):
+        """
+        Returns the spot prices of the zones of the region from the one in
+        effect at start_time on, newest first, as describe_spot_price_history
+        does, the prices changing every SPOT_PRICE_INTERVAL
+        """
+        now = int(time.time()) // SPOT_PRICE_INTERVAL
+        first = now - SPOT_PRICE_HISTORY + 1
+        if start_time is not None:
+            first = max(first, int(start_time.timestamp()) // SPOT_PRICE_INTERVAL)
+        return [
+            {
+                "AvailabilityZone": zone,
+                "InstanceType": instance_type,
+                "ProductDescription": product_description,
+                "SpotPrice": "%.6f" % spot_price(instance_type, product_description, zone_index, interval),
+                "Timestamp": datetime.datetime.fromtimestamp(interval * SPOT_PRICE_INTERVAL, datetime.timezone.utc)
+            }
+            for interval in range(now, first - 1, -1)
+            for zone_index, zone in enumerate(self.region + letter for letter in "abc")
+            if availability_zone in (None, zone)
+            for instance_type in instance_types or INSTANCE_TYPES
+            if instance_type in ON_DEMAND_PRICES
+            for product_description in product_descriptions or OPERATING_SYSTEMS
+            if product_description in OPERATING_SYSTEMS
+        ]
+
+    def price_list(self, filters):
+        """
+        Returns the price list items of the instance types of the region
+        matching the TERM_MATCH filters, as JSON strings as get_products does
+        """
+        price_items = []
+        for product_description, (operating_system, factor) in OPERATING_SYSTEMS.items():
+            for instance_type in INSTANCE_TYPES:
+                attributes = {
+                    "instanceType": instance_type,
+                    "regionCode": self.region,
+                    "operatingSystem": operating_system,
+                    "tenancy": "Shared",
+                    "preInstalledSw": "NA",
+                    "capacitystatus": "Used",
+                    "licenseModel": "No License required"
+                }
+                if any(attributes.get(item["Field"]) != item["Value"] for item in filters):
+                    continue
+                sku = "%s-%s-%s" % (self.region, instance_type, operating_system)
+                price_items.append(json.dumps({
+                    "product": {"productFamily": "Compute Instance", "attributes": attributes, "sku": sku},
+                    "serviceCode": "AmazonEC2",
+                    "terms": {"OnDemand": {sku + ".JRTCKXETXF": {"priceDimensions": {
+                        sku + ".JRTCKXETXF.6YS6EN2CT7": {
+                            "unit": "Hrs",
+                            "pricePerUnit": {"USD": "%.10f" % (ON_DEMAND_PRICES[instance_type] * factor)}
+                        }
+                    }}}}
+                }))
+        return price_items
+
+    def autoscaling_group(self, index):
+        name = self.autoscaling_group_name(index)
+        return {
+            "AutoScalingGroupName": name,
+            "AutoScalingGroupARN": "arn:aws:autoscaling:%s:%s:autoScalingGroup:%08x:autoScalingGroupName/%s" % (
+                self.region, DEFAULT_ACCOUNT_ID, index, name
+            ),
+            "LaunchConfigurationName": "%s-lc" % name,
+            "MinSize": 1,
+            "MaxSize": 10,
+            "DesiredCapacity": 2,
+            "AvailabilityZones": ["%sa" % self.region, "%sb" % self.region],
+            "LoadBalancerNames": [],
+            "TargetGroupARNs": [],
+            "Instances": [
+                {"InstanceId": self.instance_id(local_index), "LifecycleState": "InService"}
+                for local_index in self.members(index, self.autoscaling_group_count)
+            ],
+            "CreatedTime": LAUNCH_TIME
+        }
+
+class RawBody(object):
+    """
+    Raw body of a served AWSResponse
+    """
+
+    def __init__(self, content):
+        self.content = content
+
+    def stream(self, **kwargs):
+        yield self.content
+
+class QuotaBucket(object):
+    """
+    Token bucket of the attempts AWS accepts from an account, region and
+    service, refilled at quota attempts per second up to burst attempts
+    """
+
+    def __init__(self, quota, burst):
+        self.quota = quota
+        self.burst = burst
+        self.tokens = burst
+        self.refilled_at = time.monotonic()
+
+    def admit(self):
+        """
+        Returns whether an attempt is accepted, taking its token
+        """
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.refilled_at) * self.quota)
+        self.refilled_at = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+def page(records_count, make_record, start_token, page_size, result_key, token_key):
+    """
+    Returns a page of records starting at the numeric start_token with the
+    token of the next page under token_key, if there is one
+    """
+    start = int(start_token or 0)
+    stop = min(start + page_size, records_count)
+    response = {result_key: [make_record(index) for index in range(start, stop)]}
+    if stop < records_count:
+        response[token_key] = str(stop)
+    return response
+
+def request_filters(body):
+    """
+    Returns the (name, values) of the Filter.N.Name and Filter.N.Value.M
+    parameters of an ec2 request body
+    """
+    filters = []
+    number = 1
+    while "Filter.%d.Name" % number in body:
+        values = []
+        while "Filter.%d.Value.%d" % (number, len(values) + 1) in body:
+            values.append(body["Filter.%d.Value.%d" % (number, len(values) + 1)])
+        filters.append((body["Filter.%d.Name" % number], values))
+        number += 1
+    return filters
+
+def request_list(body, name):
+    """
+    Returns the values of the name.N parameters of an ec2 request body
+    """
+    values = []
+    while "%s.%d" % (name, len(values) + 1) in body:
+        values.append(body["%s.%d" % (name, len(values) + 1)])
+    return values
+
+def request_time(value):
+    """
+    Returns the datetime of a timestamp of an ec2 request body
+    """
+    return datetime.datetime.strptime(value.replace(".", "Z").split("Z")[0], "%Y-%m-%dT%H:%M:%S").replace(
+        tzinfo=datetime.timezone.utc
+    )
+
+def spot_price(instance_type, product_description, zone_index, interval):
+    """
+    Returns the hourly spot price of an instance type and product in a zone
+    during an interval, between 30% and 50% of the on-demand price
+    """
+    on_demand = ON_DEMAND_PRICES[instance_type] * OPERATING_SYSTEMS[product_description][1]
+    type_index = INSTANCE_TYPES.index(instance_type)
+    return on_demand * (0.3 + 0.02 * ((zone_index * 7 + type_index * 3 + interval) % 11))
+
+def filter_value(record, name):
+    """
+    Returns the values of a record a filter of name is matched against
+    """
+    if name in ("instance-state-name", "state"):
+        state = record.get("State")
+        return [state.get("Name") if isinstance(state, dict) else state]
+    if name == "instance-type":
+        return [record.get("InstanceType")]
+    if name == "tag-key":
+        return [tag["Key"] for tag in record.get("Tags", [])]
+    if name.startswith("tag:"):
+        return [tag["Value"] for tag in record.get("Tags", []) if tag["Key"] == name[len("tag:"):]]
+    raise NotImplementedError("filter {} is not served by the synthetic fleet".format(name))
+
+def matches(record, filters):
+    """
+    Returns whether a record matches every filter, with one of its values
+    matching one of the wildcard values of the filter as AWS matches them
+    """
+    return all(
+        any(value is not None and fnmatch.fnmatchcase(value, pattern)
+            for value in filter_value(record, name) for pattern in patterns)
+        for name, patterns in filters
+    )
+
+class SyntheticFleet(object):
+    """
+    Parameterized fleet served to boto3 clients by serve, counting every call
+    Parameters :
+    region_count - number of regions the resources are spread over
+    instance_count - number of instances over all regions
+    reservation_count - number of reserved instance purchases over all regions
+    load_balancer_count - number of classic load balancers over all regions
+    v2_load_balancer_count - number of v2 load balancers over all regions
+    target_group_count - number of target groups over all regions
+    autoscaling_group_count - number of auto scaling groups over all regions
+    spot_ratio - share of the instances that are spot instances
+    terminated_ratio - share of the instances that are terminated
+    latency - seconds every attempt takes
+    throttle_rate - share of the attempts that are throttled and retried
+    seed - seed of the throttling
+    quota - attempts per second accepted per (account, region, service), or
+            None to serve every call at the before-call event
+    quota_burst - attempts accepted at once per (account, region, service),
+                  one second of quota when None
+    count_bytes - add up the size of the responses as JSON in response_bytes
+    """
+
+    def __init__(self, region_count=len(MOCK_REGIONS), instance_count=1000, reservation_count=100,
+                 load_balancer_count=50, v2_load_balancer_count=50, target_group_count=100,
+                 autoscaling_group_count=20, spot_ratio=0.2, latency=0.0, throttle_rate=0.0, seed=0,
+                 quota=None, quota_burst=None, terminated_ratio=0.0, count_bytes=False):
+        self.regions = region_names(region_count)
+        self.instance_count = instance_count
+        self.reservation_count = reservation_count
+        self.load_balancer_count = load_balancer_count
+        self.v2_load_balancer_count = v2_load_balancer_count
+        self.target_group_count = target_group_count
+        self.autoscaling_group_count = autoscaling_group_count
+        self.spot_ratio = spot_ratio
+        self.terminated_ratio = terminated_ratio
+        self.count_bytes = count_bytes
+        self.response_bytes = 0
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.random = random.Random(seed)
+        self.quota = quota
+        self.quota_burst = quota_burst if quota_burst is not None else quota
+        self.quota_buckets = {}
+        self.local = threading.local()
+        self.region_fleets = {region: RegionFleet(self, index) for index, region in enumerate(self.regions)}
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.throttles = 0
+
+    def call_count(self):
+        """
+        Returns the number of calls served
+        """
+        with self.lock:
+            return sum(self.calls.values())
+
+    def attempts(self):
+        """
+        Returns the number of attempts the calls took, after throttling
+        """
+        while True:
+            time.sleep(self.latency)
+            with self.lock:
+                throttled = self.throttle_rate and self.random.random() < self.throttle_rate
+                if not throttled:
+                    return
+                self.throttles += 1
+            yield
+
+    def admit(self, account_id, region, service):
+        """
+        Returns whether an attempt is accepted by the quota of its account,
+        region and service and the throttling rate, counting it when throttled
+        """
+        time.sleep(self.latency)
+        with self.lock:
+            key = (account_id, region, service)
+            bucket = self.quota_buckets.get(key)
+            if bucket is None:
+                bucket = self.quota_buckets[key] = QuotaBucket(self.quota, self.quota_burst)
+            throttled = self.throttle_rate and self.random.random() < self.throttle_rate
+            if bucket.admit() and not throttled:
+                return True
+            self.throttles += 1
+            return False
+
+    def respond(self, account_id, service, region, operation_name, body):
+        """
+        Returns the parsed response of an operation, counting its size when asked to
+        """
+        response = self.build_response(account_id, service, region, operation_name, body)
+        if self.count_bytes:
+            size = len(json.dumps(response, default=str))
+            with self.lock:
+                self.response_bytes += size
+        return response
+
+    def build_response(self, account_id, service, region, operation_name, body):
+        """
+        Returns the parsed response of an operation
+        """
+        # The services using the json protocol send a json document
+        if isinstance(body, bytes):
+            body = json.loads(body.decode("utf-8") or "{}")
+        region_fleet = self.region_fleets.get(region) or self.region_fleets[self.regions[0]]
+        page_size = int(body.get("MaxResults") or body.get("PageSize") or body.get("MaxRecords") or
+                        DEFAULT_PAGE_SIZES.get(operation_name, 0))
+        if operation_name == "GetCallerIdentity":
+            return {"Account": account_id, "Arn": "arn:aws:iam::%s:user/inventory" % account_id}
+        if operation_name == "AssumeRole":
+            role_account_id = body["RoleArn"].split(":")[4]
+            return {"Credentials": {
+                "AccessKeyId": ASSUMED_KEY_PREFIX + role_account_id,
+                "SecretAccessKey": "mock",
+                "SessionToken": "mock",
+                "Expiration": LAUNCH_TIME
+            }}
+        if operation_name == "DescribeRegions":
+            return {"Regions": [{"RegionName": name} for name in self.regions]}
+        if operation_name == "DescribeInstances":
+            response = page(
+                region_fleet.instance_count, region_fleet.instance, body.get("NextToken"),
+                page_size, "Instances", "NextToken"
+            )
+            filters = request_filters(body)
+            instances = [instance for instance in response.pop("Instances") if matches(instance, filters)]
+            response["Reservations"] = [
+                {"ReservationId": "r-%s" % instance["InstanceId"][2:], "OwnerId": account_id,
+                 "Groups": [], "Instances": [instance]}
+                for instance in instances
+            ]
+            return response
+        if operation_name == "DescribeReservedInstances":
+            filters = request_filters(body)
+            return {"ReservedInstances": [
+                reserved_instance
+                for reserved_instance in map(region_fleet.reserved_instance, range(region_fleet.reservation_count))
+                if matches(reserved_instance, filters)
+            ]}
+        if operation_name == "DescribeLoadBalancers" and service == "elastic-load-balancing":
+            return page(
+                region_fleet.load_balancer_count, region_fleet.load_balancer, body.get("Marker"),
+                page_size, "LoadBalancerDescriptions", "NextMarker"
+            )
+        if operation_name == "DescribeLoadBalancers":
+            return page(
+                region_fleet.v2_load_balancer_count, region_fleet.v2_load_balancer, body.get("Marker"),
+                page_size, "LoadBalancers", "NextMarker"
+            )
+        if operation_name == "DescribeTargetGroups":
+            return page(
+                region_fleet.target_group_count, region_fleet.target_group, body.get("Marker"),
+                page_size, "TargetGroups", "NextMarker"
+            )
+        if operation_name == "DescribeTargetHealth":
+            return {"TargetHealthDescriptions": region_fleet.target_health(body["TargetGroupArn"])}
+        if operation_name == "DescribeAutoScalingGroups":
+            return page(
+                region_fleet.autoscaling_group_count, region_fleet.autoscaling_group, body.get("NextToken"),
+                page_size, "AutoScalingGroups", "NextToken"
+            )
+        if operation_name == "DescribeSpotPriceHistory":
+            records = region_fleet.spot_price_history(
+                request_time(body["StartTime"]) if body.get("StartTime") else None,
+                request_list(body, "InstanceType"),
+                request_list(body, "ProductDescription"),
+                body.get("AvailabilityZone")
+            )
+            return page(len(records), records.__getitem__, body.get("NextToken"), page_size,
+                        "SpotPriceHistory", "NextToken")
+        if operation_name == "GetProducts":
+            filters = body.get("Filters", [])
+            region = next((item["Value"] for item in filters if item["Field"] == "regionCode"), None)
+            region_fleet = self.region_fleets.get(region)
+            price_items = region_fleet.price_list(filters) if region_fleet is not None else []
+            response = page(len(price_items), price_items.__getitem__, body.get("NextToken"), page_size,
+                            "PriceList", "NextToken")
+            response["FormatVersion"] = "aws_v1"
+            return response
+        raise NotImplementedError("{} {} is not served by the synthetic fleet".format(service, operation_name))
+
+    def handler(self, account_id):
+        """
+        Returns the before-call handler serving the calls of a session of account_id
+        """
+        def before_call(event_name, params, context, model, **kwargs):
+            # Calls answered by the ResponseCache do not reach AWS
+            if context.get("response_cache_hit"):
+                return None
+            service = event_name.split(".")[1]
+            with self.lock:
+                key = (service, model.name)
+                self.calls[key] = self.calls.get(key, 0) + 1
+            if self.quota:
+                # Served by before_send and before_parse on every attempt of the call
+                self.local.call = (account_id, service, context.get("client_region"), model.name, params["body"])
+                return None
+            retries = 0
+            for _ in self.attempts():
+                time.sleep(THROTTLING_BACKOFF * 2 ** min(retries, 5))
+                retries += 1
+            parsed = self.respond(account_id, service, context.get("client_region"), model.name, params["body"])
+            parsed["ResponseMetadata"] = {"HTTPStatusCode": 200, "RetryAttempts": retries}
+            return AWSResponse(params["url"], 200, {}, None), parsed
+        return before_call
+
+    def before_send(self, request, **kwargs):
+        """
+        Answers an attempt of the call of the thread with a throttling error
+        when it is over the quota and with an empty response otherwise
+        """
+        account_id, service, region, operation_name, _ = self.local.call
+        if not self.admit(account_id, region, service):
+            return AWSResponse(request.url, 400, {}, RawBody(THROTTLING_ERROR_BODIES[service == "ec2"]))
+        body = "<{0}Response><{0}Result/></{0}Response>".format(operation_name)
+        return AWSResponse(request.url, 200, {}, RawBody(body.encode("utf-8")))
+
+    def before_parse(self, response_dict, customized_response_dict, **kwargs):
+        """
+        Fills the parsed response of an accepted attempt of the call of the thread
+        """
+        if response_dict["status_code"] != 200:
+            return
+        customized_response_dict.update(self.respond(*self.local.call))
+        customized_response_dict["ResponseMetadata"] = {"HTTPStatusCode": 200}
+
+    @contextmanager
+    def serve(self):
+        """
+        Serves the fleet to every boto3 session and client created inside the block
+        """
+        original_session = boto3.session.Session
+        fleet = self
+
+        class MockAwsSession(original_session):
+            """
+            boto3 session whose clients are served by the fleet, belonging to
+            the account of an assumed role key or to DEFAULT_ACCOUNT_ID
+            """
+
+            def __init__(self, aws_access_key_id=None, aws_secret_access_key=None, aws_session_token=None,
+                         region_name=None, **kwargs):
+                account_id = DEFAULT_ACCOUNT_ID
+                if aws_access_key_id and aws_access_key_id.startswith(ASSUMED_KEY_PREFIX):
+                    account_id = aws_access_key_id[len(ASSUMED_KEY_PREFIX):]
+                # Explicit keys keep botocore from looking for credentials
+                original_session.__init__(
+                    self,
+                    aws_access_key_id=aws_access_key_id or "mock",
+                    aws_secret_access_key=aws_secret_access_key or "mock",
+                    aws_session_token=aws_session_token,
+                    region_name=region_name or fleet.regions[0],
+                    **kwargs
+                )
+                # Served last, after the handlers of the clients such as the response cache
+                self.events.register_last("before-call", fleet.handler(account_id))
+                if fleet.quota:
+                    self.events.register_last("before-send", fleet.before_send)
+                    self.events.register_last("before-parse", fleet.before_parse)
+
+        def default_client(*args, **kwargs):
+            return MockAwsSession().client(*args, **kwargs)
+
+        with mock.patch.object(boto3.session, "Session", MockAwsSession), \
+                mock.patch.object(boto3, "client", default_client):
+            yield self
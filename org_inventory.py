@@ -0,0 +1,335 @@
+"""
+This script collects the inventory of every account of an organization. It
+assumes a role in every account and spreads the accounts over a pool of
+processes, each fetching the regions of its account concurrently, and writes
+the inventory of every account into its own partition directory
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from client_pool import ClientPool
+from collection_filters import parse_filter
+from fetch_inventory import DEFAULT_INVENTORY_DIR, DEFAULT_MAX_WORKERS, fetch_data
+from inventory_stream import COMPRESSIONS, OUTPUT_FORMATS
+from rate_limiter import AdaptiveRateLimiter
+from resource_collectors import COLLECTORS, parse_resources
+from response_cache import DEFAULT_CACHE_FILE, ResponseCache
+from run_checkpoint import run_complete
+from serializers import SERIALIZER_NAMES
+
+# Role assumed in every member account, the one AWS Organizations creates
+DEFAULT_ROLE_NAME = "OrganizationAccountAccessRole"
+
+# Seconds the assumed role credentials stay valid
+DEFAULT_SESSION_DURATION = 3600
+
+# Client pool of the worker process, built once per process by init_worker
+WORKER_CLIENT_POOL = None
+
+def load_accounts(accounts_file):
+    """
+    Returns the account ids listed in a file, one per line, skipping blank
+    lines and lines starting with #
+    Parameters :
+    accounts_file - path of the account list
+    """
+    with open(accounts_file) as account_list:
+        return [
+            line.split()[0] for line in account_list
+            if line.strip() and not line.lstrip().startswith("#")
+        ]
+
+def list_organization_accounts(client_pool):
+    """
+    Returns the ids of the active accounts of the organization, listed with the
+    credentials stored in .aws file, which must belong to the management account
+    Parameters :
+    client_pool - ClientPool the organizations client is taken from
+    """
+    organizations = client_pool.client("organizations", None)
+    account_ids = []
+    for page in organizations.get_paginator("list_accounts").paginate():
+        account_ids.extend(account["Id"] for account in page["Accounts"] if account["Status"] == "ACTIVE")
+    return account_ids
+
+def assume_role(client_pool, account_id, role_name=DEFAULT_ROLE_NAME, duration=DEFAULT_SESSION_DURATION):
+    """
+    Returns the (access_key_id, secret_access_key, session_token) of the role
+    assumed in an account
+    Parameters :
+    client_pool - ClientPool the sts client is taken from
+    account_id - AWS account id to assume the role in
+    role_name - name of the role to assume
+    duration - seconds the credentials stay valid
+    """
+    response = client_pool.client("sts", None).assume_role(
+        RoleArn="arn:aws:iam::{}:role/{}".format(account_id, role_name),
+        RoleSessionName="inventory-{}".format(account_id),
+        DurationSeconds=duration
+    )
+    credentials = response["Credentials"]
+    return (credentials["AccessKeyId"], credentials["SecretAccessKey"], credentials["SessionToken"])
+
+def account_partition(inventory_dir, account_id):
+    """
+    Returns the directory the inventory of an account is written to
+    """
+    return os.path.join(inventory_dir, "account_id={}".format(account_id))
+
+def init_worker(cache_file=None, refresh=False, rate_limit=True):
+    """
+    Builds the client pool every account collected by the worker process shares
+    Parameters :
+    cache_file - path of the response cache shared by all processes, or None
+    refresh - ignore the cached responses and fetch them again
+    rate_limit - pace the calls of every account, region and service to its API quota
+    """
+    global WORKER_CLIENT_POOL
+    cache = ResponseCache(cache_file, refresh=refresh) if cache_file else None
+    WORKER_CLIENT_POOL = ClientPool(cache=cache, rate_limiter=AdaptiveRateLimiter() if rate_limit else None)
+
+def collect_account(account_id, role_name=DEFAULT_ROLE_NAME, inventory_dir=DEFAULT_INVENTORY_DIR,
+                    max_workers=DEFAULT_MAX_WORKERS, output_format="json", compression=None, snapshot_dir=None,
+                    relationship_dir=None, serializer=None, resume=False, resources=None, filters=None,
+                    projection=False):
+    """
+    Assumes the role in an account and fetches all of its regions into the
+    partition of the account. When resuming, an account whose partition holds
+    a complete run is skipped and the others only fetch what their
+    checkpoint is missing
+    Returns (account_id, seconds taken, error message or None)
+    Parameters :
+    account_id - AWS account id to collect
+    role_name - name of the role to assume in the account
+    inventory_dir - directory holding the partitions of all accounts
+    max_workers - number of regions fetched at the same time
+    output_format - format of the inventory files, json or ndjson
+    compression - compression of the inventory files, gzip, zstd or None
+    snapshot_dir - directory holding the snapshots of all accounts, or None
+    relationship_dir - directory holding the relationship indexes of all accounts, or None
+    serializer - serializer backend of the inventory files, one of SERIALIZER_NAMES or None for the fastest
+    resume - keep what the previous run completed in the partition of the account
+    resources - names of the collectors of the resources to fetch, or None for every resource
+    filters - list of (name, values) filters of the instances and reserved instances, or None
+    projection - keep only the fields of the instances the inventory is read for
+    """
+    start = time.perf_counter()
+    try:
+        partition = account_partition(inventory_dir, account_id)
+        if resume and run_complete(partition):
+            print("Account {} is already complete".format(account_id))
+            return account_id, time.perf_counter() - start, None
+
+        client_pool = WORKER_CLIENT_POOL or ClientPool()
+        credentials = assume_role(client_pool, account_id, role_name)
+
+        try:
+            # Every account starts from an empty partition of its own, so the
+            # processes never append to the same files
+            if not os.path.isdir(partition):
+                os.makedirs(partition)
+            if not resume:
+                for file_name in os.listdir(partition):
+                    path = os.path.join(partition, file_name)
+                    if os.path.isfile(path):
+                        os.remove(path)
+
+            print("For account " + account_id)
+            complete = fetch_data(
+                max_workers=max_workers,
+                output_format=output_format,
+                compression=compression,
+                snapshot_dir=account_partition(snapshot_dir, account_id) if snapshot_dir else None,
+                client_pool=client_pool,
+                credentials=credentials,
+                inventory_dir=partition,
+                relationship_dir=relationship_dir,
+                serializer=serializer,
+                resume=resume,
+                resources=resources,
+                filters=filters,
+                projection=projection
+            )
+        finally:
+            # The clients of the account are not used again by this process
+            client_pool.release(credentials)
+        if not complete:
+            return account_id, time.perf_counter() - start, "the run did not complete, run again with --resume"
+        return account_id, time.perf_counter() - start, None
+
+    except Exception as error:
+        return account_id, time.perf_counter() - start, str(error)
+
+def collect_organization(account_ids, processes=None, role_name=DEFAULT_ROLE_NAME,
+                         inventory_dir=DEFAULT_INVENTORY_DIR, max_workers=DEFAULT_MAX_WORKERS,
+                         output_format="json", compression=None, snapshot_dir=None,
+                         cache_file=None, refresh=False, relationship_dir=None, serializer=None,
+                         rate_limit=True, resume=False, resources=None, filters=None, projection=False):
+    """
+    Collects the accounts over a pool of processes
+    Returns the list of (account_id, seconds taken, error message or None)
+    in the order the accounts were given
+    Parameters :
+    account_ids - AWS account ids to collect
+    processes - number of accounts collected at the same time, or None for one per core
+    role_name - name of the role to assume in every account
+    inventory_dir - directory holding the partitions of all accounts
+    max_workers - number of regions of an account fetched at the same time
+    output_format - format of the inventory files, json or ndjson
+    compression - compression of the inventory files, gzip, zstd or None
+    snapshot_dir - directory holding the snapshots of all accounts, or None
+    cache_file - path of the response cache shared by all processes, or None
+    refresh - ignore the cached responses and fetch them again
+    relationship_dir - directory holding the relationship indexes of all accounts, or None
+    serializer - serializer backend of the inventory files, one of SERIALIZER_NAMES or None for the fastest
+    rate_limit - pace the calls of every account, region and service to its API quota. The
+                 accounts are collected by separate processes, each pacing the accounts it collects
+    resume - skip the accounts the previous run completed and only fetch what the others are missing,
+             or start a new run when every account completed
+    resources - names of the collectors of the resources to fetch, or None for every resource
+    filters - list of (name, values) filters of the instances and reserved instances, or None
+    projection - keep only the fields of the instances the inventory is read for
+    """
+    # Once every account completed, resuming the run starts a new one
+    if resume and all(run_complete(account_partition(inventory_dir, account_id)) for account_id in account_ids):
+        print("The previous run in {} is complete, starting a new run".format(inventory_dir))
+        resume = False
+    with ProcessPoolExecutor(max_workers=processes, initializer=init_worker,
+                             initargs=(cache_file, refresh, rate_limit)) as executor:
+        futures = [
+            executor.submit(
+                collect_account,
+                account_id,
+                role_name,
+                inventory_dir,
+                max_workers,
+                output_format,
+                compression,
+                snapshot_dir,
+                relationship_dir,
+                serializer,
+                resume,
+                resources,
+                filters,
+                projection
+            )
+            for account_id in account_ids
+        ]
+        return [future.result() for future in futures]
+
+def main(argv=None):
+    """
+    Parses the command line arguments and collects the inventory of every
+    account of the organization into its partition
+    Parameters :
+    argv - command line arguments, sys.argv[1:] when None
+    """
+    # Initializing the parser
+    parser = argparse.ArgumentParser()
+
+    # Adding parameters
+    parser.add_argument("--accounts-file", help="File listing the account ids, one per line")
+    parser.add_argument(
+        "--organization",
+        action="store_true",
+        help="Collect every active account listed by AWS Organizations"
+    )
+    parser.add_argument("--role-name", default=DEFAULT_ROLE_NAME, help="Role assumed in every account")
+    parser.add_argument("--processes", type=int, help="Number of accounts collected at the same time")
+    parser.add_argument(
+        "--max-workers",
+        type=int,
+        default=DEFAULT_MAX_WORKERS,
+        help="Number of regions of an account fetched at the same time"
+    )
+    parser.add_argument("--inventory-dir", default=DEFAULT_INVENTORY_DIR, help="Directory of the account partitions")
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, default="json", help="Format of the inventory files")
+    parser.add_argument("--compression", choices=COMPRESSIONS, help="Compress the inventory files")
+    parser.add_argument(
+        "--serializer",
+        choices=SERIALIZER_NAMES,
+        help="JSON backend of the inventory files, the fastest installed one by default"
+    )
+    parser.add_argument("--snapshot-dir", help="Keep a snapshot of every account in this directory")
+    parser.add_argument(
+        "--relationship-dir",
+        help="Keep the instance to load balancer index of every account and region in this directory"
+    )
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        help="Serve the regions, reserved instances and target groups from a response cache kept across runs, "
+             "up to 24, 6 and 1 hours old"
+    )
+    parser.add_argument("--cache-file", default=DEFAULT_CACHE_FILE, help="File of the response cache of --cache")
+    parser.add_argument("--refresh", action="store_true", help="Fetch the responses of --cache again")
+    parser.add_argument(
+        "--resources",
+        type=parse_resources,
+        help="Comma separated resources to fetch out of " + ", ".join(COLLECTORS) + ", all of them by default"
+    )
+    parser.add_argument(
+        "--filter",
+        type=parse_filter,
+        action="append",
+        default=[],
+        help="Filter the instances and reserved instances server side, e.g. state=active, family=m5,c5, "
+             "tag:team=web, tag-key=owner or asg=* for the instances of any auto scaling group, repeatable"
+    )
+    parser.add_argument(
+        "--projection",
+        action="store_true",
+        help="Keep only the instance fields the inventory is read for, dropping devices, interfaces and the like"
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Skip the accounts the previous run completed and only fetch what the others are missing"
+    )
+    parser.add_argument(
+        "--no-rate-limit",
+        action="store_true",
+        help="Send the calls as fast as botocore's adaptive retries allow instead of pacing them to the API quotas"
+    )
+
+    # Parse the arguments
+    args = parser.parse_args(argv)
+
+    if args.accounts_file:
+        account_ids = load_accounts(args.accounts_file)
+    elif args.organization:
+        account_ids = list_organization_accounts(ClientPool())
+    else:
+        parser.error("one of --accounts-file or --organization is required")
+
+    results = collect_organization(
+        account_ids,
+        processes=args.processes,
+        role_name=args.role_name,
+        inventory_dir=args.inventory_dir,
+        max_workers=args.max_workers,
+        output_format=args.format,
+        compression=args.compression,
+        snapshot_dir=args.snapshot_dir,
+        cache_file=args.cache_file if args.cache else None,
+        refresh=args.refresh,
+        relationship_dir=args.relationship_dir,
+        serializer=args.serializer,
+        rate_limit=not args.no_rate_limit,
+        resume=args.resume,
+        resources=args.resources,
+        filters=args.filter,
+        projection=args.projection
+    )
+    for account_id, seconds, error in results:
+        if error is not None:
+            print("Account {} failed after {:.1f}s: {}".format(account_id, seconds, error))
+    print("Collected {} of {} accounts".format(
+        sum(1 for result in results if result[2] is None),
+        len(results)
+    ))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,582 @@
+"""
+This script fetches the spot price history and the on-demand price list of
+the instance types of the inventory and keeps them in a price table, so the
+recommendations join the instances to their prices without calling AWS per
+instance type. The table is a directory of numpy arrays sorted by a key
+packing the codes of the region, instance type, product and availability
+zone, memory mapped when read and looked up with binary searches:
+zone_prices - latest spot price of every availability zone
+on_demand_prices - on-demand price of every region
+prices - on-demand price and highest zone spot price of every region
+The manifest next to them holds the names the codes stand for and the time
+every region was last fetched. The spot price history is fetched from that
+time on, which returns the price in effect then and the changes since, so a
+refresh only transfers the prices that changed. Prices are kept hourly, in
+USD, as AWS quotes them
+"""
+import argparse
+import datetime
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from client_pool import ClientPool
+from columnar_export import find_inventory_file, flatten_instances
+from inventory_stream import iter_inventory_records, iter_records
+from reservation_matcher import normalize_platform
+from run_checkpoint import replace_atomically
+
+# Directory the price table is written to
+DEFAULT_PRICE_DIR = "./prices"
+
+# Name of the manifest file in the price table directory
+MANIFEST_FILE_NAME = "prices.json"
+
+# Version of the price table layout, a table of another version is fetched again
+PRICE_TABLE_VERSION = 1
+
+# Hours in a month, turning the hourly prices into the monthly prices of the recommendations
+HOURS_PER_MONTH = 730
+
+# Products priced, named by the platform normalize_platform gives the instances, with their
+# ProductDescription in the spot price history and operatingSystem in the price list
+PRODUCTS = {
+    "linux": ("Linux/UNIX", "Linux"),
+    "windows": ("Windows", "Windows"),
+    "red hat enterprise linux": ("Red Hat Enterprise Linux", "RHEL"),
+    "suse linux": ("SUSE Linux", "SUSE")
+}
+
+# Products fetched unless others are asked for
+DEFAULT_PRODUCTS = ("linux", "windows")
+
+# Region of the price list API endpoint
+PRICING_REGION = "us-east-1"
+
+# Days after which the on-demand prices of a region are fetched again
+DEFAULT_ON_DEMAND_MAX_AGE = 7
+
+# Bits of the key given to the instance type, product and availability zone codes, the region takes the rest
+INSTANCE_TYPE_BITS = 16
+PRODUCT_BITS = 8
+ZONE_BITS = 16
+
+# Layouts of the arrays of the price table
+ZONE_PRICE_DTYPE = [("key", "<i8"), ("spot_price", "<f8"), ("timestamp", "<i8")]
+ON_DEMAND_PRICE_DTYPE = [("key", "<i8"), ("on_demand_price", "<f8"), ("timestamp", "<i8")]
+PRICE_DTYPE = [
+    ("key", "<i8"),
+    ("on_demand_price", "<f8"),
+    ("on_demand_timestamp", "<i8"),
+    ("spot_price", "<f8"),
+    ("spot_timestamp", "<i8")
+]
+
+# Arrays of the price table by name
+ARRAY_DTYPES = {"zone_prices": ZONE_PRICE_DTYPE, "on_demand_prices": ON_DEMAND_PRICE_DTYPE, "prices": PRICE_DTYPE}
+
+# Limits of the codes of the vocabularies of the price table, by their bits in the key
+VOCABULARY_LIMITS = {
+    "regions": 2 ** (63 - INSTANCE_TYPE_BITS - PRODUCT_BITS - ZONE_BITS),
+    "instance_types": 2 ** INSTANCE_TYPE_BITS,
+    "products": 2 ** PRODUCT_BITS,
+    "zones": 2 ** ZONE_BITS
+}
+
+def encode_keys(regions, instance_types, products, zones=0):
+    """
+    Returns the keys of the prices of the given codes, scalars or numpy arrays
+    """
+    return (((regions << INSTANCE_TYPE_BITS | instance_types) << PRODUCT_BITS | products) << ZONE_BITS) | zones
+
+def timestamp_seconds(value):
+    """
+    Returns the seconds since the epoch of a datetime, naive ones being UTC
+    """
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=datetime.timezone.utc)
+    return int(value.timestamp())
+
+def latest_by_key(rows, order_field):
+    """
+    Returns the rows sorted by key with only the last of every key by
+    order_field, the last given winning ties
+    """
+    import numpy
+
+    rows = rows[numpy.lexsort((rows[order_field], rows["key"]))]
+    return rows[numpy.append(rows["key"][1:] != rows["key"][:-1], True)]
+
+def find_prices(table, keys, known, field):
+    """
+    Returns the field of the rows of a sorted table of every key, NaN for the
+    keys it does not hold or that are not known
+    """
+    import numpy
+
+    found_prices = numpy.full(len(keys), numpy.nan)
+    if len(table):
+        positions = numpy.minimum(numpy.searchsorted(table["key"], keys), len(table) - 1)
+        found = known & (table["key"][positions] == keys)
+        found_prices[found] = table[field][positions[found]]
+    return found_prices
+
+class PriceTable(object):
+    """
+    Price table kept in a directory. The arrays are memory mapped read only
+    and replaced by in-memory ones when updated, save writes them under a new
+    generation and switches the manifest over to it, so a reader never sees a
+    partially written table
+    Parameters :
+    directory - directory of the price table, created by save when missing
+    """
+
+    def __init__(self, directory=DEFAULT_PRICE_DIR):
+        import numpy
+
+        self.directory = directory
+        manifest = None
+        try:
+            with open(os.path.join(directory, MANIFEST_FILE_NAME)) as manifest_file:
+                manifest = json.load(manifest_file)
+        except (IOError, ValueError):
+            pass
+        if manifest is not None and manifest.get("version") != PRICE_TABLE_VERSION:
+            print("Not reading the price table in {}, it was written in another layout".format(directory))
+            manifest = None
+        if manifest is None:
+            manifest = {
+                "version": PRICE_TABLE_VERSION,
+                "generation": 0,
+                "files": {},
+                "regions": [],
+                "instance_types": [],
+                "products": [],
+                # Code 0 of the zones stands for the region as a whole
+                "zones": [""],
+                "spot_fetched": {},
+                "on_demand_fetched": {}
+            }
+        self.manifest = manifest
+        self.codes = {
+            name: {value: code for code, value in enumerate(manifest[name])} for name in VOCABULARY_LIMITS
+        }
+        self.arrays = {}
+        for name, dtype in ARRAY_DTYPES.items():
+            file_name = manifest["files"].get(name)
+            if file_name is None:
+                self.arrays[name] = numpy.zeros(0, dtype=dtype)
+            else:
+                self.arrays[name] = numpy.load(os.path.join(directory, file_name), mmap_mode="r")
+
+    def __len__(self):
+        return len(self.arrays["prices"])
+
+    def code(self, vocabulary, value):
+        """
+        Returns the code of a value of a vocabulary, adding it when new
+        """
+        codes = self.codes[vocabulary]
+        code = codes.get(value)
+        if code is None:
+            code = len(codes)
+            if code >= VOCABULARY_LIMITS[vocabulary]:
+                raise ValueError("too many {} in the price table".format(vocabulary))
+            codes[value] = code
+            self.manifest[vocabulary].append(value)
+        return code
+
+    def category_codes(self, vocabulary, values):
+        """
+        Returns the codes of a sequence of values as a numpy array, -1 for the values not in the vocabulary
+        """
+        import pandas
+
+        return pandas.Categorical(values, categories=self.manifest[vocabulary]).codes.astype("int64")
+
+    def spot_fetched(self, region):
+        """
+        Returns the time the spot prices of a region were last fetched, or None
+        """
+        fetched = self.manifest["spot_fetched"].get(region)
+        return datetime.datetime.fromisoformat(fetched) if fetched else None
+
+    def on_demand_stale(self, region, products, now, max_age):
+        """
+        Returns whether the on-demand prices of a region were fetched longer
+        than max_age ago or without some of the products
+        """
+        fetched = self.manifest["on_demand_fetched"].get(region)
+        return (
+            fetched is None or
+            not set(products).issubset(fetched["products"]) or
+            now - datetime.datetime.fromisoformat(fetched["time"]) > max_age
+        )
+
+    def update_spot(self, region, records, fetched_at):
+        """
+        Keeps the latest of the spot prices of every availability zone of a
+        region and the records of its spot price history
+        Returns the number of records
+        Parameters :
+        region - AWS region of the records
+        records - iterable of the records of describe_spot_price_history
+        fetched_at - time the records were asked for, the start time of the next refresh
+        """
+        import numpy
+
+        region_code = self.code("regions", region)
+        rows = numpy.fromiter(
+            (
+                (
+                    encode_keys(
+                        region_code,
+                        self.code("instance_types", record["InstanceType"]),
+                        self.code("products", normalize_platform(record["ProductDescription"])),
+                        self.code("zones", record["AvailabilityZone"])
+                    ),
+                    float(record["SpotPrice"]),
+                    timestamp_seconds(record["Timestamp"])
+                )
+                for record in records
+            ),
+            dtype=ZONE_PRICE_DTYPE
+        )
+        self.arrays["zone_prices"] = latest_by_key(numpy.concatenate([self.arrays["zone_prices"], rows]), "timestamp")
+        self.manifest["spot_fetched"][region] = fetched_at.isoformat()
+        self.build_prices()
+        return len(rows)
+
+    def update_on_demand(self, region, prices, products, fetched_at):
+        """
+        Replaces the on-demand prices of a region
+        Returns the number of prices
+        Parameters :
+        region - AWS region of the prices
+        prices - iterable of (instance_type, product, hourly price)
+        products - products the prices were fetched for
+        fetched_at - time the prices were fetched
+        """
+        import numpy
+
+        region_code = self.code("regions", region)
+        timestamp = timestamp_seconds(fetched_at)
+        rows = numpy.fromiter(
+            (
+                (
+                    encode_keys(
+                        region_code,
+                        self.code("instance_types", instance_type),
+                        self.code("products", product)
+                    ),
+                    price,
+                    timestamp
+                )
+                for instance_type, product, price in prices
+            ),
+            dtype=ON_DEMAND_PRICE_DTYPE
+        )
+        self.arrays["on_demand_prices"] = latest_by_key(
+            numpy.concatenate([self.arrays["on_demand_prices"], rows]),
+            "timestamp"
+        )
+        self.manifest["on_demand_fetched"][region] = {"time": fetched_at.isoformat(), "products": sorted(products)}
+        self.build_prices()
+        return len(rows)
+
+    def build_prices(self):
+        """
+        Rebuilds the prices of the regions from the zone and on-demand prices.
+        The spot price of a region is the highest of its zones, so that the
+        savings of an instance in an unknown zone are not overstated
+        """
+        import numpy
+
+        zone_prices = self.arrays["zone_prices"]
+        on_demand_prices = self.arrays["on_demand_prices"]
+        # The zone prices are sorted by key, so their region keys are sorted too
+        spot_keys = (zone_prices["key"] >> ZONE_BITS) << ZONE_BITS
+        starts = numpy.flatnonzero(numpy.append(True, spot_keys[1:] != spot_keys[:-1])) if len(spot_keys) else []
+        keys = numpy.union1d(spot_keys[starts], on_demand_prices["key"])
+        prices = numpy.zeros(len(keys), dtype=PRICE_DTYPE)
+        prices["key"] = keys
+        prices["on_demand_price"] = numpy.nan
+        prices["spot_price"] = numpy.nan
+        if len(starts):
+            positions = numpy.searchsorted(keys, spot_keys[starts])
+            prices["spot_price"][positions] = numpy.maximum.reduceat(zone_prices["spot_price"], starts)
+            prices["spot_timestamp"][positions] = numpy.maximum.reduceat(zone_prices["timestamp"], starts)
+        positions = numpy.searchsorted(keys, on_demand_prices["key"])
+        prices["on_demand_price"][positions] = on_demand_prices["on_demand_price"]
+        prices["on_demand_timestamp"][positions] = on_demand_prices["timestamp"]
+        self.arrays["prices"] = prices
+
+    def save(self):
+        """
+        Writes the arrays under the next generation, replaces the manifest and
+        removes the files of the previous generation
+        """
+        import numpy
+
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        previous_files = dict(self.manifest["files"])
+        self.manifest["generation"] += 1
+        for name, array in self.arrays.items():
+            file_name = "{}-{}.npy".format(name, self.manifest["generation"])
+
+            def write(path, array=array):
+                with open(path, "wb") as array_file:
+                    numpy.save(array_file, numpy.ascontiguousarray(array))
+            replace_atomically(self.directory, os.path.join(self.directory, file_name), write)
+            self.manifest["files"][name] = file_name
+        encoded = json.dumps(self.manifest, indent=2, sort_keys=True).encode("utf-8")
+
+        def write(path):
+            with open(path, "wb") as manifest_file:
+                manifest_file.write(encoded)
+        replace_atomically(self.directory, os.path.join(self.directory, MANIFEST_FILE_NAME), write)
+        for file_name in previous_files.values():
+            path = os.path.join(self.directory, file_name)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def monthly_prices(self, regions, instance_types, products, zones=None):
+        """
+        Returns numpy arrays of the monthly on-demand and spot prices of every
+        instance, NaN where the table has none. The spot price is the one of
+        the zone of the instance when known and the one of its region otherwise
+        Parameters :
+        regions - sequence of the regions of the instances
+        instance_types - sequence of their instance types
+        products - sequence of their platforms, as normalize_platform gives them
+        zones - sequence of their availability zones, or None
+        """
+        import numpy
+
+        region_codes = self.category_codes("regions", regions)
+        instance_type_codes = self.category_codes("instance_types", instance_types)
+        product_codes = self.category_codes("products", products)
+        known = (region_codes >= 0) & (instance_type_codes >= 0) & (product_codes >= 0)
+        keys = encode_keys(region_codes, instance_type_codes, product_codes)
+        on_demand_prices = find_prices(self.arrays["prices"], keys, known, "on_demand_price")
+        spot_prices = find_prices(self.arrays["prices"], keys, known, "spot_price")
+        if zones is not None:
+            zone_codes = self.category_codes("zones", zones)
+            zone_spot_prices = find_prices(
+                self.arrays["zone_prices"], keys | zone_codes, known & (zone_codes > 0), "spot_price"
+            )
+            spot_prices = numpy.where(numpy.isnan(zone_spot_prices), spot_prices, zone_spot_prices)
+        return on_demand_prices * HOURS_PER_MONTH, spot_prices * HOURS_PER_MONTH
+
+    def price_frame(self, product="linux"):
+        """
+        Returns a DataFrame of the monthly on_demand_price and spot_price of a
+        product by region and instance type
+        """
+        import numpy
+        import pandas
+
+        prices = self.arrays["prices"]
+        keys = prices["key"] >> ZONE_BITS
+        selected = (keys & (2 ** PRODUCT_BITS - 1)) == self.codes["products"].get(product, -1)
+        keys = keys[selected] >> PRODUCT_BITS
+        return pandas.DataFrame({
+            "region": numpy.array(self.manifest["regions"], dtype=object)[keys >> INSTANCE_TYPE_BITS],
+            "instance_type": numpy.array(self.manifest["instance_types"], dtype=object)[
+                keys & (2 ** INSTANCE_TYPE_BITS - 1)
+            ],
+            "on_demand_price": prices["on_demand_price"][selected] * HOURS_PER_MONTH,
+            "spot_price": prices["spot_price"][selected] * HOURS_PER_MONTH
+        })
+
+def iter_spot_price_history(ec2_client, start_time, instance_types=None, products=DEFAULT_PRODUCTS):
+    """
+    Yields the spot price history of a region from start_time on, starting
+    with the price in effect at start_time in every availability zone
+    Parameters :
+    ec2_client - boto3 ec2 client of the region
+    start_time - datetime the history starts at
+    instance_types - instance types to price, or None for all of them
+    products - products to price, keys of PRODUCTS
+    """
+    parameters = {
+        "StartTime": start_time,
+        "ProductDescriptions": [PRODUCTS[product][0] for product in products]
+    }
+    if instance_types is not None:
+        parameters["InstanceTypes"] = list(instance_types)
+    return iter_records(ec2_client, "describe_spot_price_history", "SpotPriceHistory", **parameters)
+
+def iter_on_demand_prices(pricing_client, region, products=DEFAULT_PRODUCTS):
+    """
+    Yields the (instance_type, product, hourly price) of the on-demand, shared
+    tenancy instances of a region out of the price list of AmazonEC2
+    Parameters :
+    pricing_client - boto3 pricing client
+    region - AWS region to price
+    products - products to price, keys of PRODUCTS
+    """
+    for product in products:
+        attributes = (
+            ("regionCode", region),
+            ("operatingSystem", PRODUCTS[product][1]),
+            ("tenancy", "Shared"),
+            ("preInstalledSw", "NA"),
+            ("capacitystatus", "Used"),
+            ("licenseModel", "No License required")
+        )
+        price_list = iter_records(
+            pricing_client,
+            "get_products",
+            "PriceList",
+            ServiceCode="AmazonEC2",
+            Filters=[{"Type": "TERM_MATCH", "Field": field, "Value": value} for field, value in attributes]
+        )
+        for price_item in price_list:
+            if isinstance(price_item, str):
+                price_item = json.loads(price_item)
+            instance_type = price_item["product"]["attributes"].get("instanceType")
+            for term in price_item.get("terms", {}).get("OnDemand", {}).values():
+                for dimension in term["priceDimensions"].values():
+                    if instance_type and dimension.get("unit") == "Hrs":
+                        yield instance_type, product, float(dimension["pricePerUnit"]["USD"])
+
+def load_instance_types(inventory_dir):
+    """
+    Returns a dictionary of region to the sorted instance types of the instances of the inventory
+    Parameters :
+    inventory_dir - directory holding the inventory files
+    """
+    path = find_inventory_file(inventory_dir, "instances")
+    if path is None:
+        return {}
+    instance_types = {}
+    for row in flatten_instances(iter_inventory_records(path, "instances")):
+        instance_types.setdefault(row["region"], set()).add(row["instance_type"])
+    return {region: sorted(types) for region, types in instance_types.items()}
+
+def refresh_prices(price_table, instance_types, products=DEFAULT_PRODUCTS, client_pool=None, credentials=None,
+                   max_workers=8, on_demand_max_age=datetime.timedelta(days=DEFAULT_ON_DEMAND_MAX_AGE), now=None):
+    """
+    Fetches the spot prices that changed since the last refresh of every
+    region and the on-demand prices of the regions whose prices are stale,
+    the regions at the same time, and updates the price table
+    Returns the number of spot price records and on-demand prices fetched
+    Parameters :
+    price_table - PriceTable to update, saved by the caller
+    instance_types - dictionary of region to the instance types to price, or to None for all of them
+    products - products to price, keys of PRODUCTS
+    client_pool - ClientPool the clients are taken from, or None for a new one
+    credentials - (access_key_id, secret_access_key, session_token) tuple, or None for the .aws file
+    max_workers - number of regions fetched at the same time
+    on_demand_max_age - timedelta after which the on-demand prices of a region are fetched again
+    now - time of the refresh, now by default
+    """
+    if client_pool is None:
+        client_pool = ClientPool()
+    if now is None:
+        now = datetime.datetime.now(datetime.timezone.utc)
+
+    def fetch(region):
+        # Fetched from the last refresh on, or from now for the prices in effect
+        start_time = price_table.spot_fetched(region) or now
+        spot_records = list(iter_spot_price_history(
+            client_pool.client("ec2", region, credentials),
+            start_time,
+            instance_types[region],
+            products
+        ))
+        on_demand_prices = None
+        if price_table.on_demand_stale(region, products, now, on_demand_max_age):
+            on_demand_prices = list(iter_on_demand_prices(
+                client_pool.client("pricing", PRICING_REGION, credentials),
+                region,
+                products
+            ))
+        return region, spot_records, on_demand_prices
+
+    spot_count = 0
+    on_demand_count = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # The table is only updated from this thread
+        for region, spot_records, on_demand_prices in executor.map(fetch, sorted(instance_types)):
+            spot_count += price_table.update_spot(region, spot_records, now)
+            if on_demand_prices is not None:
+                on_demand_count += price_table.update_on_demand(region, on_demand_prices, products, now)
+    return spot_count, on_demand_count
+
+def parse_products(value):
+    """
+    Returns the products of a comma separated list of keys of PRODUCTS
+    """
+    products = [product.strip() for product in value.split(",") if product.strip()]
+    unknown = sorted(set(products).difference(PRODUCTS))
+    if unknown:
+        raise argparse.ArgumentTypeError(
+            "unknown products {}, choose from {}".format(", ".join(unknown), ", ".join(PRODUCTS))
+        )
+    return products
+
+def main(argv=None):
+    """
+    Refreshes the price table with the prices of the instance types of the inventory
+    Parameters :
+    argv - command line arguments, sys.argv[1:] when None
+    """
+    # Initializing the parser
+    parser = argparse.ArgumentParser()
+
+    # Adding parameters
+    parser.add_argument("--inventory-dir", default="./inventory", help="Directory of the inventory files")
+    parser.add_argument("--price-dir", default=DEFAULT_PRICE_DIR, help="Directory of the price table")
+    parser.add_argument(
+        "--products",
+        type=parse_products,
+        default=list(DEFAULT_PRODUCTS),
+        help="Comma separated products to price out of " + ", ".join(PRODUCTS)
+    )
+    parser.add_argument(
+        "--regions",
+        help="Comma separated regions to price all instance types of, instead of those of the inventory"
+    )
+    parser.add_argument("--max-workers", type=int, default=8, help="Number of regions fetched at the same time")
+    parser.add_argument(
+        "--on-demand-max-age",
+        type=float,
+        default=DEFAULT_ON_DEMAND_MAX_AGE,
+        help="Days after which the on-demand prices of a region are fetched again"
+    )
+
+    # Parse the arguments
+    args = parser.parse_args(argv)
+
+    if args.regions:
+        instance_types = {region: None for region in args.regions.split(",")}
+    else:
+        instance_types = load_instance_types(args.inventory_dir)
+    if not instance_types:
+        print("No instances in {}, nothing to price".format(args.inventory_dir))
+        return
+    price_table = PriceTable(args.price_dir)
+    try:
+        spot_count, on_demand_count = refresh_prices(
+            price_table,
+            instance_types,
+            products=args.products,
+            max_workers=args.max_workers,
+            on_demand_max_age=datetime.timedelta(days=args.on_demand_max_age)
+        )
+        price_table.save()
+        print("Fetched {} spot price records and {} on-demand prices, {} prices in {}".format(
+            spot_count,
+            on_demand_count,
+            len(price_table),
+            args.price_dir
+        ))
+
+    except Exception as error:
+        print(error)
+
+if __name__ == "__main__":
+    main()
@@ -1,34 +1,59 @@
-import json
-
-with open('./recommendation_response.json') as json_file:
-    data = json.load(json_file)
-    account_id = data["account_id"]
-    print()
-    print("FOR THE AWS ACCOUNT ID "+account_id)
-    savings_by_region = data["savings_by_region"]
-    for saving in savings_by_region:
-        print("---------------------------------------------------------------------")
-        print("IN THE REGION "+saving["region"])
-        print()
-        for saving_type in saving["savings_by_rule_type"]:
-            if saving_type["recommended_type"] == "SPOT":
-                print("Convert the following instances to SPOT to save "+saving_type["total_savings"]+" USD ")
-                for index,detail in enumerate(saving_type["details"]):
-                    print("{}) Instance ID: ".format(index+1)+detail["InstanceId"]+" of type "+detail["InstanceType"])
-
-                print()
-            elif saving_type["recommended_type"] == "RESERVATIONS":
-                print("RESERVE the following instances to save "+saving_type["total_savings"]+" USD")
-                for index,detail in enumerate(saving_type["details"]):
-                    print(
-                        "{}) ".format(index+1)+
-                         detail["RecommendedNumberOfInstancesToPurchase"]+
-                         " "+
-                         detail["InstanceType"]+
-                         " for a period of "+
-                         detail["Term"]+
-                         " years for the upfront cost of "+
-                         detail["UpfrontCost"]
-                         )
-                print()
-        print()
\ No newline at end of file
+"""
+Prints the recommendation response as a report, streaming it so that
+responses of any size are reported in constant memory
+"""
+import argparse
+import sys
+
+from recommendation_report import REPORT_FORMATS, RULE_TYPES, write_report
+
+# Response written by recommendation_engine.py
+DEFAULT_RESPONSE_FILE = "./recommendation_response.json"
+
+# Size of the write buffer in front of the report file
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+def main(argv=None):
+    """
+    Parses the command line arguments and writes the report of a
+    recommendation response
+    Parameters :
+    argv - command line arguments, sys.argv[1:] when None
+    """
+    # Initializing the parser
+    parser = argparse.ArgumentParser()
+
+    # Adding parameters
+    parser.add_argument("--input", default=DEFAULT_RESPONSE_FILE, help="Recommendation response to report")
+    parser.add_argument("--format", choices=REPORT_FORMATS, default="text", help="Format of the report")
+    parser.add_argument("--output", help="Write the report to this file instead of the standard output")
+    parser.add_argument("--regions", help="Comma separated regions to report, all of them by default")
+    parser.add_argument(
+        "--rule-types",
+        help="Comma separated rule types to report out of " + ", ".join(RULE_TYPES) + ", all of them by default"
+    )
+    parser.add_argument("--top", type=int, help="Only report the recommendations with the highest savings")
+
+    # Parse the arguments
+    args = parser.parse_args(argv)
+    rule_type_filter = args.rule_types.upper().split(",") if args.rule_types else None
+    if rule_type_filter and set(rule_type_filter).difference(RULE_TYPES):
+        parser.error("unknown rule types: " + ", ".join(sorted(set(rule_type_filter).difference(RULE_TYPES))))
+
+    output = open(args.output, "w", buffering=WRITE_BUFFER_SIZE, newline="") if args.output else sys.stdout
+    try:
+        with open(args.input, encoding="utf-8") as response_file:
+            write_report(
+                response_file,
+                output,
+                report_format=args.format,
+                regions=args.regions.split(",") if args.regions else None,
+                rule_types=rule_type_filter,
+                top=args.top
+            )
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+"""
+Adaptive client side rate limiting of the AWS calls shared by every client
+of a run. Every (account, region, service) gets a token bucket that each
+attempt takes a token from before it is sent, refilled at a rate that
+follows the API quota: every throttled attempt cuts the rate by a constant
+factor and every successful one raises it a little, so that the collectors
+settle just under the quota instead of bursting into it and spending their
+time in retry backoff. Throttled attempts are still retried by botocore
+"""
+import threading
+import time
+
+from instrumentation import THROTTLING_ERROR_CODES, error_code
+
+# Calls per second and burst every bucket starts with, by boto3 service name.
+# EC2 documents a bucket of 100 describe calls refilled at 20 per second, the
+# other services do not document theirs
+DEFAULT_RATES = {
+    "ec2": (20.0, 100.0),
+    "elb": (10.0, 20.0),
+    "elbv2": (10.0, 20.0),
+    "autoscaling": (10.0, 20.0),
+    "sts": (20.0, 20.0)
+}
+
+# Calls per second and burst of the services missing from DEFAULT_RATES
+DEFAULT_RATE = (10.0, 20.0)
+
+# Factor the rate of a bucket is multiplied with when an attempt is throttled
+BACKOFF_FACTOR = 0.7
+
+# Calls per second the rate of a bucket grows by per second of successful calls
+RATE_INCREASE = 2.0
+
+# Lowest rate a bucket slows down to, in calls per second
+MIN_RATE = 0.5
+
+# Highest rate a bucket speeds up to, as a multiple of its initial rate
+MAX_RATE_FACTOR = 4.0
+
+class TokenBucket(object):
+    """
+    Token bucket whose refill rate is lowered by throttled attempts and
+    raised by successful ones. Callers reserve a token and sleep until it is
+    refilled, so concurrent callers are spaced 1 / rate apart once the burst
+    is spent
+    Parameters :
+    rate - initial calls per second
+    burst - tokens the bucket holds when full
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.max_rate = rate * MAX_RATE_FACTOR
+        self.tokens = burst
+        self.lock = threading.Lock()
+        self.refilled_at = time.monotonic()
+        self.decreased_at = 0.0
+        self.throttles = 0
+        self.waited_seconds = 0.0
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.refilled_at) * self.rate)
+        self.refilled_at = now
+
+    def acquire(self):
+        """
+        Blocks until the caller is allowed to send its attempt
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.refill(now)
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            self.waited_seconds += wait
+        if wait:
+            time.sleep(wait)
+
+    def throttled(self):
+        """
+        Lowers the rate after a throttled attempt. The attempts already in
+        flight when the rate was lowered were sent at the old rate, so their
+        throttles within the next 1 / rate seconds lower it only once
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.throttles += 1
+            if now - self.decreased_at < 1.0 / self.rate:
+                return
+            self.refill(now)
+            self.rate = max(MIN_RATE, self.rate * BACKOFF_FACTOR)
+            # The burst is what got throttled, the next attempts wait for the lower rate
+            self.tokens = min(self.tokens, 0.0)
+            self.decreased_at = now
+
+    def succeeded(self):
+        """
+        Raises the rate after a successful attempt, by RATE_INCREASE per
+        second of attempts at the current rate
+        """
+        with self.lock:
+            self.refill(time.monotonic())
+            self.rate = min(self.max_rate, self.rate + RATE_INCREASE / self.rate)
+
+class AdaptiveRateLimiter(object):
+    """
+    Token buckets of the attempts of the instrumented boto3 clients, keyed
+    by (account, region, service) so that every client and thread calling
+    the same API quota shares a bucket
+    Parameters :
+    rates - (calls per second, burst) by service, DEFAULT_RATES when None
+    """
+
+    def __init__(self, rates=None):
+        self.rates = DEFAULT_RATES if rates is None else rates
+        self.lock = threading.Lock()
+        self.buckets = {}
+
+    def bucket(self, account_id, region, service):
+        """
+        Returns the token bucket of an account, region and service
+        """
+        key = (account_id, region, service)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            with self.lock:
+                bucket = self.buckets.get(key)
+                if bucket is None:
+                    rate, burst = self.rates.get(service, DEFAULT_RATE)
+                    bucket = self.buckets[key] = TokenBucket(rate, burst)
+        return bucket
+
+    def instrument(self, client, account_label):
+        """
+        Registers the handlers making every attempt of a boto3 client take a
+        token from its bucket and adapting the bucket to the responses. Calls
+        served by the ResponseCache never reach the send event
+        Parameters :
+        client - boto3 client to rate limit
+        account_label - function returning the account id of the client, or
+                        None while it is not resolved yet
+        """
+        region = client.meta.region_name or ""
+        service = client.meta.service_model.service_name
+
+        def before_send(**kwargs):
+            self.bucket(account_label() or "", region, service).acquire()
+
+        def needs_retry(response, **kwargs):
+            # Called after every attempt, successful or not
+            if response is None:
+                return None
+            bucket = self.bucket(account_label() or "", region, service)
+            if error_code(response[1]) in THROTTLING_ERROR_CODES:
+                bucket.throttled()
+            elif response[0] is not None and response[0].status_code < 300:
+                bucket.succeeded()
+            return None
+
+        events = client.meta.events
+        events.register_first("before-send.*.*", before_send)
+        events.register("needs-retry.*.*", needs_retry)
+
+    def print_summary(self):
+        """
+        Prints the throttled attempts, time spent waiting and current rate of
+        every bucket that was throttled or made callers wait
+        """
+        with self.lock:
+            buckets = sorted(self.buckets.items())
+        for (account_id, region, service), bucket in buckets:
+            if not bucket.throttles and not bucket.waited_seconds:
+                continue
+            print("Rate limit {} {} {}: {} throttled, waited {:.2f}s, {:.1f} calls/s".format(
+                account_id or "-",
+                region or "-",
+                service,
+                bucket.throttles,
+                bucket.waited_seconds,
+                bucket.rate
+            ))
@@ -0,0 +1,525 @@
+"""
+This script reads the collected inventory and produces recommendation_document.json
+and recommendation_response.json in ./recommendations. The spot and reservation rules are evaluated as
+batched pandas operations over a flat table of instances rather than per instance
+"""
+import argparse
+import datetime
+import json
+import os
+
+from columnar_export import find_inventory_file, flatten_instances
+from inventory_stream import iter_inventory_records
+from price_table import PriceTable
+from reservation_matcher import match_instances
+
+# Spot rules in the order their results are reported
+SPOT_RULES = ("autoscaling_groups_spot", "load_balancers_spot", "emr_spot")
+
+# Reservation term recommended, in years
+RESERVATION_TERM = "1"
+
+# Directory the recommendation documents are written to, apart from the sample documents in the repository
+DEFAULT_OUTPUT_DIR = "./recommendations"
+
+# Instance columns the rules need
+INSTANCE_COLUMNS = [
+    "account_id",
+    "region",
+    "instance_id",
+    "instance_type",
+    "state",
+    "spot",
+    "tenancy",
+    "platform",
+    "availability_zone",
+    "autoscaling_group",
+    "emr_cluster_id",
+    "has_load_balancer"
+]
+
+# Price columns, all monthly USD per instance except the upfront cost
+PRICE_COLUMNS = ["on_demand_price", "spot_price", "reserved_upfront_cost", "reserved_monthly_price"]
+
+def load_instances(inventory_dir, parquet_dir=None):
+    """
+    Returns a DataFrame with the INSTANCE_COLUMNS of every collected instance,
+    read from instances.parquet when columnar_export.py wrote one and from the
+    inventory files otherwise
+    Parameters :
+    inventory_dir - directory holding the inventory files
+    parquet_dir - directory holding the Parquet files, or None
+    """
+    import pandas
+
+    parquet_path = os.path.join(parquet_dir, "instances.parquet") if parquet_dir else None
+    if parquet_path and os.path.exists(parquet_path):
+        import pyarrow.compute
+        import pyarrow.parquet
+
+        table = pyarrow.parquet.read_table(
+            parquet_path,
+            columns=INSTANCE_COLUMNS[:-1] + ["load_balancer_names"]
+        )
+        has_load_balancer = pyarrow.compute.fill_null(
+            pyarrow.compute.greater(pyarrow.compute.list_value_length(table["load_balancer_names"]), 0),
+            False
+        )
+        table = table.drop(["load_balancer_names"]).append_column("has_load_balancer", has_load_balancer)
+        return table.to_pandas()
+
+    path = find_inventory_file(inventory_dir, "instances")
+    if path is None:
+        return pandas.DataFrame(columns=INSTANCE_COLUMNS)
+    rows = (
+        [row[column] for column in INSTANCE_COLUMNS[:-1]] + [bool(row["load_balancer_names"])]
+        for row in flatten_instances(iter_inventory_records(path, "instances"))
+    )
+    return pandas.DataFrame.from_records(rows, columns=INSTANCE_COLUMNS)
+
+def load_reservations(inventory_dir):
+    """
+    Returns a DataFrame of the reserved instances with the attributes they
+    are matched to instances on, their state and instance count
+    Parameters :
+    inventory_dir - directory holding the inventory files
+    """
+    import pandas
+
+    columns = [
+        "account_id",
+        "region",
+        "availability_zone",
+        "scope",
+        "instance_type",
+        "product_description",
+        "instance_tenancy",
+        "state",
+        "instance_count"
+    ]
+    path = find_inventory_file(inventory_dir, "reservations")
+    if path is None:
+        return pandas.DataFrame(columns=columns)
+    return pandas.DataFrame.from_records(
+        (
+            (
+                reserved_instance.get("account_id"),
+                reserved_instance.get("region"),
+                reserved_instance.get("AvailabilityZone"),
+                reserved_instance.get("Scope"),
+                reserved_instance.get("InstanceType"),
+                reserved_instance.get("ProductDescription"),
+                reserved_instance.get("InstanceTenancy"),
+                reserved_instance.get("State"),
+                reserved_instance.get("InstanceCount", 0)
+            )
+            for reserved_instance in iter_inventory_records(path, "reservations")
+        ),
+        columns=columns
+    )
+
+def load_member_instance_ids(inventory_dir, name, field, key):
+    """
+    Returns the set of instance ids listed under the Instances of the records
+    of an inventory file, e.g. the instances of auto scaling groups
+    Parameters :
+    inventory_dir - directory holding the inventory files
+    name - inventory file name without extension
+    field - key the records are stored under in the json format
+    key - key of the instance list in every record
+    """
+    path = find_inventory_file(inventory_dir, name)
+    if path is None:
+        return set()
+    return {
+        instance["InstanceId"]
+        for record in iter_inventory_records(path, field)
+        for instance in record.get(key, [])
+    }
+
+def load_prices(path):
+    """
+    Returns a DataFrame of the PRICE_COLUMNS by region and instance type read
+    from a json list of {"region", "InstanceType", "OnDemandPrice", "SpotPrice",
+    "ReservedUpfrontCost", "ReservedMonthlyPrice"} objects
+    Parameters :
+    path - path of the price file, or None for no prices
+    """
+    import pandas
+
+    columns = ["region", "instance_type"] + PRICE_COLUMNS
+    if path is None:
+        return pandas.DataFrame(columns=columns)
+    with open(path) as price_file:
+        prices = json.load(price_file)
+    return pandas.DataFrame.from_records(
+        (
+            (
+                price["region"],
+                price["InstanceType"],
+                price.get("OnDemandPrice"),
+                price.get("SpotPrice"),
+                price.get("ReservedUpfrontCost"),
+                price.get("ReservedMonthlyPrice")
+            )
+            for price in prices
+        ),
+        columns=columns
+    ).astype({column: "float64" for column in PRICE_COLUMNS})
+
+def on_demand_candidates(instances):
+    """
+    Returns the running instances that are not spot instances yet
+    Parameters :
+    instances - DataFrame from load_instances
+    """
+    mask = (instances["state"] == "running") & ~instances["spot"].fillna(False).astype(bool)
+    return instances[mask]
+
+def merge_table_prices(prices, price_table):
+    """
+    Returns the prices with the on-demand and spot prices of the Linux
+    instances of the price table over those of the price file
+    Parameters :
+    prices - DataFrame from load_prices
+    price_table - PriceTable from price_table.py
+    """
+    merged = prices.merge(
+        price_table.price_frame("linux"),
+        on=["region", "instance_type"],
+        how="outer",
+        suffixes=("", "_table")
+    )
+    for column in ("on_demand_price", "spot_price"):
+        merged[column] = merged[column + "_table"].fillna(merged[column])
+    return merged[prices.columns].astype({column: "float64" for column in PRICE_COLUMNS})
+
+def evaluate_spot_rules(instances, prices, autoscaling_instance_ids=(), load_balancer_instance_ids=(),
+                        price_table=None):
+    """
+    Returns a DataFrame with a row per (rule, instance) the spot rules
+    recommend, along with the prices and monthly savings of the instance
+    Parameters :
+    instances - DataFrame from load_instances
+    prices - DataFrame from load_prices
+    autoscaling_instance_ids - instance ids listed by the auto scaling groups
+    load_balancer_instance_ids - instance ids listed by the v1 load balancers
+    price_table - PriceTable whose prices of the platform and zone of every
+                  instance are used over those of prices, or None
+    """
+    import numpy
+    import pandas
+
+    candidates = on_demand_candidates(instances)
+    instance_ids = candidates["instance_id"]
+    rule_masks = {
+        "autoscaling_groups_spot": candidates["autoscaling_group"].notna()
+        | instance_ids.isin(list(autoscaling_instance_ids)),
+        "load_balancers_spot": candidates["has_load_balancer"].fillna(False).astype(bool)
+        | instance_ids.isin(list(load_balancer_instance_ids)),
+        "emr_spot": candidates["emr_cluster_id"].notna()
+    }
+    columns = ["account_id", "region", "instance_id", "instance_type", "platform", "availability_zone"]
+    results = pandas.concat(
+        [
+            candidates.loc[rule_masks[rule_name], columns].assign(rule_name=rule_name)
+            for rule_name in SPOT_RULES
+        ],
+        ignore_index=True
+    )
+    results = results.merge(
+        prices[["region", "instance_type", "on_demand_price", "spot_price"]],
+        on=["region", "instance_type"],
+        how="left"
+    )
+    if price_table is not None:
+        # Looked up for all the rows at once, falling back to the price file
+        on_demand_price, spot_price = price_table.monthly_prices(
+            results["region"],
+            results["instance_type"],
+            results["platform"],
+            results["availability_zone"]
+        )
+        results["on_demand_price"] = numpy.where(
+            numpy.isnan(on_demand_price), results["on_demand_price"].astype("float64"), on_demand_price
+        )
+        results["spot_price"] = numpy.where(
+            numpy.isnan(spot_price), results["spot_price"].astype("float64"), spot_price
+        )
+    results = results.drop(columns=["platform", "availability_zone"])
+    results["savings"] = (results["on_demand_price"] - results["spot_price"]).fillna(0.0).clip(lower=0.0)
+    return results
+
+def evaluate_reservations(instances, reservations, prices):
+    """
+    Returns a DataFrame with a row per (account, region, instance type) whose
+    running on-demand instances are not covered by active reserved instances,
+    with the number of instances to reserve and the cost and savings of doing so.
+    Coverage follows reservation_matcher, including size-flexible reservations
+    Parameters :
+    instances - DataFrame from load_instances
+    reservations - DataFrame from load_reservations
+    prices - DataFrame from load_prices
+    """
+    import numpy
+
+    candidates = on_demand_candidates(instances)
+    active = reservations[reservations["state"] == "active"]
+
+    # Matching the instances against hash indexes of the reservations
+    covered = match_instances(
+        zip(*(candidates[column].tolist() for column in (
+            "account_id", "region", "availability_zone", "instance_type", "platform", "tenancy"
+        ))),
+        zip(*(active[column].tolist() for column in (
+            "account_id", "region", "availability_zone", "scope", "instance_type",
+            "product_description", "instance_tenancy", "instance_count"
+        )))
+    )
+    uncovered = candidates.loc[~numpy.array(covered, dtype=bool)]
+    coverage = (
+        uncovered.groupby(["account_id", "region", "instance_type"], observed=True)
+        .size()
+        .rename("uncovered")
+        .reset_index()
+    )
+    coverage = coverage[coverage["uncovered"] > 0]
+    coverage = coverage.astype({"account_id": str, "region": str, "instance_type": str})
+    coverage = coverage.merge(prices, on=["region", "instance_type"], how="left")
+    coverage["upfront_cost"] = (coverage["uncovered"] * coverage["reserved_upfront_cost"]).fillna(0.0)
+    coverage["savings"] = (
+        coverage["uncovered"] * (coverage["on_demand_price"] - coverage["reserved_monthly_price"])
+    ).fillna(0.0).clip(lower=0.0)
+    return coverage
+
+def format_amount(value):
+    """
+    Returns an amount as the strings used in the recommendation documents,
+    e.g. 40 or 12.5, and an empty string for unknown amounts
+    """
+    if value != value or value is None:
+        return ""
+    return ("%.2f" % value).rstrip("0").rstrip(".")
+
+def spot_details(results):
+    """
+    Returns the details of spot recommendations as listed in the documents
+    """
+    return [
+        {
+            "InstanceId": instance_id,
+            "InstanceType": instance_type,
+            "OnDemandPrice": format_amount(on_demand_price),
+            "SpotPrice": format_amount(spot_price)
+        }
+        for instance_id, instance_type, on_demand_price, spot_price in zip(
+            results["instance_id"],
+            results["instance_type"],
+            results["on_demand_price"],
+            results["spot_price"]
+        )
+    ]
+
+def reservation_details(results):
+    """
+    Returns the details of reservation recommendations as listed in the documents
+    """
+    return [
+        {
+            "InstanceType": instance_type,
+            "RecommendedNumberOfInstancesToPurchase": str(uncovered),
+            "Term": RESERVATION_TERM,
+            "UpfrontCost": format_amount(upfront_cost),
+            "EstimatedMonthlySavingsAmount": format_amount(savings)
+        }
+        for instance_type, uncovered, upfront_cost, savings in zip(
+            results["instance_type"],
+            results["uncovered"],
+            results["upfront_cost"],
+            results["savings"]
+        )
+    ]
+
+def iter_runs(keys):
+    """
+    Yields (key, start, stop) for every run of equal keys in a sorted list
+    Parameters :
+    keys - sorted list of keys
+    """
+    start = 0
+    for index in range(1, len(keys) + 1):
+        if index == len(keys) or keys[index] != keys[start]:
+            yield keys[start], start, index
+            start = index
+
+def sorted_by_region(results, extra_keys=()):
+    """
+    Returns the results sorted by account and region, keeping the order of the
+    rows within a region, along with the (account_id, region) key of every row
+    Parameters :
+    results - DataFrame with account_id and region columns
+    extra_keys - further columns to sort by within a region
+    """
+    results = results.sort_values(["account_id", "region"] + list(extra_keys), kind="stable")
+    keys = list(zip(results["account_id"].astype(str).tolist(), results["region"].astype(str).tolist()))
+    return results, keys
+
+def build_documents(spot_results, reservation_results, time_stamp=None):
+    """
+    Returns a dictionary of account_id to the (recommendation document,
+    recommendation response) pair of the account. The results are sorted once
+    and every region is a slice of them, so building is linear in the rows
+    Parameters :
+    spot_results - DataFrame from evaluate_spot_rules
+    reservation_results - DataFrame from evaluate_reservations
+    time_stamp - time stamp of the recommendations, now by default
+    """
+    import pandas
+
+    if time_stamp is None:
+        time_stamp = str(datetime.datetime.now())
+    regions = {}
+
+    spot_results = spot_results.assign(
+        rule_order=pandas.Categorical(spot_results["rule_name"], categories=SPOT_RULES).codes
+    )
+    spot_results, keys = sorted_by_region(spot_results, ["rule_order"])
+    details = spot_details(spot_results)
+    rule_names = spot_results["rule_name"].tolist()
+    savings = spot_results["savings"].tolist()
+    # An instance matched by several rules is only counted once in the totals
+    unique = (~spot_results.duplicated(["account_id", "region", "instance_id"])).tolist()
+    for key, start, stop in iter_runs(keys):
+        rule_results, savings_by_rule_type = regions.setdefault(key, ([], []))
+        for rule_name, rule_start, rule_stop in iter_runs(rule_names[start:stop]):
+            rule_results.append({
+                "recommended_type": "SPOT",
+                "rule_name": rule_name,
+                "time_stamp": time_stamp,
+                "savings": format_amount(sum(savings[start + rule_start:start + rule_stop])),
+                "details": details[start + rule_start:start + rule_stop]
+            })
+        rows = [index for index in range(start, stop) if unique[index]]
+        savings_by_rule_type.append({
+            "recommended_type": "SPOT",
+            "total_savings": format_amount(sum(savings[index] for index in rows)),
+            "details": [details[index] for index in rows]
+        })
+
+    reservation_results, keys = sorted_by_region(reservation_results)
+    details = reservation_details(reservation_results)
+    savings = reservation_results["savings"].tolist()
+    for key, start, stop in iter_runs(keys):
+        rule_results, savings_by_rule_type = regions.setdefault(key, ([], []))
+        total_savings = format_amount(sum(savings[start:stop]))
+        rule_results.append({
+            "recommended_type": "RESERVATIONS",
+            "time_stamp": time_stamp,
+            "savings": total_savings,
+            "details": details[start:stop]
+        })
+        savings_by_rule_type.append({
+            "recommended_type": "RESERVATIONS",
+            "total_savings": total_savings,
+            "details": details[start:stop]
+        })
+
+    documents = {}
+    for (account_id, region), (rule_results, savings_by_rule_type) in sorted(regions.items()):
+        document, response = documents.setdefault(account_id, (
+            {"time_stamp": time_stamp, "account_id": account_id, "savings_by_region": []},
+            {"time_stamp": time_stamp, "account_id": account_id, "savings_by_region": []}
+        ))
+        document["savings_by_region"].append({
+            "account_id": account_id,
+            "region": region,
+            "rule_results": rule_results,
+            "savings_by_rule_type": savings_by_rule_type
+        })
+        response["savings_by_region"].append({
+            "account_id": account_id,
+            "region": region,
+            "savings_by_rule_type": savings_by_rule_type
+        })
+    return documents
+
+def write_documents(documents, output_dir):
+    """
+    Writes recommendation_document.json and recommendation_response.json into
+    output_dir, or into a directory per account when there are several accounts
+    Parameters :
+    documents - dictionary from build_documents
+    output_dir - directory the documents are written to
+    """
+    for account_id, (document, response) in documents.items():
+        directory = output_dir if len(documents) == 1 else os.path.join(output_dir, account_id)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(os.path.join(directory, "recommendation_document.json"), "w") as document_file:
+            json.dump(document, document_file, indent=4)
+        with open(os.path.join(directory, "recommendation_response.json"), "w") as response_file:
+            json.dump(response, response_file, indent=4)
+
+def generate_recommendations(inventory_dir, output_dir, prices_path=None, parquet_dir=None, price_dir=None):
+    """
+    Evaluates every rule over the inventory and writes the documents
+    Returns the dictionary from build_documents
+    Parameters :
+    inventory_dir - directory holding the inventory files
+    output_dir - directory the documents are written to
+    prices_path - price file for load_prices, or None
+    parquet_dir - directory holding the Parquet files, or None
+    price_dir - directory of the price table written by price_table.py, or None
+    """
+    instances = load_instances(inventory_dir, parquet_dir)
+    prices = load_prices(prices_path)
+    price_table = None
+    if price_dir is not None:
+        price_table = PriceTable(price_dir)
+        prices = merge_table_prices(prices, price_table)
+    spot_results = evaluate_spot_rules(
+        instances,
+        prices,
+        load_member_instance_ids(inventory_dir, "autoscaling_groups", "autoscaling_groups", "Instances"),
+        load_member_instance_ids(inventory_dir, "load_balancers", "load_balancers", "Instances"),
+        price_table
+    )
+    reservation_results = evaluate_reservations(instances, load_reservations(inventory_dir), prices)
+    documents = build_documents(spot_results, reservation_results)
+    write_documents(documents, output_dir)
+    return documents
+
+def main(argv=None):
+    """
+    Parses the command line arguments and writes the recommendation documents
+    of every account
+    Parameters :
+    argv - command line arguments, sys.argv[1:] when None
+    """
+    # Initializing the parser
+    parser = argparse.ArgumentParser()
+
+    # Adding parameters
+    parser.add_argument("--inventory-dir", default="./inventory", help="Directory of the inventory files")
+    parser.add_argument("--parquet-dir", help="Directory of the Parquet files written by columnar_export.py")
+    parser.add_argument("--prices", help="Price file with monthly prices by region and instance type")
+    parser.add_argument(
+        "--price-dir",
+        help="Directory of the price table written by price_table.py, used over the price file"
+    )
+    parser.add_argument(
+        "--output-dir",
+        default=DEFAULT_OUTPUT_DIR,
+        help="Directory the recommendation documents are written to"
+    )
+
+    # Parse the arguments
+    args = parser.parse_args(argv)
+
+    documents = generate_recommendations(
+        args.inventory_dir, args.output_dir, args.prices, args.parquet_dir, args.price_dir
+    )
+    print("Recommendations written for {} account(s)".format(len(documents)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,455 @@
+"""
+Streaming reports of the recommendation responses. The response is scanned
+incrementally a chunk at a time and only one detail is decoded at once, so
+memory stays bounded by the chunk size and the top-N selection whatever the
+size of the response. Rows can be filtered by region and rule type, cut down
+to the top N by savings and written as the text report of
+print_recommendation.py, CSV, Markdown or JSON
+"""
+import csv
+import heapq
+import json
+import re
+
+# Characters of the response read at a time
+CHUNK_SIZE = 1024 * 1024
+
+# Formats the reports can be written in
+REPORT_FORMATS = ("text", "csv", "markdown", "json")
+
+# Rule types of the recommendations
+RULE_TYPES = ("SPOT", "RESERVATIONS")
+
+# Columns of the csv, markdown and json reports: the row fields followed by the detail fields
+REPORT_COLUMNS = (
+    "account_id",
+    "region",
+    "recommended_type",
+    "total_savings",
+    "savings",
+    "InstanceId",
+    "InstanceType",
+    "OnDemandPrice",
+    "SpotPrice",
+    "RecommendedNumberOfInstancesToPurchase",
+    "Term",
+    "UpfrontCost",
+    "EstimatedMonthlySavingsAmount"
+)
+
+# Separator printed before every region of the text report
+REGION_SEPARATOR = "---------------------------------------------------------------------"
+
+# Whitespace skipped between the tokens of the response
+WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+# Encoder of the rows of the json report, built once rather than by every json.dumps call
+ROW_ENCODER = json.JSONEncoder(separators=(",", ":"))
+
+def parse_amount(amount):
+    """
+    Returns an amount of the recommendation documents as a float, or None when it is unknown
+    """
+    try:
+        return float(amount)
+    except (TypeError, ValueError):
+        return None
+
+class JsonStreamScanner(object):
+    """
+    Walks a JSON document read from a text stream a chunk at a time. The
+    containers are entered with iter_object and iter_array, which yield once
+    per member and element with the scanner on its value, and every value is
+    either decoded with value or skipped with skip before the next one
+    Parameters :
+    stream - text stream of the JSON document
+    chunk_size - characters read at a time
+    """
+
+    def __init__(self, stream, chunk_size=CHUNK_SIZE):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.position = 0
+        self.eof = False
+
+    def fill(self):
+        """
+        Drops the characters already scanned and reads the next chunk
+        Returns False at the end of the stream
+        """
+        self.buffer = self.buffer[self.position:]
+        self.position = 0
+        chunk = self.stream.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer += chunk
+        return True
+
+    def peek(self):
+        """
+        Returns the next character that is not whitespace without consuming it
+        """
+        while True:
+            self.position = WHITESPACE.match(self.buffer, self.position).end()
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            if not self.fill():
+                raise ValueError("unexpected end of the JSON document")
+
+    def at_end(self):
+        """
+        Returns whether nothing but whitespace is left in the stream
+        """
+        while True:
+            self.position = WHITESPACE.match(self.buffer, self.position).end()
+            if self.position < len(self.buffer):
+                return False
+            if not self.fill():
+                return True
+
+    def expect(self, character):
+        found = self.peek()
+        if found != character:
+            raise ValueError("expected {!r} but found {!r} in the JSON document".format(character, found))
+        self.position += 1
+
+    def value(self):
+        """
+        Returns the next value decoded. A value is only taken once a
+        character follows it, so a number cut at the end of a chunk is never
+        decoded short
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.position)
+                if end < len(self.buffer) or self.eof:
+                    self.position = end
+                    return value
+            except ValueError:
+                if self.eof:
+                    raise
+            self.fill()
+
+    def skip(self):
+        """
+        Skips the next value, walking the containers rather than decoding them
+        """
+        character = self.peek()
+        if character == "{":
+            for _ in self.iter_object():
+                self.skip()
+        elif character == "[":
+            for _ in self.iter_array():
+                self.skip()
+        else:
+            self.value()
+
+    def iter_array(self):
+        """
+        Yields once per element of the next array
+        """
+        self.expect("[")
+        if self.peek() == "]":
+            self.position += 1
+            return
+        while True:
+            yield
+            separator = self.peek()
+            self.position += 1
+            if separator == "]":
+                return
+            if separator != ",":
+                raise ValueError("expected ',' or ']' but found {!r} in the JSON document".format(separator))
+
+    def iter_object(self):
+        """
+        Yields the key of every member of the next object
+        """
+        self.expect("{")
+        if self.peek() == "}":
+            self.position += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(":")
+            yield key
+            separator = self.peek()
+            self.position += 1
+            if separator == "}":
+                return
+            if separator != ",":
+                raise ValueError("expected ',' or '}}' but found {!r} in the JSON document".format(separator))
+
+class ReportRow(object):
+    """
+    Detail of a recommendation with the account, region and rule type it belongs to
+    """
+
+    __slots__ = ("sequence", "account_id", "region", "recommended_type", "total_savings", "detail")
+
+    def __init__(self, sequence, account_id, region, recommended_type, total_savings, detail):
+        self.sequence = sequence
+        self.account_id = account_id
+        self.region = region
+        self.recommended_type = recommended_type
+        self.total_savings = total_savings
+        self.detail = detail
+
+    @property
+    def savings(self):
+        """
+        Monthly savings of the detail, or None when its amounts are unknown
+        """
+        if self.recommended_type == "SPOT":
+            on_demand_price = parse_amount(self.detail.get("OnDemandPrice"))
+            spot_price = parse_amount(self.detail.get("SpotPrice"))
+            if on_demand_price is None or spot_price is None:
+                return None
+            return on_demand_price - spot_price
+        return parse_amount(self.detail.get("EstimatedMonthlySavingsAmount"))
+
+    def to_json(self):
+        row = {
+            "account_id": self.account_id,
+            "region": self.region,
+            "recommended_type": self.recommended_type,
+            "total_savings": self.total_savings,
+            "savings": self.savings
+        }
+        for column in REPORT_COLUMNS[len(row):]:
+            if column in self.detail:
+                row[column] = self.detail[column]
+        return row
+
+def iter_report_rows(stream, chunk_size=CHUNK_SIZE):
+    """
+    Yields a ReportRow for every detail of every rule type of every region of
+    a recommendation response or document, in the order of the document.
+    Details are buffered only while the keys of the rule type or region they
+    belong to come after them, which the documents written by
+    recommendation_engine.py never do
+    Parameters :
+    stream - text stream of the recommendation response
+    chunk_size - characters read at a time
+    """
+    scanner = JsonStreamScanner(stream, chunk_size)
+    account_id = None
+    sequence = 0
+    for key in scanner.iter_object():
+        if key == "account_id":
+            account_id = scanner.value()
+            continue
+        if key != "savings_by_region":
+            scanner.skip()
+            continue
+        for _ in scanner.iter_array():
+            region_fields = {"account_id": None, "region": None}
+            pending = []
+            for region_key in scanner.iter_object():
+                if region_key in region_fields:
+                    region_fields[region_key] = scanner.value()
+                    continue
+                if region_key != "savings_by_rule_type":
+                    scanner.skip()
+                    continue
+                for _ in scanner.iter_array():
+                    rule_fields = {"recommended_type": None, "total_savings": None}
+                    details = []
+                    for rule_key in scanner.iter_object():
+                        if rule_key in rule_fields:
+                            rule_fields[rule_key] = scanner.value()
+                        elif rule_key != "details":
+                            scanner.skip()
+                        elif rule_fields["recommended_type"] is None or region_fields["region"] is None:
+                            details.extend(scanner.value() for _ in scanner.iter_array())
+                        else:
+                            for _ in scanner.iter_array():
+                                for row in pending:
+                                    row.account_id = region_fields["account_id"] or account_id
+                                    row.region = region_fields["region"]
+                                    yield row
+                                pending = []
+                                sequence += 1
+                                yield ReportRow(
+                                    sequence,
+                                    region_fields["account_id"] or account_id,
+                                    region_fields["region"],
+                                    rule_fields["recommended_type"],
+                                    rule_fields["total_savings"],
+                                    scanner.value()
+                                )
+                    for detail in details:
+                        sequence += 1
+                        pending.append(ReportRow(
+                            sequence, None, None, rule_fields["recommended_type"], rule_fields["total_savings"], detail
+                        ))
+            for row in pending:
+                row.account_id = region_fields["account_id"] or account_id
+                row.region = region_fields["region"]
+                yield row
+
+def select_rows(rows, regions=None, rule_types=None, top=None):
+    """
+    Returns the rows of the regions and rule types asked for, all of them
+    lazily in document order, or the top ones by savings in descending order
+    keeping only top rows in memory
+    Parameters :
+    rows - iterable of ReportRows
+    regions - regions to keep, or None for all of them
+    rule_types - rule types to keep out of RULE_TYPES, or None for all of them
+    top - number of rows with the highest savings to keep, or None for all of them
+    """
+    if regions is not None:
+        regions = frozenset(regions)
+    if rule_types is not None:
+        rule_types = frozenset(rule_types)
+    selected = (
+        row for row in rows
+        if (regions is None or row.region in regions) and (rule_types is None or row.recommended_type in rule_types)
+    )
+    if top is None:
+        return selected
+    heap = []
+    for row in selected:
+        savings = row.savings
+        # Rows with unknown savings rank below every known one, earlier rows above later ones
+        key = (savings is not None, savings or 0.0, -row.sequence)
+        if len(heap) < top:
+            heapq.heappush(heap, (key, row))
+        elif key > heap[0][0]:
+            heapq.heapreplace(heap, (key, row))
+    return [row for _, row in sorted(heap, key=lambda item: item[0], reverse=True)]
+
+def write_text_report(rows, output):
+    """
+    Writes the rows as the text report of print_recommendation.py, grouped
+    under a header for every account, region and rule type they change to
+    Returns the number of rows written
+    """
+    count = 0
+    account_id = region = group = None
+    index = 0
+    lines = []
+    for row in rows:
+        if row.recommended_type not in RULE_TYPES:
+            continue
+        if row.account_id != account_id:
+            if group is not None:
+                lines.append("\n\n")
+            lines.append("\nFOR THE AWS ACCOUNT ID {}\n".format(row.account_id))
+            account_id = row.account_id
+            region = group = None
+        if row.region != region:
+            if group is not None:
+                lines.append("\n\n")
+            lines.append("{}\nIN THE REGION {}\n\n".format(REGION_SEPARATOR, row.region))
+            region = row.region
+            group = None
+        if (row.recommended_type, row.total_savings) != group:
+            if group is not None:
+                lines.append("\n")
+            if row.recommended_type == "SPOT":
+                lines.append("Convert the following instances to SPOT to save {} USD \n".format(row.total_savings))
+            else:
+                lines.append("RESERVE the following instances to save {} USD\n".format(row.total_savings))
+            group = (row.recommended_type, row.total_savings)
+            index = 0
+        index += 1
+        detail = row.detail
+        if row.recommended_type == "SPOT":
+            lines.append("{}) Instance ID: {} of type {}\n".format(index, detail["InstanceId"], detail["InstanceType"]))
+        else:
+            lines.append("{}) {} {} for a period of {} years for the upfront cost of {}\n".format(
+                index,
+                detail["RecommendedNumberOfInstancesToPurchase"],
+                detail["InstanceType"],
+                detail["Term"],
+                detail["UpfrontCost"]
+            ))
+        count += 1
+        if len(lines) >= 1000:
+            output.write("".join(lines))
+            lines = []
+    if group is not None:
+        lines.append("\n\n")
+    output.write("".join(lines))
+    return count
+
+def write_csv_report(rows, output):
+    """
+    Writes the rows as CSV with a header of the REPORT_COLUMNS
+    Returns the number of rows written
+    """
+    writer = csv.DictWriter(output, REPORT_COLUMNS, lineterminator="\n")
+    writer.writeheader()
+    count = 0
+    for row in rows:
+        writer.writerow(row.to_json())
+        count += 1
+    return count
+
+def markdown_cell(value):
+    if value is None:
+        return ""
+    return str(value).replace("|", "\\|")
+
+def write_markdown_report(rows, output):
+    """
+    Writes the rows as a Markdown table of the REPORT_COLUMNS
+    Returns the number of rows written
+    """
+    output.write("| " + " | ".join(REPORT_COLUMNS) + " |\n")
+    output.write("|" + "---|" * len(REPORT_COLUMNS) + "\n")
+    count = 0
+    for row in rows:
+        values = row.to_json()
+        output.write("| " + " | ".join(markdown_cell(values.get(column)) for column in REPORT_COLUMNS) + " |\n")
+        count += 1
+    return count
+
+def write_json_report(rows, output):
+    """
+    Writes the rows as a JSON array with one row object per line
+    Returns the number of rows written
+    """
+    output.write("[")
+    count = 0
+    for row in rows:
+        output.write(",\n" if count else "\n")
+        output.write(ROW_ENCODER.encode(row.to_json()))
+        count += 1
+    output.write("\n]\n" if count else "]\n")
+    return count
+
+# Writers of every report format
+REPORT_WRITERS = {
+    "text": write_text_report,
+    "csv": write_csv_report,
+    "markdown": write_markdown_report,
+    "json": write_json_report
+}
+
+def write_report(stream, output, report_format="text", regions=None, rule_types=None, top=None,
+                 chunk_size=CHUNK_SIZE):
+    """
+    Streams a recommendation response into a report. The text report keeps
+    the top rows in document order so they stay grouped by region, the
+    other formats list them by descending savings
+    Returns the number of rows written
+    Parameters :
+    stream - text stream of the recommendation response
+    output - text stream the report is written to
+    report_format - one of REPORT_FORMATS
+    regions - regions to report, or None for all of them
+    rule_types - rule types to report out of RULE_TYPES, or None for all of them
+    top - number of rows with the highest savings to report, or None for all of them
+    chunk_size - characters of the response read at a time
+    """
+    rows = select_rows(iter_report_rows(stream, chunk_size), regions, rule_types, top)
+    if top is not None and report_format == "text":
+        rows = sorted(rows, key=lambda row: row.sequence)
+    return REPORT_WRITERS[report_format](rows, output)
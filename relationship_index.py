@@ -0,0 +1,402 @@
+"""
+Bidirectional index of the relationships between the instances, classic load
+balancers, v2 load balancers, target groups and auto scaling groups of a
+region. Classic load balancer memberships, the target groups of the v2 load
+balancers and the Instances, LoadBalancerNames and TargetGroupARNs of the auto
+scaling groups are merged into one graph that answers lookups in both
+directions. The index can be saved between runs, and a refresh only looks up
+the target health of the target groups that changed since the previous run
+"""
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from inventory_stream import call_with_retries, iter_records
+from run_checkpoint import replace_atomically
+
+# Kinds of the nodes of the graph
+INSTANCE = "instance"
+LOAD_BALANCER = "load_balancer"
+TARGET_GROUP = "target_group"
+AUTOSCALING_GROUP = "autoscaling_group"
+
+# Number of describe_target_health calls in flight at the same time
+DEFAULT_MAX_WORKERS = 8
+
+# Seconds after which the targets of an unchanged target group are looked up
+# again, so registrations made outside auto scaling are eventually seen
+DEFAULT_MAX_AGE = 6 * 3600
+
+# Fields of a target group whose change invalidates its cached targets
+TARGET_GROUP_FIELDS = ("LoadBalancerArns", "Port", "Protocol", "TargetType", "VpcId")
+
+def target_group_digest(target_group):
+    """
+    Returns a digest of the fields of a target group its targets depend on
+    """
+    encoded = json.dumps(
+        [target_group.get(field) for field in TARGET_GROUP_FIELDS],
+        sort_keys=True,
+        separators=(",", ":"),
+        default=str
+    )
+    return hashlib.sha1(encoded.encode("utf-8")).hexdigest()
+
+def list_target_groups(elbv2_client):
+    """
+    Returns every target group of the region, listed page by page
+    Parameters :
+    elbv2_client - boto3 elbv2 client of the region
+    """
+    return list(iter_records(elbv2_client, "describe_target_groups", "TargetGroups"))
+
+class RelationshipIndex(object):
+    """
+    Graph of the resources of a region. Every edge is kept in both directions
+    in edges, a dictionary of (kind, id) node to the set of its neighbours.
+    Target groups additionally keep the health state of their targets and the
+    digest and time of their last lookup, which make refreshes incremental
+    """
+
+    def __init__(self):
+        self.edges = {}
+        self.target_states = {}
+        self.target_group_digests = {}
+        self.target_group_checked = {}
+        self.autoscaling_instances = {}
+        self.target_health_calls = 0
+
+    def link(self, node, other):
+        self.edges.setdefault(node, set()).add(other)
+        self.edges.setdefault(other, set()).add(node)
+
+    def unlink(self, node, kind):
+        """
+        Removes the edges between node and its neighbours of a kind
+        """
+        neighbours = self.edges.get(node)
+        if not neighbours:
+            return
+        for other in [other for other in neighbours if other[0] == kind]:
+            neighbours.discard(other)
+            reverse = self.edges.get(other)
+            if reverse is not None:
+                reverse.discard(node)
+                if not reverse:
+                    del self.edges[other]
+        if not neighbours:
+            del self.edges[node]
+
+    def remove(self, node):
+        """
+        Removes a node and every edge it is part of
+        """
+        for other in self.edges.pop(node, ()):
+            reverse = self.edges.get(other)
+            if reverse is not None:
+                reverse.discard(node)
+                if not reverse:
+                    del self.edges[other]
+
+    def neighbours(self, node, kind):
+        """
+        Returns the sorted ids of the neighbours of a kind of node
+        """
+        return sorted(other[1] for other in self.edges.get(node, ()) if other[0] == kind)
+
+    def nodes(self, kind):
+        return [node[1] for node in self.edges if node[0] == kind]
+
+    def replace_edges(self, kind, other_kind, adjacency):
+        """
+        Replaces every edge between nodes of kind and of other_kind with the
+        ones of adjacency, a dictionary of id of kind to ids of other_kind
+        """
+        for node_id in self.nodes(kind):
+            self.unlink((kind, node_id), other_kind)
+        for node_id, other_ids in adjacency.items():
+            for other_id in other_ids:
+                self.link((kind, node_id), (other_kind, other_id))
+
+    def update_load_balancers(self, load_balancers):
+        """
+        Replaces the classic load balancer memberships
+        Parameters :
+        load_balancers - LoadBalancerDescriptions of the classic load balancers
+        """
+        self.replace_edges(LOAD_BALANCER, INSTANCE, {
+            load_balancer["LoadBalancerName"]: [instance["InstanceId"] for instance in load_balancer["Instances"]]
+            for load_balancer in load_balancers
+        })
+
+    def update_autoscaling_groups(self, autoscaling_groups):
+        """
+        Replaces the instances, classic load balancers and target groups of
+        the auto scaling groups
+        Returns the ARNs of the target groups attached, before or after the
+        update, to a group whose instances changed or that was deleted
+        Parameters :
+        autoscaling_groups - AutoScalingGroups from describe_auto_scaling_groups
+        """
+        instances = {}
+        load_balancers = {}
+        target_groups = {}
+        for autoscaling_group in autoscaling_groups:
+            name = autoscaling_group["AutoScalingGroupName"]
+            instances[name] = sorted(instance["InstanceId"] for instance in autoscaling_group.get("Instances", ()))
+            load_balancers[name] = autoscaling_group.get("LoadBalancerNames", ())
+            target_groups[name] = autoscaling_group.get("TargetGroupARNs", ())
+
+        changed = set(name for name in instances if self.autoscaling_instances.get(name) != instances[name])
+        changed.update(name for name in self.autoscaling_instances if name not in instances)
+        # The target groups of a deleted group are only known until its node is removed
+        changed_target_groups = set()
+        for name in changed:
+            changed_target_groups.update(self.neighbours((AUTOSCALING_GROUP, name), TARGET_GROUP))
+            changed_target_groups.update(target_groups.get(name, ()))
+        for name in self.autoscaling_instances:
+            if name not in instances:
+                self.remove((AUTOSCALING_GROUP, name))
+        self.autoscaling_instances = instances
+
+        self.replace_edges(AUTOSCALING_GROUP, INSTANCE, instances)
+        self.replace_edges(AUTOSCALING_GROUP, LOAD_BALANCER, load_balancers)
+        self.replace_edges(AUTOSCALING_GROUP, TARGET_GROUP, target_groups)
+        return changed_target_groups
+
+    def changed_target_groups(self, target_groups, autoscaling_target_groups, max_age=DEFAULT_MAX_AGE, now=None):
+        """
+        Returns the ARNs of the target groups whose targets must be looked up:
+        new ones, ones whose definition changed, ones attached to an auto
+        scaling group whose instances changed and ones last looked up more
+        than max_age seconds ago
+        Parameters :
+        target_groups - TargetGroups from describe_target_groups
+        autoscaling_target_groups - ARNs returned by update_autoscaling_groups
+        max_age - seconds the targets of an unchanged target group are trusted
+        now - current time, defaults to time.time()
+        """
+        now = time.time() if now is None else now
+        changed = set(autoscaling_target_groups)
+        for target_group in target_groups:
+            arn = target_group["TargetGroupArn"]
+            if (arn not in self.target_states
+                    or self.target_group_digests.get(arn) != target_group_digest(target_group)
+                    or now - self.target_group_checked.get(arn, 0) > max_age):
+                changed.add(arn)
+        return changed.intersection(target_group["TargetGroupArn"] for target_group in target_groups)
+
+    def update_target_groups(self, target_groups, v2_load_balancers, target_healths, now=None):
+        """
+        Replaces the target groups of the v2 load balancers, drops the target
+        groups that no longer exist and replaces the targets of the looked up ones
+        Parameters :
+        target_groups - TargetGroups from describe_target_groups
+        v2_load_balancers - LoadBalancers of the v2 load balancers
+        target_healths - dictionary of target group ARN to its describe_target_health response
+        now - current time, defaults to time.time()
+        """
+        now = time.time() if now is None else now
+        names = {
+            load_balancer["LoadBalancerArn"]: load_balancer["LoadBalancerName"]
+            for load_balancer in v2_load_balancers
+        }
+        current = set(target_group["TargetGroupArn"] for target_group in target_groups)
+        for arn in list(self.target_states):
+            if arn not in current:
+                self.remove((TARGET_GROUP, arn))
+                del self.target_states[arn]
+                self.target_group_digests.pop(arn, None)
+                self.target_group_checked.pop(arn, None)
+
+        self.replace_edges(TARGET_GROUP, LOAD_BALANCER, {
+            target_group["TargetGroupArn"]: [
+                names[arn] for arn in target_group.get("LoadBalancerArns", ()) if arn in names
+            ]
+            for target_group in target_groups
+        })
+        for target_group in target_groups:
+            arn = target_group["TargetGroupArn"]
+            response = target_healths.get(arn)
+            if response is None:
+                continue
+            states = {
+                target_health["Target"]["Id"]: target_health["TargetHealth"]["State"]
+                for target_health in response["TargetHealthDescriptions"]
+            }
+            self.unlink((TARGET_GROUP, arn), INSTANCE)
+            for instance_id in states:
+                self.link((TARGET_GROUP, arn), (INSTANCE, instance_id))
+            self.target_states[arn] = states
+            self.target_group_digests[arn] = target_group_digest(target_group)
+            self.target_group_checked[arn] = now
+
+    def refresh(self, elbv2_client, load_balancers, v2_load_balancers, autoscaling_groups,
+                max_age=DEFAULT_MAX_AGE, max_workers=DEFAULT_MAX_WORKERS):
+        """
+        Updates the index from the listings of a run, looking up the target
+        health of the changed target groups only. The calls are paced by the
+        AdaptiveRateLimiter of the ClientPool the client comes from
+        Returns the number of describe_target_health calls made
+        Parameters :
+        elbv2_client - boto3 elbv2 client of the region
+        load_balancers - LoadBalancerDescriptions of the classic load balancers
+        v2_load_balancers - LoadBalancers of the v2 load balancers
+        autoscaling_groups - AutoScalingGroups from describe_auto_scaling_groups
+        max_age - seconds the targets of an unchanged target group are trusted
+        max_workers - number of describe_target_health calls in flight at the same time
+        """
+        self.update_load_balancers(load_balancers)
+        autoscaling_target_groups = self.update_autoscaling_groups(autoscaling_groups)
+
+        # Target groups not serving any v2 load balancer are never looked up,
+        # as they can not put an instance behind one
+        target_groups = [
+            target_group for target_group in (list_target_groups(elbv2_client) if v2_load_balancers else [])
+            if target_group.get("LoadBalancerArns")
+        ]
+        changed = sorted(self.changed_target_groups(target_groups, autoscaling_target_groups, max_age))
+
+        def describe_target_health(target_group_arn):
+            return call_with_retries(elbv2_client, "describe_target_health", TargetGroupArn=target_group_arn)
+
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            target_healths = dict(zip(changed, executor.map(describe_target_health, changed)))
+        self.update_target_groups(target_groups, v2_load_balancers, target_healths)
+        self.target_health_calls += len(changed)
+        return len(changed)
+
+    def instance_load_balancers(self, instance_id, healthy_only=False):
+        """
+        Returns the names of the classic and v2 load balancers an instance is
+        registered with, classic ones first
+        Parameters :
+        instance_id - id of the instance
+        healthy_only - only count v2 targets whose health state is healthy
+        """
+        node = (INSTANCE, instance_id)
+        names = self.neighbours(node, LOAD_BALANCER)
+        for arn in self.neighbours(node, TARGET_GROUP):
+            if healthy_only and self.target_states.get(arn, {}).get(instance_id) != "healthy":
+                continue
+            for name in self.neighbours((TARGET_GROUP, arn), LOAD_BALANCER):
+                if name not in names:
+                    names.append(name)
+        return names
+
+    def load_balancer_instances(self, load_balancer_name, healthy_only=False):
+        """
+        Returns the ids of the instances registered with a classic or v2 load balancer
+        """
+        node = (LOAD_BALANCER, load_balancer_name)
+        instance_ids = set(self.neighbours(node, INSTANCE))
+        for arn in self.neighbours(node, TARGET_GROUP):
+            for instance_id, state in self.target_states.get(arn, {}).items():
+                if not healthy_only or state == "healthy":
+                    instance_ids.add(instance_id)
+        return sorted(instance_ids)
+
+    def instance_target_groups(self, instance_id):
+        return self.neighbours((INSTANCE, instance_id), TARGET_GROUP)
+
+    def instance_autoscaling_groups(self, instance_id):
+        return self.neighbours((INSTANCE, instance_id), AUTOSCALING_GROUP)
+
+    def autoscaling_group_instances(self, autoscaling_group_name):
+        return self.neighbours((AUTOSCALING_GROUP, autoscaling_group_name), INSTANCE)
+
+    def autoscaling_group_load_balancers(self, autoscaling_group_name):
+        """
+        Returns the names of the classic load balancers attached to an auto
+        scaling group and of the v2 load balancers of its target groups
+        """
+        node = (AUTOSCALING_GROUP, autoscaling_group_name)
+        names = self.neighbours(node, LOAD_BALANCER)
+        for arn in self.neighbours(node, TARGET_GROUP):
+            for name in self.neighbours((TARGET_GROUP, arn), LOAD_BALANCER):
+                if name not in names:
+                    names.append(name)
+        return names
+
+    def load_balancer_autoscaling_groups(self, load_balancer_name):
+        """
+        Returns the names of the auto scaling groups attached to a classic
+        load balancer or to a target group of a v2 load balancer
+        """
+        node = (LOAD_BALANCER, load_balancer_name)
+        names = set(self.neighbours(node, AUTOSCALING_GROUP))
+        for arn in self.neighbours(node, TARGET_GROUP):
+            names.update(self.neighbours((TARGET_GROUP, arn), AUTOSCALING_GROUP))
+        return sorted(names)
+
+    def instance_to_load_balancers_map(self, healthy_only=False):
+        """
+        Returns a dictionary of instance_id to the names of the classic and v2
+        load balancers the instance is registered with, for annotate_reservations
+        """
+        instance_to_load_balancer_map = {}
+        for instance_id in self.nodes(INSTANCE):
+            names = self.instance_load_balancers(instance_id, healthy_only)
+            if names:
+                instance_to_load_balancer_map[instance_id] = names
+        return instance_to_load_balancer_map
+
+    def to_json(self):
+        """
+        Returns the state of the index as a JSON serializable dictionary
+        """
+        return {
+            "edges": sorted(
+                [node[0], node[1], other[0], other[1]]
+                for node, neighbours in self.edges.items()
+                for other in neighbours
+                if node < other
+            ),
+            "target_states": self.target_states,
+            "target_group_digests": self.target_group_digests,
+            "target_group_checked": self.target_group_checked,
+            "autoscaling_instances": self.autoscaling_instances
+        }
+
+    @classmethod
+    def from_json(cls, document):
+        index = cls()
+        for kind, node_id, other_kind, other_id in document["edges"]:
+            index.link((kind, node_id), (other_kind, other_id))
+        index.target_states = document["target_states"]
+        index.target_group_digests = document["target_group_digests"]
+        index.target_group_checked = document["target_group_checked"]
+        index.autoscaling_instances = document["autoscaling_instances"]
+        return index
+
+    @classmethod
+    def load(cls, path):
+        """
+        Returns the index saved at path, or an empty index when there is none
+        """
+        try:
+            with open(path) as index_file:
+                return cls.from_json(json.load(index_file))
+        except IOError:
+            return cls()
+
+    def save(self, path):
+        """
+        Writes the index to path, replacing the previous one atomically
+        """
+        directory = os.path.dirname(path) or "."
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        def write(temporary_path):
+            with open(temporary_path, "w") as index_file:
+                json.dump(self.to_json(), index_file, separators=(",", ":"))
+        replace_atomically(directory, path, write)
+
+def relationship_index_path(directory, account_id, region):
+    """
+    Returns the path the index of an account and region is saved to
+    """
+    return os.path.join(directory, "{}.{}.json".format(account_id, region))
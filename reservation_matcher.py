@@ -0,0 +1,149 @@
+"""
+Matches running on-demand instances against active reserved instances the way
+EC2 applies them: zonal reservations first, then regional reservations of the
+exact instance type and finally size-flexible regional reservations through
+their normalization factor. Every lookup is a hash index probe, so matching is
+linear in the number of instances
+"""
+
+# Normalization factor of every instance size for size-flexible reservations
+NORMALIZATION_FACTORS = {
+    "nano": 0.25,
+    "micro": 0.5,
+    "small": 1,
+    "medium": 2,
+    "large": 4,
+    "xlarge": 8,
+    "2xlarge": 16,
+    "3xlarge": 24,
+    "4xlarge": 32,
+    "6xlarge": 48,
+    "8xlarge": 64,
+    "9xlarge": 72,
+    "10xlarge": 80,
+    "12xlarge": 96,
+    "16xlarge": 128,
+    "18xlarge": 144,
+    "24xlarge": 192,
+    "32xlarge": 256,
+    "48xlarge": 384
+}
+
+# Scope of the reservations that apply to a single availability zone
+ZONAL_SCOPE = "Availability Zone"
+
+def normalize_platform(platform):
+    """
+    Returns the platform of an instance or reservation as linux, windows or the
+    lower cased product description for the other platforms
+    Parameters :
+    platform - Platform of an instance or ProductDescription of a reservation
+    """
+    if not platform:
+        return "linux"
+    platform = platform.lower()
+    if platform.startswith("windows"):
+        return "windows"
+    if platform.startswith("linux/unix") or platform == "linux":
+        return "linux"
+    return platform.replace(" (amazon vpc)", "")
+
+def normalize_tenancy(tenancy):
+    """
+    Returns the tenancy with None read as default
+    """
+    return tenancy or "default"
+
+def split_instance_type(instance_type):
+    """
+    Returns the (family, normalization factor) of an instance type, with a factor
+    of None for sizes such as metal that are not size-flexible
+    Parameters :
+    instance_type - instance type such as m5.xlarge
+    """
+    family, _, size = instance_type.partition(".")
+    return family, NORMALIZATION_FACTORS.get(size)
+
+def is_size_flexible(platform, tenancy, factor):
+    """
+    Returns whether a regional reservation applies to any size of its family,
+    which EC2 only does for Linux/UNIX reservations with default tenancy
+    """
+    return platform == "linux" and tenancy == "default" and factor is not None
+
+class ReservationMatcher(object):
+    """
+    Hash indexes over the remaining capacity of active reservations keyed on
+    (account, availability zone or region, instance type or family, platform, tenancy)
+    """
+
+    def __init__(self, reservations):
+        """
+        Builds the indexes
+        Parameters :
+        reservations - iterable of (account_id, region, availability_zone, scope,
+                       instance_type, product_description, instance_tenancy,
+                       instance_count) tuples of the active reservations
+        """
+        self.zonal = {}
+        self.regional = {}
+        self.flexible_units = {}
+        for (account_id, region, availability_zone, scope, instance_type,
+             product_description, instance_tenancy, instance_count) in reservations:
+            platform = normalize_platform(product_description)
+            tenancy = normalize_tenancy(instance_tenancy)
+            if scope == ZONAL_SCOPE:
+                key = (account_id, availability_zone, instance_type, platform, tenancy)
+                self.zonal[key] = self.zonal.get(key, 0) + instance_count
+                continue
+            family, factor = split_instance_type(instance_type)
+            if is_size_flexible(platform, tenancy, factor):
+                key = (account_id, region, family)
+                self.flexible_units[key] = self.flexible_units.get(key, 0) + instance_count * factor
+            else:
+                key = (account_id, region, instance_type, platform, tenancy)
+                self.regional[key] = self.regional.get(key, 0) + instance_count
+
+    def match(self, account_id, region, availability_zone, instance_type, platform, tenancy):
+        """
+        Returns whether a running on-demand instance is covered by a reservation,
+        using up the capacity of the reservation that covers it
+        Parameters :
+        account_id - AWS account id of the instance
+        region - AWS region of the instance
+        availability_zone - availability zone of the instance
+        instance_type - instance type of the instance
+        platform - Platform of the instance
+        tenancy - Placement Tenancy of the instance
+        """
+        platform = normalize_platform(platform)
+        tenancy = normalize_tenancy(tenancy)
+
+        key = (account_id, availability_zone, instance_type, platform, tenancy)
+        if self.zonal.get(key, 0) > 0:
+            self.zonal[key] -= 1
+            return True
+
+        key = (account_id, region, instance_type, platform, tenancy)
+        if self.regional.get(key, 0) > 0:
+            self.regional[key] -= 1
+            return True
+
+        family, factor = split_instance_type(instance_type)
+        if is_size_flexible(platform, tenancy, factor):
+            key = (account_id, region, family)
+            if self.flexible_units.get(key, 0) >= factor:
+                self.flexible_units[key] -= factor
+                return True
+        return False
+
+def match_instances(instances, reservations):
+    """
+    Returns a list with True for every instance covered by a reservation
+    Parameters :
+    instances - iterable of (account_id, region, availability_zone, instance_type,
+                platform, tenancy) tuples of running on-demand instances
+    reservations - iterable of tuples as taken by ReservationMatcher
+    """
+    matcher = ReservationMatcher(reservations)
+    return [matcher.match(*instance) for instance in instances]
@@ -0,0 +1,279 @@
+"""
+Registry of the collectors of the inventory of a region. Every collector
+declares the paginated call listing its records, the key they are written
+under and the collectors it requires, and the plan of a run is the closure
+of the resources it asks for, so a run only makes the calls its outputs
+need. The load_balancer_map collector writes no file of its own: it relates
+the instances to their load balancers and auto scaling groups, which needs
+the listings of all three and a describe_target_health crawl of the target
+groups, and annotates the instances with the load balancers they are behind
+"""
+import argparse
+
+from client_pool import REGION_SERVICES
+from collection_filters import call_filters, project_reservations
+from inventory_stream import annotate_reservations, iter_records
+from relationship_index import RelationshipIndex, relationship_index_path
+
+def relate_instances(clients, account_id, region, listed, relationship_dir=None, healthy_only=False):
+    """
+    Returns the map of instance_id to the names of the v1 and v2 load
+    balancers of the instances of a region, looking up the target health of
+    the target groups that changed since the index of the region was last saved
+    Parameters :
+    clients - dictionary of boto3 service name to client of the region
+    account_id - AWS account id of the region
+    region - AWS region of the records
+    listed - dictionary of the records of the collectors load_balancer_map requires
+    relationship_dir - directory the RelationshipIndex of the region is kept in between runs, or None
+    healthy_only - only map the instances to the load balancers they are healthy behind
+    """
+    index_path = None
+    if relationship_dir is not None:
+        index_path = relationship_index_path(relationship_dir, account_id, region)
+    relationship_index = RelationshipIndex.load(index_path) if index_path else RelationshipIndex()
+    relationship_index.refresh(
+        clients["elbv2"],
+        listed["load_balancers"],
+        listed["v2_load_balancers"],
+        listed["autoscaling_groups"]
+    )
+    if index_path is not None:
+        relationship_index.save(index_path)
+    return relationship_index.instance_to_load_balancers_map(healthy_only=healthy_only)
+
+class ResourceCollector(object):
+    """
+    Declaration of the records of a resource type and of how they are listed
+    Parameters :
+    name - name of the resource type, the inventory file is named after it
+    service - boto3 service name of the client making the call
+    operation - paginated operation listing the records
+    result_key - key of the records in every page
+    field - key the records are stored under in the inventory file, or None when no file is written
+    version - version stored along with the records, or None
+    requires - names of the collectors whose records this one needs
+    annotates - name of the collector whose records this one annotates, or None
+    project - function(records) returning the records with only the fields the
+              inventory is read for, or None when they are kept whole
+    relate - function(clients, account_id, region, listed, relationship_dir, healthy_only)
+             returning the annotations of the collector this one annotates from the
+             listed records of the required collectors, or None
+    annotate - function(records, annotations) returning the records annotated by the
+               collector annotating this one, or None
+    """
+
+    def __init__(self, name, service, operation, result_key, field=None, version=None, requires=(),
+                 project=None, annotates=None, relate=None, annotate=None):
+        self.name = name
+        self.service = service
+        self.operation = operation
+        self.result_key = result_key
+        self.field = field
+        self.version = version
+        self.requires = requires
+        self.project = project
+        self.annotates = annotates
+        self.relate = relate
+        self.annotate = annotate
+
+    @property
+    def output(self):
+        """
+        Whether the records are written to an inventory file
+        """
+        return self.field is not None
+
+    @property
+    def call(self):
+        return self.service + "." + self.operation
+
+    def iter_records(self, clients, **kwargs):
+        """
+        Yields the records page by page
+        Parameters :
+        clients - dictionary of boto3 service name to client of the region
+        kwargs - parameters passed on to the operation, e.g. Filters
+        """
+        return iter_records(clients[self.service], self.operation, self.result_key, **kwargs)
+
+# Collectors by name, in the order their inventory files are written
+COLLECTORS = {collector.name: collector for collector in (
+    ResourceCollector(
+        "instances", "ec2", "describe_instances", "Reservations",
+        field="instances",
+        project=project_reservations,
+        annotate=annotate_reservations
+    ),
+    ResourceCollector(
+        "reservations", "ec2", "describe_reserved_instances", "ReservedInstances",
+        field="reservations"
+    ),
+    ResourceCollector(
+        "load_balancers", "elb", "describe_load_balancers", "LoadBalancerDescriptions",
+        field="load_balancers",
+        version="elb"
+    ),
+    ResourceCollector(
+        "v2_load_balancers", "elbv2", "describe_load_balancers", "LoadBalancers",
+        field="load_balancers",
+        version="elbv2"
+    ),
+    ResourceCollector(
+        "autoscaling_groups", "autoscaling", "describe_auto_scaling_groups", "AutoScalingGroups",
+        field="autoscaling_groups"
+    ),
+    ResourceCollector(
+        "load_balancer_map", "elbv2", "describe_target_health", "TargetHealthDescriptions",
+        requires=("load_balancers", "v2_load_balancers", "autoscaling_groups"),
+        annotates="instances",
+        relate=relate_instances
+    )
+)}
+
+# Inventory files written by the collectors, named after their resource type
+RESOURCE_TYPES = tuple(name for name, collector in COLLECTORS.items() if collector.output)
+
+def parse_resources(value):
+    """
+    Returns the names of a comma separated list of collectors
+    """
+    names = [name.strip() for name in value.split(",") if name.strip()]
+    unknown = sorted(set(names).difference(COLLECTORS))
+    if unknown:
+        raise argparse.ArgumentTypeError(
+            "unknown resources {}, choose from {}".format(", ".join(unknown), ", ".join(COLLECTORS))
+        )
+    return names
+
+class CollectionPlan(object):
+    """
+    Collectors a run needs for the resources it asks for. A collector
+    annotating another one brings that one along, and every collector brings
+    the collectors it requires, which are run but not written unless asked for
+    Parameters :
+    resources - names of the requested collectors, or None for every collector
+    filters - list of (name, values) filters of the calls from parse_filter, or None
+    projection - keep only the fields of the records the inventory is read for
+    """
+
+    def __init__(self, resources=None, filters=None, projection=False):
+        requested = set(COLLECTORS if resources is None else resources)
+        unknown = sorted(requested.difference(COLLECTORS))
+        if unknown:
+            raise ValueError("unknown resources " + ", ".join(unknown))
+        requested.update(
+            COLLECTORS[name].annotates for name in list(requested) if COLLECTORS[name].annotates is not None
+        )
+        self.resources = tuple(name for name in COLLECTORS if name in requested)
+        self.written = tuple(name for name in self.resources if COLLECTORS[name].output)
+        self.annotators = {
+            COLLECTORS[name].annotates: name for name in self.resources if COLLECTORS[name].annotates is not None
+        }
+        self.parameters = {
+            name: {"Filters": collector_filters} for name, collector_filters in call_filters(filters or ()).items()
+        }
+        self.projection = projection
+        self.services = tuple(sorted(
+            set(COLLECTORS[name].service for name in self.needed()),
+            key=REGION_SERVICES.index
+        ))
+
+    def needed(self, completed=None):
+        """
+        Returns the names of the collectors a region needs in registry order:
+        the written ones it did not complete yet, their annotators and every
+        collector these require
+        Parameters :
+        completed - function returning whether the region completed a resource type, or None
+        """
+        needed = set()
+
+        def need(name):
+            if name not in needed:
+                needed.add(name)
+                for required in COLLECTORS[name].requires:
+                    need(required)
+
+        for name in self.written:
+            if completed is not None and completed(name):
+                continue
+            need(name)
+            if name in self.annotators:
+                need(self.annotators[name])
+        return [name for name in COLLECTORS if name in needed]
+
+    @property
+    def calls(self):
+        """
+        Names of the calls the run makes in every region
+        """
+        return [
+            COLLECTORS[name].call + (" filtered" if name in self.parameters else "") for name in self.needed()
+        ]
+
+    def iter_records(self, name, clients):
+        """
+        Yields the records of a collector page by page, filtered and projected as planned
+        """
+        collector = COLLECTORS[name]
+        records = collector.iter_records(clients, **self.parameters.get(name, {}))
+        if self.projection and collector.project is not None:
+            records = collector.project(records)
+        return records
+
+def collect_region(plan, clients, account_id, region, completed=None, relationship_dir=None, healthy_only=False,
+                   executor=None, staged=None):
+    """
+    Runs the collectors of the plan a region needs
+    Returns a list of (collector, records) of every written resource type the
+    region did not complete, in registry order. The records other collectors
+    require are listed up front, concurrently when an executor is given, the
+    others are streamed page by page as they are written
+    Parameters :
+    plan - CollectionPlan of the run
+    clients - dictionary of boto3 service name to client of the region
+    account_id - AWS account id of the region
+    region - AWS region to collect
+    completed - function returning whether the region completed a resource type, or None
+    relationship_dir - directory the RelationshipIndex of the region is kept in between runs, or None
+    healthy_only - only map the instances to the load balancers they are healthy behind
+    executor - ThreadPoolExecutor the required records are listed on, or None to list them in turn
+    staged - function(stage, records) wrapping the fetch and annotate work of the records, or None
+    """
+    if staged is None:
+        def staged(stage, records):
+            return records
+
+    needed = plan.needed(completed)
+    required = set(required for name in needed for required in COLLECTORS[name].requires)
+
+    # Listing the records the annotators need before anything is written
+    listed = {}
+    for name in needed:
+        if name in required:
+            records = staged("fetch", plan.iter_records(name, clients))
+            listed[name] = executor.submit(list, records) if executor is not None else list(records)
+    if executor is not None:
+        listed = {name: future.result() for name, future in listed.items()}
+
+    # Relating the records the annotators annotate
+    annotations = {}
+    for name in needed:
+        collector = COLLECTORS[name]
+        if collector.annotates is not None:
+            annotations[collector.annotates] = collector.relate(
+                clients, account_id, region, listed, relationship_dir, healthy_only
+            )
+
+    outputs = []
+    for name in plan.written:
+        if name not in needed or (completed is not None and completed(name)):
+            continue
+        collector = COLLECTORS[name]
+        records = listed[name] if name in listed else staged("fetch", plan.iter_records(name, clients))
+        if collector.annotate is not None:
+            # Annotated with nothing when the annotator was not asked for
+            records = staged("annotate", collector.annotate(records, annotations.get(name, {})))
+        outputs.append((collector, records))
+    return outputs
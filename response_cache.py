@@ -0,0 +1,230 @@
+"""
+Persistent cache of the responses of the describe calls whose results change
+rarely, such as the region list, reserved instances and target group
+definitions. Responses are kept in a SQLite file keyed by account, region,
+service, operation and parameters, expire after a per-operation TTL and are
+evicted least recently used first once the cache grows past its size bound.
+Cache hits are served from the before-call event of the boto3 clients, so
+they never reach the network. Volatile data such as instances and target
+health is never cached. Responses are stored as JSON with their datetimes as
+ISO 8601 strings, so that reading the cache never runs code out of the file
+"""
+import datetime
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# File the collectors keep the cache in, in the cache directory of the user
+DEFAULT_CACHE_FILE = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"),
+    "inventory",
+    "responses.sqlite"
+)
+
+# Version of the layout of the cache file, files of another version are emptied
+CACHE_VERSION = 2
+
+# Key of the objects standing for a datetime in the stored responses
+DATETIME_KEY = "__datetime__"
+
+# Seconds the response of every cached operation stays fresh
+DEFAULT_TTLS = {
+    "DescribeRegions": 24 * 3600,
+    "DescribeReservedInstances": 6 * 3600,
+    "DescribeTargetGroups": 3600
+}
+
+# Upper bound on the bytes of cached responses
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+def cache_key(account_id, region, service, operation_name, body):
+    """
+    Returns the key of a call, a digest of its account, region, service,
+    operation and serialized parameters
+    """
+    encoded = json.dumps(
+        [account_id, region, service, operation_name, body],
+        sort_keys=True,
+        separators=(",", ":"),
+        default=str
+    )
+    return hashlib.sha1(encoded.encode("utf-8")).hexdigest()
+
+def encode_datetime(value):
+    """
+    Returns the JSON object standing for a datetime of a response
+    """
+    if isinstance(value, datetime.datetime):
+        return {DATETIME_KEY: value.isoformat()}
+    raise TypeError("{} is not JSON serializable".format(type(value).__name__))
+
+def decode_datetime(value):
+    """
+    Returns the datetime a JSON object of encode_datetime stands for, or the object itself
+    """
+    if len(value) == 1 and DATETIME_KEY in value:
+        return datetime.datetime.fromisoformat(value[DATETIME_KEY])
+    return value
+
+def encode_response(parsed):
+    """
+    Returns the JSON bytes of a parsed response
+    """
+    return json.dumps(parsed, default=encode_datetime, separators=(",", ":")).encode("utf-8")
+
+def decode_response(body):
+    """
+    Returns the parsed response of JSON bytes of encode_response
+    """
+    return json.loads(body, object_hook=decode_datetime)
+
+class ResponseCache(object):
+    """
+    SQLite backed response cache shared by the threads of a process. Several
+    processes may use the same file, SQLite serializes their writes
+    Parameters :
+    path - path of the SQLite file, its directory is created when missing
+    ttls - dictionary of operation name to seconds its responses stay fresh,
+           operations missing from it are never cached
+    max_bytes - upper bound on the bytes of cached responses
+    refresh - ignore the cached responses and fetch everything again,
+              still storing the fresh responses
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_FILE, ttls=None, max_bytes=DEFAULT_MAX_BYTES, refresh=False):
+        self.path = path
+        self.ttls = DEFAULT_TTLS if ttls is None else ttls
+        self.max_bytes = max_bytes
+        self.refresh = refresh
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.oldest_hit = None
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        # The processes sharing the file upgrade it one at a time
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            if self.connection.execute("PRAGMA user_version").fetchone()[0] != CACHE_VERSION:
+                self.connection.execute("DROP TABLE IF EXISTS responses")
+                self.connection.execute("PRAGMA user_version = %d" % CACHE_VERSION)
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, operation TEXT, stored REAL, expires REAL, accessed REAL, size INTEGER, "
+                "body BLOB)"
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+            self.connection.execute("COMMIT")
+        except Exception:
+            self.connection.execute("ROLLBACK")
+            raise
+
+    def get(self, key):
+        """
+        Returns the cached parsed response of key, or None when it is missing,
+        expired or refresh is set, keeping the age of the oldest response served
+        """
+        if self.refresh:
+            return None
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT stored, expires, body FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] <= now:
+                self.connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return None
+            self.connection.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self.oldest_hit = max(self.oldest_hit or 0.0, now - row[0])
+        return decode_response(row[2])
+
+    def put(self, key, operation_name, parsed):
+        """
+        Stores a parsed response under key and evicts the least recently used
+        responses while the cache is larger than max_bytes
+        """
+        body = encode_response(parsed)
+        now = time.time()
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses (key, operation, stored, expires, accessed, size, body) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, operation_name, now, now + self.ttls[operation_name], now, len(body), sqlite3.Binary(body))
+            )
+            self.evict()
+
+    def evict(self):
+        """
+        Deletes the expired responses and then the least recently used ones
+        until the cache fits into max_bytes. Called with the lock held
+        """
+        self.connection.execute("DELETE FROM responses WHERE expires <= ?", (time.time(),))
+        total = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        evicted = []
+        for key, size in self.connection.execute("SELECT key, size FROM responses ORDER BY accessed"):
+            if total <= self.max_bytes:
+                break
+            evicted.append((key,))
+            total -= size
+        self.connection.executemany("DELETE FROM responses WHERE key = ?", evicted)
+
+    def instrument(self, client, account_label):
+        """
+        Registers the handlers serving the cached operations of a boto3 client
+        from the cache and storing their fresh responses
+        Parameters :
+        client - boto3 client to serve
+        account_label - function returning the account id of the client
+        """
+        region = client.meta.region_name or ""
+        service = client.meta.service_model.service_name
+
+        def before_call(model, params, context, **kwargs):
+            if model.name not in self.ttls:
+                return None
+            key = cache_key(account_label(), region, service, model.name, params.get("body"))
+            context["response_cache_key"] = key
+            parsed = self.get(key)
+            with self.lock:
+                if parsed is None:
+                    self.misses += 1
+                    return None
+                self.hits += 1
+            context["response_cache_hit"] = True
+            from botocore.awsrequest import AWSResponse
+
+            return AWSResponse(params.get("url"), 200, {}, None), parsed
+
+        def after_call(http_response, parsed, model, context, **kwargs):
+            key = context.get("response_cache_key")
+            if key is None or context.get("response_cache_hit") or http_response.status_code != 200:
+                return
+            self.put(key, model.name, parsed)
+
+        client.meta.events.register("before-call.*.*", before_call)
+        client.meta.events.register("after-call.*.*", after_call)
+
+    def print_summary(self):
+        """
+        Prints the hits and misses of the run and, when cached responses were
+        used, how old the oldest of them was
+        """
+        line = "Response cache {}: {} hits, {} misses".format(self.path, self.hits, self.misses)
+        if self.oldest_hit is not None:
+            line += ", served cached responses up to {:.0f} minutes old, --refresh fetches them again".format(
+                self.oldest_hit / 60.0
+            )
+        print(line)
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
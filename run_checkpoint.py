@@ -0,0 +1,303 @@
+"""
+Checkpoint of a collection run, so that a run that failed in some regions or
+was killed can be resumed without fetching the finished work again or
+duplicating it in the inventory files. Every (account, region, resource
+type) unit is written to a file of its own, atomically through a temporary
+file and a rename, and recorded in a manifest once complete. The inventory
+files are assembled from the units when the run ends, again through a
+rename, so they never hold a partially written region. The units are
+dropped once every unit of the run completed, and the manifest is kept to
+mark the run as complete, so that resuming it starts a new run. The
+manifest only holds the settings of the run, the completed units are
+appended to a journal next to it so that recording a unit does not rewrite
+what was recorded before
+"""
+import binascii
+import json
+import os
+import shutil
+import threading
+
+from inventory_stream import (
+    inventory_file_path,
+    iter_inventory_records,
+    iter_non_empty,
+    open_inventory_file,
+    write_records
+)
+
+# Directory of the checkpoint inside the inventory directory
+CHECKPOINT_DIR_NAME = ".checkpoint"
+
+# Name of the manifest file in the checkpoint directory
+MANIFEST_FILE_NAME = "manifest.json"
+
+# Name of the journal of the completed units in the checkpoint directory, one json line per unit
+UNITS_FILE_NAME = "units.jsonl"
+
+# Version of the manifest layout, a checkpoint of another version is not resumed
+MANIFEST_VERSION = 2
+
+# Permissions new files are created with, before the umask of the process applies
+NEW_FILE_MODE = 0o666
+
+# Keys written next to the records of a unit rather than being part of them
+STAMP_KEYS = ("account_id", "region", "version")
+
+def unit_key(account_id, region, resource_type):
+    return "/".join((account_id, region, resource_type))
+
+def replace_atomically(directory, path, write):
+    """
+    Writes a file through a temporary file in directory renamed over path.
+    The temporary file is created the way open() creates files, so the umask
+    applies to it, and a file that is replaced keeps its permissions
+    Parameters :
+    directory - directory of path, where the temporary file is created
+    path - path of the file
+    write - function writing the content to the temporary file at the path it is given
+    """
+    while True:
+        temporary_path = os.path.join(directory, ".tmp-" + binascii.hexlify(os.urandom(8)).decode("ascii"))
+        try:
+            descriptor = os.open(temporary_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, NEW_FILE_MODE)
+            break
+        except FileExistsError:
+            continue
+    os.close(descriptor)
+    try:
+        write(temporary_path)
+        try:
+            os.chmod(temporary_path, os.stat(path).st_mode & 0o7777)
+        except FileNotFoundError:
+            pass
+        os.replace(temporary_path, path)
+    except BaseException:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
+
+def run_complete(inventory_dir):
+    """
+    Returns whether the manifest of the checkpoint in inventory_dir marks its run as complete
+    """
+    try:
+        with open(os.path.join(inventory_dir, CHECKPOINT_DIR_NAME, MANIFEST_FILE_NAME)) as manifest_file:
+            return bool(json.load(manifest_file).get("complete"))
+    except (IOError, ValueError):
+        return False
+
+class RunCheckpoint(object):
+    """
+    Manifest and unit files of a run writing into inventory_dir. A run is
+    resumed only when the manifest was written for the same output format
+    and compression and did not complete, any other checkpoint is discarded
+    Parameters :
+    inventory_dir - directory the inventory files are written to
+    output_format - format of the inventory files, one of OUTPUT_FORMATS
+    compression - compression of the inventory files, one of COMPRESSIONS or None
+    resume - keep the units completed by the previous run instead of starting over
+    """
+
+    def __init__(self, inventory_dir, output_format="json", compression=None, resume=False):
+        self.inventory_dir = inventory_dir
+        self.output_format = output_format
+        self.compression = compression
+        self.directory = os.path.join(inventory_dir, CHECKPOINT_DIR_NAME)
+        self.manifest_path = os.path.join(self.directory, MANIFEST_FILE_NAME)
+        self.units_path = os.path.join(self.directory, UNITS_FILE_NAME)
+        self.lock = threading.Lock()
+        self.manifest = None
+        if resume:
+            self.manifest = self.read_manifest()
+            if self.manifest is not None and (
+                self.manifest.get("version") != MANIFEST_VERSION or
+                self.manifest.get("output_format") != output_format or
+                self.manifest.get("compression") != compression
+            ):
+                print("Not resuming the checkpoint in {}, it was written in another format".format(self.directory))
+                self.manifest = None
+            elif self.manifest is not None and self.manifest.get("complete"):
+                print("The previous run in {} is complete, starting a new run".format(inventory_dir))
+                self.manifest = None
+        if self.manifest is None:
+            if os.path.isdir(self.directory):
+                shutil.rmtree(self.directory)
+            os.makedirs(self.directory)
+            self.manifest = {
+                "version": MANIFEST_VERSION,
+                "output_format": output_format,
+                "compression": compression,
+                "complete": False,
+                "units": {}
+            }
+            self.write_manifest()
+
+    def read_manifest(self):
+        """
+        Returns the manifest with the units of the journal, or None when there is no readable manifest
+        """
+        try:
+            with open(self.manifest_path) as manifest_file:
+                manifest = json.load(manifest_file)
+        except (IOError, ValueError):
+            return None
+        manifest["units"] = {}
+        try:
+            with open(self.units_path) as units_file:
+                for line in units_file:
+                    try:
+                        unit = json.loads(line)
+                    except ValueError:
+                        # A line of a killed run may be partially written, its unit is fetched again
+                        continue
+                    manifest["units"][unit["key"]] = {"file": unit["file"], "records": unit["records"]}
+        except IOError:
+            pass
+        return manifest
+
+    def write_manifest(self):
+        """
+        Writes the manifest without its units, which are kept in the journal
+        """
+        settings = {key: value for key, value in self.manifest.items() if key != "units"}
+        encoded = json.dumps(settings, indent=2, sort_keys=True).encode("utf-8")
+
+        def write(path):
+            with open(path, "wb") as manifest_file:
+                manifest_file.write(encoded)
+        replace_atomically(self.directory, self.manifest_path, write)
+
+    @property
+    def complete(self):
+        """
+        Whether every unit of the run completed and the inventory files were assembled
+        """
+        return self.manifest["complete"]
+
+    def completed(self, account_id, region, resource_type):
+        """
+        Returns whether a unit was completed by this run or the one it resumes
+        """
+        return self.complete or unit_key(account_id, region, resource_type) in self.manifest["units"]
+
+    def unit_path(self, account_id, region, resource_type):
+        """
+        Returns the path of the file of a unit
+        """
+        return inventory_file_path(
+            os.path.join(self.directory, "units", account_id, region, resource_type + ".json"),
+            self.output_format,
+            self.compression
+        )
+
+    def write_unit(self, account_id, region, resource_type, field, records, before, after=(), serializer=None):
+        """
+        Writes the records of a unit in the format of the inventory file of
+        the resource type and records the unit as complete. Nothing but the
+        manifest entry is written when there are no records
+        Returns the number of records written
+        Parameters :
+        account_id - AWS account id of the records
+        region - AWS region of the records
+        resource_type - name of the inventory file of the records, e.g. v2_load_balancers
+        field - key the records are stored under
+        records - iterable of the records
+        before - list of (key, value) pairs written before the records
+        after - list of (key, value) pairs written after the records
+        serializer - serializer backend, one of SERIALIZER_NAMES or None for the fastest installed one
+        """
+        records = iter_non_empty(records)
+        count = 0
+        path = None
+        if records is not None:
+            path = self.unit_path(account_id, region, resource_type)
+            directory = os.path.dirname(path)
+            # The units of a region are written by concurrent threads
+            os.makedirs(directory, exist_ok=True)
+            counts = []
+
+            def write(temporary_path):
+                with open_inventory_file(temporary_path, "w+", self.compression) as unit_file:
+                    counts.append(write_records(
+                        unit_file, self.output_format, field, records, before, after, serializer
+                    ))
+            replace_atomically(directory, path, write)
+            count = counts[0]
+            path = os.path.relpath(path, self.directory)
+        key = unit_key(account_id, region, resource_type)
+        line = json.dumps({"key": key, "file": path, "records": count}, sort_keys=True) + "\n"
+        with self.lock:
+            self.manifest["units"][key] = {"file": path, "records": count}
+            with open(self.units_path, "a") as units_file:
+                units_file.write(line)
+        return count
+
+    def iter_unit_records(self, account_id, region, resource_type, field):
+        """
+        Yields the records of a completed unit as they were written, without
+        the account_id, region and version keys written next to them
+        """
+        unit = self.manifest["units"].get(unit_key(account_id, region, resource_type))
+        if unit is None or unit["file"] is None:
+            return
+        for record in iter_inventory_records(os.path.join(self.directory, unit["file"]), field):
+            for key in STAMP_KEYS:
+                record.pop(key, None)
+            yield record
+
+    def assemble(self, account_id, regions, resource_types):
+        """
+        Replaces the inventory file of every resource type with the
+        concatenation of its completed units in region order, and removes the
+        inventory files no unit has records for
+        Parameters :
+        account_id - AWS account id of the run
+        regions - AWS regions of the run, in the order their records are written
+        resource_types - names of the inventory files, e.g. instances
+        """
+        for resource_type in resource_types:
+            path = inventory_file_path(
+                os.path.join(self.inventory_dir, resource_type + ".json"),
+                self.output_format,
+                self.compression
+            )
+            unit_paths = []
+            for region in regions:
+                unit = self.manifest["units"].get(unit_key(account_id, region, resource_type))
+                if unit is not None and unit["file"] is not None:
+                    unit_paths.append(os.path.join(self.directory, unit["file"]))
+            if not unit_paths:
+                if os.path.exists(path):
+                    os.remove(path)
+                continue
+
+            def write(temporary_path):
+                with open(temporary_path, "wb") as inventory_file:
+                    for unit_path in unit_paths:
+                        with open(unit_path, "rb") as unit_file:
+                            shutil.copyfileobj(unit_file, inventory_file)
+            replace_atomically(self.inventory_dir, path, write)
+
+    def finish(self, account_id, regions, resource_types):
+        """
+        Marks the run as complete and drops the unit files when every unit of
+        the regions and resource types completed
+        Returns whether the run is complete
+        """
+        missing = [
+            (region, resource_type)
+            for region in regions
+            for resource_type in resource_types
+            if not self.completed(account_id, region, resource_type)
+        ]
+        if missing:
+            return False
+        with self.lock:
+            self.manifest["complete"] = True
+            self.manifest["units"] = {}
+            self.write_manifest()
+            if os.path.exists(self.units_path):
+                os.remove(self.units_path)
+        shutil.rmtree(os.path.join(self.directory, "units"), ignore_errors=True)
+        return True
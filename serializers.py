@@ -0,0 +1,101 @@
+"""
+Serializer backends encoding the inventory records straight to JSON bytes.
+orjson and msgspec encode datetimes and decimals natively in C and are
+picked when installed, the json module of the standard library is the
+fallback. Every backend writes datetimes as ISO 8601 timestamps that
+datetime.fromisoformat reads back, decimals as JSON numbers and fails on
+values it can not encode rather than writing them as null
+"""
+import datetime
+import decimal
+import json
+
+# Serializer backends, in the order they are picked when none is asked for
+SERIALIZER_NAMES = ("orjson", "msgspec", "json")
+
+# Serializers already built, by name
+_SERIALIZERS = {}
+
+def encode_default(value):
+    """
+    Returns a JSON serializable replacement of a value the backends do not
+    encode natively: ISO 8601 text for dates and times and a number for decimals
+    """
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    raise TypeError("Object of type {} is not JSON serializable".format(type(value).__name__))
+
+class JsonSerializer(object):
+    """
+    Serializer using the json module of the standard library
+    """
+
+    name = "json"
+
+    def __init__(self):
+        self.encoder = json.JSONEncoder(default=encode_default, ensure_ascii=False, separators=(",", ":"))
+
+    def encode(self, value):
+        return self.encoder.encode(value).encode("utf-8")
+
+class OrjsonSerializer(object):
+    """
+    Serializer using orjson, which encodes datetimes natively
+    """
+
+    name = "orjson"
+
+    def __init__(self):
+        import orjson
+        self.dumps = orjson.dumps
+
+    def encode(self, value):
+        return self.dumps(value, default=encode_default)
+
+class MsgspecSerializer(object):
+    """
+    Serializer using msgspec, which encodes datetimes and decimals natively
+    """
+
+    name = "msgspec"
+
+    def __init__(self):
+        import msgspec
+        self.encoder = msgspec.json.Encoder(enc_hook=encode_default, decimal_format="number")
+
+    def encode(self, value):
+        return self.encoder.encode(value)
+
+# Serializer classes by name
+SERIALIZER_CLASSES = {
+    "orjson": OrjsonSerializer,
+    "msgspec": MsgspecSerializer,
+    "json": JsonSerializer
+}
+
+def get_serializer(name=None):
+    """
+    Returns the serializer of a backend, or of the first installed one of
+    SERIALIZER_NAMES when name is None
+    Parameters :
+    name - one of SERIALIZER_NAMES, or None
+    """
+    serializer = _SERIALIZERS.get(name)
+    if serializer is not None:
+        return serializer
+    if name is None:
+        for candidate in SERIALIZER_NAMES:
+            try:
+                serializer = get_serializer(candidate)
+                break
+            except RuntimeError:
+                continue
+    else:
+        try:
+            serializer = SERIALIZER_CLASSES[name]()
+        except ImportError:
+            raise RuntimeError("the {0} serializer needs the {0} package".format(name))
+    _SERIALIZERS[name] = serializer
+    return serializer
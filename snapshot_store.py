@@ -0,0 +1,221 @@
+"""
+Keeps the records of the previous run indexed by resource id so that every
+run only writes the records that were added, removed or changed as a delta
+file, next to a compacted current view of every resource type
+"""
+import datetime
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+from run_checkpoint import replace_atomically
+from serializers import encode_default, get_serializer
+
+# Key identifying the records of every resource type
+RESOURCE_ID_KEYS = {
+    "instances": "InstanceId",
+    "reservations": "ReservedInstancesId",
+    "load_balancers": "LoadBalancerName",
+    "v2_load_balancers": "LoadBalancerArn",
+    "autoscaling_groups": "AutoScalingGroupARN"
+}
+
+# Classic load balancer names are only unique within an account and region
+SCOPED_RESOURCE_TYPES = ("load_balancers",)
+
+def record_digest(record):
+    """
+    Returns a digest of the record that changes whenever any of its fields does
+    Parameters :
+    record - resource record to digest
+    """
+    encoded = json.dumps(record, sort_keys=True, separators=(",", ":"), default=encode_default)
+    return hashlib.sha1(encoded.encode("utf-8")).hexdigest()
+
+class SnapshotStore(object):
+    """
+    Snapshot of the inventory in a directory holding, per resource type,
+    <resource>.index.json - resource id to [digest, account_id, region]
+    <resource>.current.ndjson - the latest record of every resource
+    <resource>.delta.<run_id>.ndjson - the changes made by every run
+    Records are tracked while the collectors stream them and the snapshot is
+    only updated by commit, for the (account, region) scopes whose records
+    were read to the end
+    Parameters :
+    directory - directory of the snapshot, created when missing
+    serializer - name of one of the SERIALIZER_NAMES, or None for the fastest installed one
+    """
+
+    def __init__(self, directory, serializer=None):
+        self.directory = directory
+        self.encode = get_serializer(serializer).encode
+        self.run_id = datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+        self.lock = threading.Lock()
+        self.completed_scopes = {}
+        self.observed = {}
+        self.observed_files = {}
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def path(self, resource_type, kind):
+        """
+        Returns the path of one of the files kept for a resource type
+        Parameters :
+        resource_type - one of RESOURCE_ID_KEYS
+        kind - index, current or delta
+        """
+        if kind == "index":
+            return os.path.join(self.directory, resource_type + ".index.json")
+        if kind == "current":
+            return os.path.join(self.directory, resource_type + ".current.ndjson")
+        return os.path.join(self.directory, "{}.delta.{}.ndjson".format(resource_type, self.run_id))
+
+    def resource_id(self, resource_type, record, account_id, region):
+        """
+        Returns the id of the record, qualified by account and region when the
+        resource type is not identified by an ARN or a globally unique id
+        """
+        resource_id = record[RESOURCE_ID_KEYS[resource_type]]
+        if resource_type in SCOPED_RESOURCE_TYPES:
+            return "{}:{}:{}".format(account_id, region, resource_id)
+        return resource_id
+
+    def track(self, resource_type, account_id, region, records):
+        """
+        Yields the records unchanged while recording them for the snapshot.
+        Reservations are tracked per instance. The scope only counts as
+        collected once the records were read to the end
+        Parameters :
+        resource_type - one of RESOURCE_ID_KEYS
+        account_id - AWS account id the records belong to
+        region - AWS region the records were fetched from
+        records - iterable of the records
+        """
+        for record in records:
+            if resource_type == "instances":
+                for instance in record["Instances"]:
+                    snapshot_record = dict(instance)
+                    snapshot_record["ReservationId"] = record.get("ReservationId")
+                    self.observe(resource_type, account_id, region, snapshot_record)
+            else:
+                self.observe(resource_type, account_id, region, record)
+            yield record
+        with self.lock:
+            self.completed_scopes.setdefault(resource_type, set()).add((account_id, region))
+
+    def observe(self, resource_type, account_id, region, record):
+        """
+        Records the digest of a record and spools it for the current view
+        """
+        resource_id = self.resource_id(resource_type, record, account_id, region)
+        line = self.encode({"account_id": account_id, "region": region, "id": resource_id, "record": record})
+        digest = record_digest(record)
+        with self.lock:
+            observed_file = self.observed_files.get(resource_type)
+            if observed_file is None:
+                observed_file = tempfile.TemporaryFile("w+b", dir=self.directory)
+                self.observed_files[resource_type] = observed_file
+            observed_file.write(line + b"\n")
+            self.observed.setdefault(resource_type, {})[resource_id] = [digest, account_id, region]
+
+    def load_index(self, resource_type):
+        """
+        Returns the index written by the previous run of the resource type
+        """
+        try:
+            with open(self.path(resource_type, "index")) as index_file:
+                return json.load(index_file)
+        except IOError:
+            return {}
+
+    def commit(self):
+        """
+        Writes the delta of this run and the updated current view and index of
+        every resource type that changed within the collected scopes
+        Returns a dictionary of resource type to (added, removed, changed) counts
+        """
+        summary = {}
+        for resource_type in RESOURCE_ID_KEYS:
+            scopes = self.completed_scopes.get(resource_type, set())
+            if scopes:
+                summary[resource_type] = self.commit_resource_type(resource_type, scopes)
+        for observed_file in self.observed_files.values():
+            observed_file.close()
+        self.observed_files = {}
+        return summary
+
+    def commit_resource_type(self, resource_type, scopes):
+        """
+        Commits a single resource type, see commit
+        Parameters :
+        resource_type - one of RESOURCE_ID_KEYS
+        scopes - set of (account_id, region) whose records were read to the end
+        """
+        previous_index = self.load_index(resource_type)
+        observed = {
+            resource_id: entry
+            for resource_id, entry in self.observed.get(resource_type, {}).items()
+            if (entry[1], entry[2]) in scopes
+        }
+        added = [resource_id for resource_id in observed if resource_id not in previous_index]
+        changed = [
+            resource_id for resource_id, entry in observed.items()
+            if resource_id in previous_index and previous_index[resource_id][0] != entry[0]
+        ]
+        removed = [
+            resource_id for resource_id, entry in previous_index.items()
+            if (entry[1], entry[2]) in scopes and resource_id not in observed
+        ]
+        if not (added or changed or removed):
+            return (0, 0, 0)
+
+        kinds = dict.fromkeys(added, "added")
+        kinds.update(dict.fromkeys(changed, "changed"))
+        observed_file = self.observed_files.get(resource_type)
+        current_path = self.path(resource_type, "current")
+
+        def write_current(temporary_path):
+            with open(self.path(resource_type, "delta"), "wb") as delta_file, \
+                    open(temporary_path, "wb") as current_file:
+                # Records of scopes that were not collected this run are carried over
+                if os.path.exists(current_path):
+                    with open(current_path, "rb") as previous_file:
+                        for line in previous_file:
+                            entry = json.loads(line)
+                            if (entry["account_id"], entry["region"]) not in scopes:
+                                current_file.write(line)
+                if observed_file is not None:
+                    observed_file.seek(0)
+                    for line in observed_file:
+                        entry = json.loads(line)
+                        if (entry["account_id"], entry["region"]) not in scopes:
+                            continue
+                        current_file.write(line)
+                        kind = kinds.get(entry["id"])
+                        if kind is not None:
+                            entry["change"] = kind
+                            delta_file.write(self.encode(entry) + b"\n")
+                for resource_id in removed:
+                    entry = previous_index[resource_id]
+                    delta_file.write(self.encode({
+                        "account_id": entry[1],
+                        "region": entry[2],
+                        "id": resource_id,
+                        "change": "removed"
+                    }) + b"\n")
+        replace_atomically(self.directory, current_path, write_current)
+
+        index = {
+            resource_id: entry
+            for resource_id, entry in previous_index.items()
+            if (entry[1], entry[2]) not in scopes
+        }
+        index.update(observed)
+
+        def write_index(temporary_path):
+            with open(temporary_path, "w") as index_file:
+                json.dump(index, index_file)
+        replace_atomically(self.directory, self.path(resource_type, "index"), write_index)
+        return (len(added), len(removed), len(changed))
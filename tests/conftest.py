@@ -0,0 +1,8 @@
+"""
+Puts the modules of the repository, which are not installed as a package, on
+the import path of the tests
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,20 @@
+"""
+Checks which inventory file columnar_export reads when several formats were written
+"""
+import os
+
+import columnar_export
+
+def test_most_recently_modified_inventory_file_is_found(tmp_path):
+    assert columnar_export.find_inventory_file(str(tmp_path), "instances") is None
+
+    stale_path = str(tmp_path / "instances.json")
+    current_path = str(tmp_path / "instances.ndjson.gz")
+    for path in (stale_path, current_path):
+        with open(path, "w"):
+            pass
+    os.utime(stale_path, ns=(1000000000, 1000000000))
+
+    assert columnar_export.find_inventory_file(str(tmp_path), "instances") == current_path
+    os.utime(current_path, ns=(0, 0))
+    assert columnar_export.find_inventory_file(str(tmp_path), "instances") == stale_path
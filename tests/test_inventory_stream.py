@@ -0,0 +1,83 @@
+"""
+Checks the pagination of inventory_stream against a synthetic fleet
+"""
+import boto3
+
+import inventory_stream
+import mock_aws
+
+def test_paginated_instances_are_the_unpaginated_ones():
+    fleet = mock_aws.SyntheticFleet(region_count=1, instance_count=100000)
+    with fleet.serve():
+        ec2 = boto3.session.Session().client("ec2", region_name=fleet.regions[0])
+        paginated = list(inventory_stream.iter_records(ec2, "describe_instances", "Reservations"))
+        pages = fleet.calls[("ec2", "DescribeInstances")]
+        unpaginated = inventory_stream.call_with_retries(
+            ec2,
+            "describe_instances",
+            MaxResults=fleet.instance_count
+        )["Reservations"]
+
+    assert pages == fleet.instance_count // mock_aws.DEFAULT_PAGE_SIZES["DescribeInstances"]
+    assert len(paginated) == fleet.instance_count
+    assert paginated == unpaginated
+
+def test_pages_keep_the_parameters_of_the_call():
+    fleet = mock_aws.SyntheticFleet(region_count=1, instance_count=5000)
+    with fleet.serve():
+        ec2 = boto3.session.Session().client("ec2", region_name=fleet.regions[0])
+        instance_types = {
+            reservation["Instances"][0]["InstanceType"]
+            for reservation in inventory_stream.iter_records(
+                ec2,
+                "describe_instances",
+                "Reservations",
+                Filters=[{"Name": "instance-type", "Values": ["m5.large"]}],
+                MaxResults=500
+            )
+        }
+
+    assert fleet.calls[("ec2", "DescribeInstances")] == 10
+    assert instance_types == {"m5.large"}
+
+def test_operations_without_paginator_are_called_once():
+    fleet = mock_aws.SyntheticFleet(region_count=1, target_group_count=4)
+    with fleet.serve():
+        elbv2 = boto3.session.Session().client("elbv2", region_name=fleet.regions[0])
+        target_group_arn = fleet.region_fleets[fleet.regions[0]].target_group(0)["TargetGroupArn"]
+        pages = list(inventory_stream.iter_pages(
+            elbv2,
+            "describe_target_health",
+            "TargetHealthDescriptions",
+            TargetGroupArn=target_group_arn
+        ))
+
+    assert len(pages) == 1
+    assert fleet.call_count() == 1
+
+def test_json_inventory_files_are_read_a_region_at_a_time(tmp_path):
+    fleet = mock_aws.SyntheticFleet(region_count=3, instance_count=3000)
+    path = str(tmp_path / "instances.json")
+    documents = []
+    with open(path, "wb") as inventory_file:
+        for region, region_fleet in sorted(fleet.region_fleets.items()):
+            reservations = [
+                {"ReservationId": "r-%d" % index, "Instances": [region_fleet.instance(index)]}
+                for index in range(region_fleet.instance_count)
+            ]
+            before = [("account_id", mock_aws.DEFAULT_ACCOUNT_ID), ("region", region)]
+            after = [("version", "1")]
+            inventory_stream.write_records(inventory_file, "json", "instances", reservations, before, after)
+            inventory_file.write(b"\n")
+            documents.append(dict(before + after))
+
+    with open(path, encoding="utf-8") as inventory_file:
+        assert len(inventory_file.read()) > 2 * 1024 * 1024
+    records = list(inventory_stream.iter_inventory_records(path, "instances"))
+
+    assert len(records) == fleet.instance_count
+    assert {(record["region"], record["version"]) for record in records} == {
+        (document["region"], "1") for document in documents
+    }
+    assert records[0]["Instances"][0]["InstanceId"] == fleet.region_fleets[fleet.regions[0]].instance_id(0)
+    assert records[-1]["Instances"][0]["LaunchTime"] == mock_aws.LAUNCH_TIME.isoformat()
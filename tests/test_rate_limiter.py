@@ -0,0 +1,24 @@
+"""
+Checks that pages throttled past the attempts of botocore are asked for again
+without being lost or duplicated
+"""
+from unittest import mock
+
+import client_pool
+import inventory_stream
+import mock_aws
+import rate_limiter
+
+def test_throttled_pages_are_neither_lost_nor_duplicated():
+    fleet = mock_aws.SyntheticFleet(region_count=1, instance_count=20000, throttle_rate=0.3, quota=1000)
+    with fleet.serve(), mock.patch.object(inventory_stream, "PAGE_RETRY_BACKOFF", 0.001):
+        pool = client_pool.ClientPool(max_attempts=1, rate_limiter=rate_limiter.AdaptiveRateLimiter())
+        ec2 = pool.client("ec2", fleet.regions[0])
+        instance_ids = [
+            reservation["Instances"][0]["InstanceId"]
+            for reservation in inventory_stream.iter_records(ec2, "describe_instances", "Reservations")
+        ]
+
+    region_fleet = fleet.region_fleets[fleet.regions[0]]
+    assert fleet.throttles > 0
+    assert instance_ids == [region_fleet.instance_id(index) for index in range(region_fleet.instance_count)]
@@ -0,0 +1,51 @@
+"""
+Checks the incremental refreshes of relationship_index against a synthetic fleet
+"""
+import os
+import stat
+
+import client_pool
+import inventory_stream
+import mock_aws
+import relationship_index
+
+def test_target_groups_of_a_deleted_autoscaling_group_are_refreshed():
+    fleet = mock_aws.SyntheticFleet(
+        region_count=1, instance_count=100, load_balancer_count=0, v2_load_balancer_count=4,
+        target_group_count=8, autoscaling_group_count=4
+    )
+    with fleet.serve():
+        pool = client_pool.ClientPool()
+        elbv2 = pool.client("elbv2", fleet.regions[0])
+        autoscaling = pool.client("autoscaling", fleet.regions[0])
+        v2_load_balancers = list(inventory_stream.iter_records(elbv2, "describe_load_balancers", "LoadBalancers"))
+        autoscaling_groups = list(inventory_stream.iter_records(
+            autoscaling, "describe_auto_scaling_groups", "AutoScalingGroups"
+        ))
+        target_group_arns = sorted(
+            target_group["TargetGroupArn"] for target_group in relationship_index.list_target_groups(elbv2)
+        )
+        for group_index, autoscaling_group in enumerate(autoscaling_groups):
+            autoscaling_group["TargetGroupARNs"] = target_group_arns[2 * group_index:2 * group_index + 2]
+
+        index = relationship_index.RelationshipIndex()
+        assert index.refresh(elbv2, [], v2_load_balancers, autoscaling_groups) == len(target_group_arns)
+        assert index.refresh(elbv2, [], v2_load_balancers, autoscaling_groups) == 0
+
+        deleted = autoscaling_groups.pop(0)
+        calls = fleet.calls[("elastic-load-balancing-v2", "DescribeTargetHealth")]
+        assert index.refresh(elbv2, [], v2_load_balancers, autoscaling_groups) == len(deleted["TargetGroupARNs"])
+        assert fleet.calls[("elastic-load-balancing-v2", "DescribeTargetHealth")] - calls == 2
+        for instance in deleted["Instances"]:
+            assert index.instance_autoscaling_groups(instance["InstanceId"]) == []
+
+def test_saved_index_gets_the_permissions_of_the_umask(tmp_path):
+    path = str(tmp_path / "index.json")
+    previous_umask = os.umask(0o022)
+    try:
+        relationship_index.RelationshipIndex().save(path)
+    finally:
+        os.umask(previous_umask)
+
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o644
+    assert relationship_index.RelationshipIndex.load(path).edges == {}
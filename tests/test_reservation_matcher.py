@@ -0,0 +1,68 @@
+"""
+Checks the hash indexes of reservation_matcher against the nested scan of
+benchmark_inventory over the instances and reservations of synthetic fleets
+"""
+import pytest
+
+import mock_aws
+import reservation_matcher
+from benchmark_inventory import nested_scan_match
+
+def fleet_rows(fleet):
+    """
+    Returns the (instance rows, reservation rows) of a fleet in the shape
+    reservation_matcher.match_instances takes them
+    """
+    instances = []
+    reservations = []
+    for region, region_fleet in sorted(fleet.region_fleets.items()):
+        for local_index in range(region_fleet.instance_count):
+            instance = region_fleet.instance(local_index)
+            instances.append((
+                mock_aws.DEFAULT_ACCOUNT_ID,
+                region,
+                instance["Placement"]["AvailabilityZone"],
+                instance["InstanceType"],
+                instance.get("Platform"),
+                instance["Placement"]["Tenancy"]
+            ))
+        for index in range(region_fleet.reservation_count):
+            reserved_instance = region_fleet.reserved_instance(index)
+            reservations.append((
+                mock_aws.DEFAULT_ACCOUNT_ID,
+                region,
+                reserved_instance["AvailabilityZone"],
+                reserved_instance["Scope"],
+                reserved_instance["InstanceType"],
+                reserved_instance["ProductDescription"],
+                reserved_instance["InstanceTenancy"],
+                reserved_instance["InstanceCount"]
+            ))
+    return instances, reservations
+
+@pytest.mark.parametrize("instance_count,reservation_count", [(1000, 50), (5000, 400), (2000, 2000)])
+def test_indexed_matcher_covers_the_instances_the_nested_scan_covers(instance_count, reservation_count):
+    fleet = mock_aws.SyntheticFleet(region_count=4, instance_count=instance_count, reservation_count=reservation_count)
+    instances, reservations = fleet_rows(fleet)
+
+    covered = reservation_matcher.match_instances(instances, reservations)
+
+    assert covered == nested_scan_match(instances, reservations)
+    assert len(covered) == instance_count
+    assert any(covered)
+
+def test_zonal_reservations_only_cover_their_zone():
+    reservations = [
+        ("1", "us-east-1", None, "Region", "m5.large", "Linux/UNIX", "default", 1),
+        ("1", "us-east-1", "us-east-1a", reservation_matcher.ZONAL_SCOPE, "m5.large", "Linux/UNIX", "default", 1)
+    ]
+    instances = [
+        ("1", "us-east-1", "us-east-1b", "m5.large", None, "default"),
+        ("1", "us-east-1", "us-east-1a", "m5.large", None, "default"),
+        ("1", "us-east-1", "us-east-1a", "m5.large", None, "default")
+    ]
+
+    covered = reservation_matcher.match_instances(instances, reservations)
+
+    assert covered == [True, True, False]
+    assert covered == nested_scan_match(instances, reservations)
@@ -0,0 +1,42 @@
+"""
+Checks that the response cache stores the responses as JSON and serves them
+back with their datetimes
+"""
+import sqlite3
+
+import mock_aws
+import response_cache
+
+def test_responses_are_stored_as_json_and_served_with_their_datetimes(tmp_path):
+    path = str(tmp_path / "cache" / "responses.sqlite")
+    fleet = mock_aws.SyntheticFleet(region_count=1)
+    region_fleet = fleet.region_fleets[fleet.regions[0]]
+    parsed = {"ReservedInstances": [region_fleet.reserved_instance(index) for index in range(3)]}
+
+    cache = response_cache.ResponseCache(path)
+    cache.put("key", "DescribeReservedInstances", parsed)
+    cache.close()
+    cache = response_cache.ResponseCache(path)
+    cached = cache.get("key")
+    cache.close()
+
+    assert cached == parsed
+    assert cache.oldest_hit is not None
+    connection = sqlite3.connect(path)
+    body = connection.execute("SELECT body FROM responses").fetchone()[0]
+    connection.close()
+    assert bytes(body).startswith(b'{"ReservedInstances":')
+    assert mock_aws.LAUNCH_TIME.isoformat().encode("utf-8") in bytes(body)
+
+def test_caches_of_another_version_are_emptied(tmp_path):
+    path = str(tmp_path / "responses.sqlite")
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE responses (key TEXT PRIMARY KEY, expires REAL, body BLOB)")
+    connection.execute("INSERT INTO responses VALUES ('key', 1e12, X'80')")
+    connection.commit()
+    connection.close()
+
+    cache = response_cache.ResponseCache(path)
+
+    assert cache.get("key") is None
+    cache.close()
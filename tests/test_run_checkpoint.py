@@ -0,0 +1,53 @@
+"""
+Checks the permissions of the files run_checkpoint writes and that resuming
+a complete run starts a new one
+"""
+import os
+import stat
+
+import fetch_inventory
+import inventory_stream
+import mock_aws
+import run_checkpoint
+
+def write_text(text):
+    def write(path):
+        with open(path, "w") as output_file:
+            output_file.write(text)
+    return write
+
+def test_new_files_get_the_permissions_of_the_umask(tmp_path):
+    previous_umask = os.umask(0o027)
+    try:
+        path = str(tmp_path / "instances.json")
+        run_checkpoint.replace_atomically(str(tmp_path), path, write_text("{}"))
+    finally:
+        os.umask(previous_umask)
+
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o640
+    assert os.listdir(str(tmp_path)) == ["instances.json"]
+
+def test_replaced_files_keep_their_permissions(tmp_path):
+    path = str(tmp_path / "instances.json")
+    run_checkpoint.replace_atomically(str(tmp_path), path, write_text("{}"))
+    os.chmod(path, 0o604)
+
+    run_checkpoint.replace_atomically(str(tmp_path), path, write_text("[]"))
+
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o604
+    with open(path) as replaced_file:
+        assert replaced_file.read() == "[]"
+
+def test_resuming_a_complete_run_starts_a_new_run(tmp_path):
+    inventory_dir = str(tmp_path / "inventory")
+    fleet = mock_aws.SyntheticFleet(region_count=2, instance_count=200)
+    with fleet.serve():
+        assert fetch_inventory.fetch_data(inventory_dir=inventory_dir, resume=True)
+        first_run_calls = fleet.calls[("ec2", "DescribeInstances")]
+        assert run_checkpoint.run_complete(inventory_dir)
+
+        assert fetch_inventory.fetch_data(inventory_dir=inventory_dir, resume=True)
+
+    assert fleet.calls[("ec2", "DescribeInstances")] == 2 * first_run_calls
+    reservations = inventory_stream.iter_inventory_records(os.path.join(inventory_dir, "instances.json"), "instances")
+    assert sum(len(reservation["Instances"]) for reservation in reservations) == fleet.instance_count